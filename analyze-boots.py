@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that reports how long each
+phase of the pxe boots of the managed hosts took, from the events
+logged in the current, rotated and compressed system events files
+(syslog).  It only reads the logs, no services or root configuration
+files are changed.
+"""
+import argparse
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    analyze_boots, \
+    load_host_registration, \
+    setup_script_logging
+
+
+usage_msg = """Report the boot timeline of each pxe boot logged in the
+system events files, and percentile latency tables of each boot phase
+(DHCPDISCOVER, DHCPACK, pxelinux RRQ, initrd RRQ, kickstart fetch) over
+all hosts and per profile.  By default the current and rotated
+system_event_file (including .gz archives) are read, each file in its
+own process.  Give the apache access log as well if apache does not
+log its requests to syslog, so kickstart fetches are seen.
+"""
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='analyze-boots', description=usage_msg)
+    parser.add_argument('files', metavar='FILE', type=str, nargs='*',
+                        help='system events files to read, plain or .gz, by default the current and rotated syslog')
+    parser.add_argument('--host', dest='hostnames', metavar='HOSTNAME', action='append',
+                        help='only report the boots of this host (name or mac address), may be repeated')
+    parser.add_argument('--profile', type=str,
+                        help='only report the boots of hosts with this profile')
+    parser.add_argument('-s', '--summary', action='store_true',
+                        help='only print the latency tables, not the timeline of every boot')
+    parser.add_argument('-j', '--processes', type=int,
+                        help='most files read at once, by default one per cpu')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. read in and determine database of currently registered hosts,
+    #    used to name the booting hosts
+    load_host_registration()
+
+    # 2. scan the logs and report the boots
+    analyze_boots(args.files, args.hostnames, args.profile, args.processes,
+                  timelines=not args.summary)
+
+
+if __name__ == "__main__":
+    main()
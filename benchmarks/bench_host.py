@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+"""Memory and throughput benchmark of the slotted Host record against
+the dict based Host class it replaced, for a registry of 100k hosts.
+
+Run from the top of the repository:
+
+    python benchmarks/bench_host.py [number of hosts]
+
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pxemanage as pm
+
+
+class LegacyHost(dict):
+    """The dict based Host class as it was before it was slotted."""
+    def __init__(self, hostname, macaddress="unknown",
+                 ipaddress="unknown", profile="default",
+                 status=pm.status.RUNNING):
+        self.hostname = hostname
+        self.macaddress = macaddress
+        self.ipaddress = ipaddress
+        self.profile = profile
+        self.status = status
+
+    def __getattr__(self, name):
+        return self.__getitem__(name)
+
+
+def legacy_lookup_host_by_mac(hosts, macaddress):
+    """lookup_host_by_mac as it was before it compared integers."""
+    for hostname in hosts:
+        if hosts[hostname].macaddress == macaddress:
+            return hostname
+    return None
+
+
+def host_fields(n):
+    """Return the fields of the nth benchmark host."""
+    return (f"cloud{n:06d}",
+            f"02:00:00:{(n >> 16) & 255:02x}:{(n >> 8) & 255:02x}:{n & 255:02x}",
+            f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}",
+            "compute")
+
+
+def build(host_class, count):
+    """Build a registry of count hosts, returning it with the time taken
+    and the memory it uses.  The memory is measured in a separate build
+    so that tracing does not slow down the timed build.
+    """
+    def build_hosts():
+        hosts = {}
+        for n in range(count):
+            fields = host_fields(n)
+            hosts[fields[0]] = host_class(*fields)
+        return hosts
+
+    gc.collect()
+    tracemalloc.start()
+    hosts = build_hosts()
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del hosts
+
+    gc.collect()
+    start = time.perf_counter()
+    hosts = build_hosts()
+    elapsed = time.perf_counter() - start
+    return hosts, elapsed, memory
+
+
+def read_fields(hosts):
+    """Time reading every field of every host, as a template would."""
+    start = time.perf_counter()
+    for hostname in hosts:
+        host = hosts[hostname]
+        host.hostname, host.macaddress, host.ipaddress, host.profile, host.status
+    return time.perf_counter() - start
+
+
+def lookup_misses(hosts, lookup, repeat=5):
+    """Time lookups of a mac address that is not registered, the worst
+    case scanning the whole registry.
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        lookup(hosts, "0a:00:00:00:00:00")
+    return (time.perf_counter() - start) / repeat
+
+
+def render(hosts):
+    """Time rendering the dhcpd.conf host shard template."""
+    template = pm.j2.get_template("dhcpd-hosts.conf.j2")
+    subnet = pm.configured_subnets()[0]
+    start = time.perf_counter()
+    template.render(hosts=hosts.values(), subnet=subnet, pxefilename=pm.settings['pxefilename'])
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    def lookup(hosts, macaddress):
+        saved, pm.db.hosts = pm.db.hosts, hosts
+        try:
+            return pm.lookup_host_by_mac(macaddress)
+        finally:
+            pm.db.hosts = saved
+
+    results = []
+    for name, host_class, host_lookup in (("dict Host", LegacyHost, legacy_lookup_host_by_mac),
+                                          ("slotted Host", pm.Host, lookup)):
+        hosts, build_time, memory = build(host_class, count)
+        results.append((name, memory / count, build_time, read_fields(hosts),
+                        lookup_misses(hosts, host_lookup), render(hosts)))
+        del hosts
+
+    print(f"{count} hosts")
+    print(f"{'':14}{'bytes/host':>12}{'build s':>10}{'read s':>10}{'lookup s':>10}{'render s':>10}")
+    for name, per_host, build_time, read_time, lookup_time, render_time in results:
+        print(f"{name:14}{per_host:12.0f}{build_time:10.3f}{read_time:10.3f}{lookup_time:10.3f}{render_time:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
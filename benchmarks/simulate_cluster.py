@@ -0,0 +1,420 @@
+#! /usr/bin/env python3
+"""Simulation of a cluster of virtual nodes pxe booting against
+pxemanage, to measure how quickly events are acted on without real
+hardware.
+
+The virtual nodes log realistic dhcpd and tftpd events (DHCPDISCOVER
+repeated until the node is registered, then the DHCP exchange and tftp
+RRQs of a pxe boot once it is rebooted for reinstall) with configurable
+timing and jitter, either into a temporary syslog file or as syslog
+datagrams to the udp event source.  The real monitors act on them:
+
+    1. monitor_host_registrations registers the nodes, answering the
+       interactive prompts automatically (or with --auto rules).
+    2. monitor_host_reinstalls follows the nodes rebooted into a
+       reinstall until all of them have begun installing.
+
+All of the files pxemanage writes (dhcpd.conf and its shards, the
+pxelinux.cfg and ks trees, the state files) are kept in a temporary
+directory, and stub sudo, systemctl, ssh and chown commands are put
+first on the PATH.  The event to action latency and the throughput of
+each phase are reported.
+
+Run from the top of the repository:
+
+    python benchmarks/simulate_cluster.py -n 1000 --auto --source udp
+
+"""
+import argparse
+import builtins
+import contextlib
+import heapq
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pxemanage as pm
+
+
+# the stub commands put on the PATH, each logs its arguments
+stub_commands = {
+    # run the command as ourselves
+    'sudo': 'exec "$@"',
+    # every service is active
+    'systemctl': 'exit 0',
+    # the reboot drops the connection, as it does for a real host
+    'ssh': 'case "$*" in *reboot*) exit 255;; esac; exit 0',
+    'chown': 'exit 0',
+}
+
+
+def install_stub_commands(directory):
+    """Write the stub commands into a directory and put it first on the
+    PATH.  Each call of a stub is logged to <directory>/<command>.log.
+    """
+    os.makedirs(directory)
+    for command, body in stub_commands.items():
+        filename = os.path.join(directory, command)
+        with open(filename, mode="w") as file:
+            file.write(f'#!/bin/sh\necho "$*" >> "{filename}.log"\n{body}\n')
+        os.chmod(filename, 0o755)
+    os.environ['PATH'] = f"{directory}{os.pathsep}{os.environ['PATH']}"
+
+
+def stub_calls(directory, command):
+    """Return the number of times a stub command was run."""
+    try:
+        with open(os.path.join(directory, f"{command}.log")) as file:
+            return sum(1 for line in file)
+    except FileNotFoundError:
+        return 0
+
+
+def configure_settings(directory, nodes):
+    """Point every file pxemanage reads or writes into the simulation
+    directory, on a subnet large enough for the nodes.
+    """
+    for tree in ("tftp/pxelinux.cfg", "html/ks", "dhcp", "state"):
+        os.makedirs(os.path.join(directory, tree))
+    key_file = os.path.join(directory, "management.key.pub")
+    with open(key_file, mode="w") as file:
+        file.write("ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIsimulated simulation@pxemanage\n")
+    prefix = 8 if nodes > 60000 else 16
+    pm.settings.update({
+        'registration_file': os.path.join(directory, "dhcp", "dhcpd.conf"),
+        'registration_shard_dir': os.path.join(directory, "dhcp", "pxemanage.d"),
+        'registration_shard_state': os.path.join(directory, "state", "dhcpd-shards.yml"),
+        'registry_lock_file': os.path.join(directory, "state", "registry.lock"),
+        'registry_snapshot_file': os.path.join(directory, "state", "registry.snapshot"),
+        'system_event_file': os.path.join(directory, "syslog"),
+        'system_event_checkpoint_file': os.path.join(directory, "state", "syslog.checkpoint"),
+        'build_manifest_file': os.path.join(directory, "state", "manifest.json"),
+        'service_state_file': os.path.join(directory, "state", "services.yml"),
+        'facts_cache_file': os.path.join(directory, "state", "facts.json"),
+        'lease_index_file': os.path.join(directory, "state", "leases.json"),
+        'inventory_dir': os.path.join(directory, "inventory"),
+        'inventory_state_file': os.path.join(directory, "state", "inventory.yml"),
+        'control_socket': os.path.join(directory, "state", "pxemanaged.sock"),
+        'pxelinux_config_dir': os.path.join(directory, "tftp", "pxelinux.cfg"),
+        'ks_config_dir': os.path.join(directory, "html", "ks"),
+        'ansible_manager_key': key_file,
+        'subnet': "10.0.0.0",
+        'netmask': {8: "255.0.0.0", 16: "255.255.0.0"}[prefix],
+        'gateway_ip': "10.0.0.1",
+        'dns_servers': ["10.0.0.1"],
+        'apache_server_ip': "10.0.0.2",
+        'reserved_ip_ranges': [],
+        'subnets': [],
+        'syslog_listen_address': "127.0.0.1:0",
+    })
+    open(pm.settings['system_event_file'], mode="w").close()
+
+
+def node_macaddress(n):
+    """Return the mac address of the nth virtual node."""
+    return f"52:54:00:{(n >> 16) & 255:02x}:{(n >> 8) & 255:02x}:{n & 255:02x}"
+
+
+class SyslogEmitter:
+    """Log the events of the virtual nodes at their scheduled times, into
+    the syslog file or as syslog datagrams, remembering when each
+    tracked event was first emitted.
+    """
+    def __init__(self, address=None):
+        """Define class constructor for the emitter.
+
+        Parameters
+        ----------
+        address - the address of the udp event source, or None to append
+          to the system events file.
+        """
+        self.address = address
+        self.queue = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.emitted = {}
+        # mac addresses whose DHCPDISCOVERs are no longer repeated
+        self.answered = set()
+        self.lines = 0
+        self.thread = threading.Thread(target=self.run, name="emitter", daemon=True)
+
+    def schedule(self, at, program, message, key=None, repeat=None):
+        """Log a message at a (monotonic) time.
+
+        Parameters
+        ----------
+        at - when to log the message.
+        program - the program tag, e.g. dhcpd[100].
+        message - the message logged.
+        key - if given, the first emission time is recorded under it.
+        repeat - if given, a (macaddress, seconds) tuple, the message is
+          logged again every seconds until the mac address is answered.
+        """
+        with self.condition:
+            heapq.heappush(self.queue, (at, self.sequence, program, message, key, repeat))
+            self.sequence += 1
+            self.condition.notify()
+
+    def run(self):
+        """Emit the scheduled messages until stopped."""
+        if self.address:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            logfile = open(pm.settings['system_event_file'], mode="a")
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    break
+                due = []
+                now = time.monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    due.append(heapq.heappop(self.queue))
+            lines = []
+            stamp = time.strftime("%b %e %H:%M:%S")
+            for at, sequence, program, message, key, repeat in due:
+                if repeat and repeat[0] in self.answered:
+                    continue
+                lines.append(f"{stamp} simulator {program}: {message}\n")
+                if key and key not in self.emitted:
+                    self.emitted[key] = time.monotonic()
+                if repeat:
+                    self.schedule(at + repeat[1], program, message, key, repeat)
+            if self.address:
+                for line in lines:
+                    sender.sendto(f"<30>{line.rstrip()}".encode(), self.address)
+            elif lines:
+                logfile.write("".join(lines))
+                logfile.flush()
+            self.lines += len(lines)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+
+def schedule_boot(emitter, macaddress, ipaddress, at):
+    """Schedule the events a node logs as it pxe boots into an install."""
+    steps = [
+        ("dhcpd[100]", f"DHCPDISCOVER from {macaddress} via eno1"),
+        ("dhcpd[100]", f"DHCPOFFER on {ipaddress} to {macaddress} via eno1"),
+        ("dhcpd[100]", f"DHCPREQUEST for {ipaddress} (10.0.0.2) from {macaddress} via eno1"),
+        ("dhcpd[100]", f"DHCPACK on {ipaddress} to {macaddress} via eno1"),
+        ("in.tftpd[200]", f"RRQ from {ipaddress} filename {pm.settings['pxefilename']}"),
+        ("in.tftpd[201]", f"RRQ from {ipaddress} filename pxelinux.cfg/01-{macaddress.replace(':', '-')}"),
+        ("in.tftpd[202]", f"RRQ from {ipaddress} filename vmlinuz"),
+        ("in.tftpd[203]", f"RRQ from {ipaddress} filename initrd"),
+    ]
+    for step, (program, message) in enumerate(steps):
+        key = ('initrd', ipaddress) if message.endswith("initrd") else None
+        emitter.schedule(at + step * 0.05, program, message, key)
+
+
+class SimulatedPower:
+    """Power control that reboots hosts through another backend (the ssh
+    stub) and then has the virtual node pxe boot.
+    """
+    name = "simulated"
+
+    def __init__(self, backend, emitter, boot_delay, jitter):
+        self.backend = backend
+        self.emitter = emitter
+        self.boot_delay = boot_delay
+        self.jitter = jitter
+
+    def power_cycle(self, host):
+        if not self.backend.power_cycle(host):
+            return False
+        at = time.monotonic() + self.boot_delay + random.uniform(0, self.jitter)
+        schedule_boot(self.emitter, host.macaddress, host.ipaddress, at)
+        return True
+
+
+def until(events, done):
+    """Yield the events until done returns True."""
+    for line in events:
+        yield line
+        if done():
+            return
+
+
+@contextlib.contextmanager
+def patched(name, wrapper):
+    """Replace a pxemanage function with a wrapper of it."""
+    original = getattr(pm, name)
+    setattr(pm, name, wrapper(original))
+    try:
+        yield
+    finally:
+        setattr(pm, name, original)
+
+
+def report_phase(title, emitter, completed, kind):
+    """Print the latency and throughput of a phase."""
+    latencies = sorted(completed[key] - emitter.emitted[key]
+                       for key in completed if key[0] == kind and key in emitter.emitted)
+    if not latencies:
+        print(f"{title}: nothing completed")
+        return
+    first = min(emitter.emitted[key] for key in completed if key in emitter.emitted)
+    elapsed = max(completed.values()) - first
+    print(f"{title}: {len(latencies)} nodes in {elapsed:.2f} s, {len(latencies) / max(elapsed, 1e-9):.1f} nodes/s")
+    print("    event to action latency (ms): " + ", ".join(
+        f"p{percent} {pm.percentile(latencies, percent) * 1000:.1f}" for percent in (50, 90, 99))
+        + f", max {latencies[-1] * 1000:.1f}")
+
+
+def simulate(args, directory):
+    """Run the registration and reinstall phases of the simulation."""
+    bin_dir = os.path.join(directory, "bin")
+    install_stub_commands(bin_dir)
+    configure_settings(directory, args.nodes)
+    pm.hosts.clear()
+    pm.update_host_registration()
+
+    # the event source the monitors read, the file source is primed so
+    # it is following the file before the first event is logged
+    if args.source == "udp":
+        source = pm.get_event_source("udp")
+        events = source.events(idle=True)
+        emitter = SyslogEmitter(source.address)
+    else:
+        events = pm.follow_system_events_file(checkpoint=False, idle=True)
+        next(events)
+        emitter = SyslogEmitter()
+    emitter.start()
+    completed = {}
+
+    # 1. registration, every node repeats its DHCPDISCOVER until it is
+    #    registered
+    macaddresses = [node_macaddress(n) for n in range(args.nodes)]
+    start = time.monotonic()
+    for n, macaddress in enumerate(macaddresses):
+        at = start + n / args.rate + random.uniform(0, args.jitter)
+        emitter.schedule(at, "dhcpd[100]", f"DHCPDISCOVER from {macaddress} via eno1",
+                         key=('discover', macaddress), repeat=(macaddress, args.retry))
+
+    def registered(macaddress):
+        emitter.answered.add(macaddress)
+        completed[('discover', macaddress)] = time.monotonic()
+
+    def register_host(original):
+        def wrapper(macaddress):
+            host = original(macaddress)
+            if host:
+                registered(macaddress)
+            return host
+        return wrapper
+
+    def register_host_batch(original):
+        def wrapper(new_hosts, *args, **kwargs):
+            original(new_hosts, *args, **kwargs)
+            for host in new_hosts:
+                registered(host.macaddress)
+        return wrapper
+
+    writes = [0]
+
+    def count_writes(original):
+        def wrapper():
+            writes[0] += 1
+            return original()
+        return wrapper
+
+    names = (f"sim{n:05d}" for n in range(args.nodes))
+
+    def answer(prompt):
+        if "should we register" in prompt:
+            return "y"
+        if "hostname" in prompt:
+            return next(names)
+        if "profile" in prompt:
+            return "default"
+        # accept the suggested static ip address
+        return ""
+
+    autoregistration = None
+    if args.auto:
+        autoregistration = pm.AutoRegistration("sim{n:05d}", f"10.0.1.0-10.{255 if args.nodes > 60000 else 0}.255.254",
+                                               batch_window=args.batch_window)
+    with contextlib.redirect_stdout(open(os.devnull, mode="w")), \
+         patched('register_host', register_host), patched('register_host_batch', register_host_batch), \
+         patched('update_host_registration', count_writes):
+        original_input = builtins.input
+        builtins.input = answer
+        try:
+            pm.monitor_host_registrations(until(events, lambda: len(emitter.answered) == args.nodes),
+                                          autoregistration)
+        finally:
+            builtins.input = original_input
+    report_phase("registration", emitter, completed, 'discover')
+    pm.service_controller.flush()
+    print(f"    dhcpd.conf writes {writes[0]}, systemctl calls {stub_calls(bin_dir, 'systemctl')}")
+
+    # 2. reinstall, the rebooted nodes pxe boot and are set back to a
+    #    local boot once their initrd is requested
+    def set_host_local_boot(original):
+        def wrapper(hostname):
+            original(hostname)
+            completed[('initrd', pm.hosts[hostname].ipaddress)] = time.monotonic()
+        return wrapper
+
+    hostnames = pm.configure_hosts_for_reinstall(sorted(pm.hosts))
+    backend = pm.get_power_backend(args.power)
+    power = SimulatedPower(backend, emitter, args.boot_delay, args.jitter)
+    with patched('set_host_local_boot', set_host_local_boot):
+        pm.reboot_hosts(hostnames, power)
+        pm.monitor_host_reinstalls(events)
+    report_phase("reinstall", emitter, completed, 'initrd')
+    print(f"    ssh calls {stub_calls(bin_dir, 'ssh')}, sudo calls {stub_calls(bin_dir, 'sudo')}, "
+          f"events logged {emitter.lines}")
+    emitter.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='simulate_cluster', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--nodes', type=int, default=100,
+                        help='number of virtual nodes (default 100)')
+    parser.add_argument('--rate', type=float, default=200.0,
+                        help='nodes powered on per second (default 200)')
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help='most seconds each node event is delayed at random (default 0.5)')
+    parser.add_argument('--retry', type=float, default=4.0,
+                        help='seconds between the DHCPDISCOVERs of an unregistered node (default 4)')
+    parser.add_argument('--boot-delay', type=float, default=1.0,
+                        help='seconds from a reboot until the node pxe boots (default 1)')
+    parser.add_argument('--source', choices=['file', 'udp'], default='file',
+                        help='log the events to a syslog file or as syslog datagrams (default file)')
+    parser.add_argument('--auto', action='store_true',
+                        help='register nodes with auto registration rules instead of answering prompts')
+    parser.add_argument('--batch-window', type=float, default=1.0,
+                        help='auto registration batch window in seconds (default 1)')
+    parser.add_argument('--power', choices=['ssh', 'mock'], default='ssh',
+                        help='power backend rebooting the nodes, ssh runs the ssh stub (default ssh)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the jitter')
+    pm.add_logging_arguments(parser)
+    args = parser.parse_args()
+    # the monitors log every node, only warnings are shown by default
+    pm.setup_logging(args.verbose - 1 if not args.quiet else -1, args.log_json, stream=sys.stderr)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="pxemanage-sim-") as directory:
+        simulate(args, directory)
+
+
+if __name__ == "__main__":
+    main()
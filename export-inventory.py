@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that exports the registered
+hosts as an Ansible inventory, grouped by profile.  It brings the
+inventory group files up to date, streams the whole inventory to a
+file, or answers as an Ansible dynamic inventory script (--list and
+--host) from the registry snapshot.  No services or root configuration
+files are changed.
+"""
+import argparse
+import json
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    dynamic_inventory, \
+    export_inventory, \
+    inventory_host_vars, \
+    inventory_suffixes, \
+    load_registry_snapshot, \
+    settings, \
+    setup_script_logging, \
+    write_inventory
+
+
+usage_msg = """Export the registered hosts as an Ansible inventory with a
+group per profile.  By default the group files in the inventory_dir
+are brought up to date (they are also refreshed whenever hosts are
+registered or unregistered).  With --output the whole inventory is
+written to a file, - for the standard output.  With --list or --host
+the script acts as an Ansible dynamic inventory script, e.g.
+ansible -i export-inventory.py all -m ping
+"""
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='export-inventory', description=usage_msg)
+    parser.add_argument('--list', action='store_true',
+                        help='print the whole inventory as json, as a dynamic inventory script')
+    parser.add_argument('--host', type=str,
+                        help='print the variables of a host as json, as a dynamic inventory script')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str,
+                        help='write the whole inventory to this file, - for the standard output')
+    parser.add_argument('--format', choices=sorted(inventory_suffixes), default='yaml',
+                        help='format of the --output inventory (default yaml)')
+    parser.add_argument('--inventory-dir', metavar='DIR', type=str, default=settings['inventory_dir'],
+                        help=f"directory of the group files (default {settings['inventory_dir']})")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. the registered hosts, from the registry snapshot
+    registered = load_registry_snapshot()['hosts']
+
+    # 2. answer as a dynamic inventory script
+    if args.list:
+        json.dump(dynamic_inventory(registered), sys.stdout)
+        print()
+        return
+    if args.host:
+        host_vars = {}
+        if args.host in registered:
+            macaddress, ipaddress, profile = registered[args.host]
+            host_vars = inventory_host_vars(macaddress, ipaddress)
+        json.dump(host_vars, sys.stdout)
+        print()
+        return
+
+    # 3. stream the whole inventory, or update the group files
+    if args.output == "-":
+        write_inventory(sys.stdout, registered, args.format)
+    elif args.output:
+        with open(args.output, mode="w") as file:
+            write_inventory(file, registered, args.format)
+    else:
+        if not args.inventory_dir:
+            print("Error: no inventory directory configured, give --inventory-dir", file=sys.stderr)
+            sys.exit(2)
+        export_inventory(registered, args.inventory_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that gathers the hardware facts
+(cpus, memory, disks, network interfaces, os and kernel) of registered
+hosts over ssh, many hosts at a time, and keeps them in the local facts
+cache.  Hosts whose cached facts are still fresh are not contacted.
+No services or root configuration files are changed.
+"""
+import argparse
+import json
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    gather_facts, \
+    hosts, \
+    load_host_registration, \
+    settings, \
+    setup_script_logging
+
+
+usage_msg = """Gather the facts of the given registered hosts, or of all
+registered hosts if none are given, and print a line for each host with
+its profile, cpus, memory, disks and network interfaces.  Cached facts
+younger than the facts_ttl setting are used unless --refresh is given.
+The exit status is 1 when the facts of a host could not be gathered.
+"""
+
+
+def format_facts(hostname, facts):
+    """Format the facts of a host as a line of the report."""
+    disks = ",".join(f"{disk['name']}:{disk['size_gb']}G" for disk in facts['disks']) or "-"
+    nics = ",".join(f"{nic['name']}:{nic['speed_mbps']}" for nic in facts['nics']) or "-"
+    return (f"{hostname:16} {hosts[hostname].profile or '-':12} {facts.get('cpus', '-'):>4} "
+            f"{facts.get('memory_mb', 0) // 1024:>5}G  {disks}  {nics}  {facts.get('os', '-')}")
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='gather-facts', description=usage_msg)
+    parser.add_argument('hostname', type=str, nargs='*',
+                        help='hosts to gather the facts of, all registered hosts if none')
+    parser.add_argument('-j', '--parallel', type=int, default=settings['facts_parallel'],
+                        help=f"contact at most this many hosts at once (default {settings['facts_parallel']})")
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=settings['facts_timeout'],
+                        help=f"give up on a host after this many seconds (default {settings['facts_timeout']})")
+    parser.add_argument('--refresh', action='store_true',
+                        help='contact every host, ignoring the cached facts')
+    parser.add_argument('--json', action='store_true',
+                        help='print the facts as a json object of hostname to facts')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. read in and determine database of currently registered hosts
+    load_host_registration()
+    hostnames = args.hostname or sorted(hosts)
+    unknown = [hostname for hostname in hostnames if hostname not in hosts]
+    if unknown:
+        print(f"Error: not registered hosts: {', '.join(unknown)}", file=sys.stderr)
+        sys.exit(2)
+
+    # 2. gather the facts not cached
+    facts, errors = gather_facts(hostnames, args.parallel, args.timeout, refresh=args.refresh)
+
+    # 3. report them
+    if args.json:
+        print(json.dumps(facts, indent=2, sort_keys=True))
+    else:
+        for hostname in hostnames:
+            if hostname in facts:
+                print(format_facts(hostname, facts[hostname]))
+            else:
+                print(f"{hostname:16} unreachable: {errors[hostname]}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
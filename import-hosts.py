@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that is used to register
+many new hosts at once from an inventory file, instead of
+watching for their dhcp requests and registering them one
+at a time.  All hosts in the inventory are validated before
+any are registered, then their pxeboot and kickstarter files
+are created and the dhcpd registration is written and the
+service restarted just once.
+
+This script needs to modify root configuration files and
+start and stop root services, it uses sudo privilage
+escalation where needed.  The user it is run as
+needs to have sudo privileges on the host to successfully
+run this script.
+"""
+import argparse
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    load_host_registration, \
+    import_hosts, \
+    setup_script_logging
+
+
+usage_msg = """Register the hosts listed in a csv or yaml inventory
+file to be put under management for our cluster.  Each host
+needs a hostname, macaddress, ipaddress and (optionally)
+profile, csv files give these as the header line.  If any
+host in the inventory is invalid, no hosts are registered.
+"""
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments to get the inventory file
+    parser = argparse.ArgumentParser(prog='import-hosts', description=usage_msg)
+    parser.add_argument('inventory', type=str,
+                        help='csv or yaml (.yml/.yaml) inventory file of the hosts to register')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only validate the inventory, do not register any hosts')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. read in and determine database of currently registered hosts
+    load_host_registration()
+
+    # 2. validate and register all of the hosts in the inventory
+    if not import_hosts(args.inventory, args.dry_run):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
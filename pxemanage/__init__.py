@@ -17,14 +17,33 @@ from enum import Enum
 from jinja2 import Environment, FileSystemLoader
 
 # these are the submodule imports for the pxemanage module
+from .autoregister import *
+from .bootanalysis import *
 from .bootconfig import *
 from .config import settings
+from .daemon import *
 from .db import *
+from .discoveryfilter import *
+from .events import *
+from .eventsources import *
+from .facts import *
+from .generation import *
+from .hostimport import *
+from .inventory import *
+from .ipalloc import *
 from .kickstart import *
+from .leases import *
+from .logs import *
+from .manifest import *
+from .power import *
+from .prewarm import *
+from .readiness import *
 from .register import *
 from .reinstall import *
 from .services import *
+from .snapshot import *
 from .unregister import *
+from .watchdog import *
 
 
 # jinja2 templates
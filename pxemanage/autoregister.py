@@ -0,0 +1,198 @@
+"""pxemanage module
+
+autoregister submodule
+
+Contents
+--------
+
+Rule based registration of new hosts, so that the operator does not
+have to answer questions for every node when a whole rack is being
+brought up.  New hosts are given the next name from a name pattern,
+e.g. 'cloud{n:02d}', the next free ip address from a pool and a
+profile chosen by rules on their hardware mac address.
+
+Hosts discovered within a short batch window are registered together.
+Their bootconfig and kickstart files are created in parallel and the
+registration file (dhcpd.conf) is written and dhcpd restarted only
+once per batch.
+
+"""
+import ipaddress
+import logging
+import time
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class AutoRegistration:
+    """Keep track of the rules used to automatically register new
+    hosts, and of the batch of discovered hosts waiting to be
+    registered.
+    """
+    def __init__(self, name_pattern, ip_pool, profile="default",
+                 profile_rules=None, first_number=1, max_hosts=None,
+                 batch_window=10.0):
+        """Define class constructor for the registration rules.
+
+        Parameters
+        ----------
+        name_pattern - a python format string used to name new hosts, it is
+          given the host number as n, e.g. 'cloud{n:02d}'
+        ip_pool - the range of static ip addresses to assign from, given as
+          a string 'first-last', e.g. '192.168.0.100-192.168.0.199'
+        profile - the installation profile given to hosts that do not match
+          any of the profile rules.
+        profile_rules - a list of (mac prefix, profile) tuples.  A host whose
+          mac address begins with the prefix is given that profile, the
+          first matching rule wins.
+        first_number - the first host number tried when naming new hosts.
+        max_hosts - the maximum number of hosts to register, or None for
+          no limit.
+        batch_window - seconds to wait after the first host of a batch is
+          discovered before registering the batch.
+        """
+        self.name_pattern = name_pattern
+        self.first_ip, self.last_ip = parse_ip_range(ip_pool)
+        self.profile = profile
+        self.profile_rules = [(prefix.lower(), rule_profile)
+                              for prefix, rule_profile in (profile_rules or [])]
+        self.next_number = first_number
+        self.max_hosts = max_hosts
+        self.batch_window = batch_window
+        self.registered = 0
+        self.pending = []
+        self.batch_started = None
+        self.allocator = None
+
+    def select_profile(self, macaddress):
+        """Determine the installation profile for a new host from the
+        profile rules.
+
+        Parameters
+        ----------
+        macaddress - the hardware mac address of the new host.
+
+        Returns
+        -------
+        profile - the name of the profile to install the host with.
+        """
+        macaddress = macaddress.lower()
+        for prefix, profile in self.profile_rules:
+            if macaddress.startswith(prefix):
+                return profile
+        return self.profile
+
+    def next_hostname(self):
+        """Return the next unused host name from the name pattern."""
+        while True:
+            hostname = self.name_pattern.format(n=self.next_number)
+            self.next_number += 1
+            if hostname not in pm.hosts:
+                return hostname
+
+    def next_ipaddress(self):
+        """Return the next free ip address from the ip pool, or None
+        if the pool is exhausted.  Addresses of registered hosts and
+        reserved addresses are never given out.
+        """
+        if self.allocator is None:
+            self.allocator = pm.build_ip_allocator()
+        return self.allocator.next_free(self.first_ip, self.last_ip)
+
+    def discover(self, macaddress):
+        """A DHCPDISCOVER was seen for the given mac address.  If the
+        host is not yet registered, assign it a name, ip address and
+        profile and add it to the current batch.
+
+        Parameters
+        ----------
+        macaddress - The hardware mac address of the machine that was
+          detected asking for a dhcp lease offer.
+
+        Returns
+        -------
+        host - the new Host that was added to the batch, or None if the
+          host was already registered or no more hosts can be registered.
+        """
+        # ignore already registered hosts, and repeated discovers of hosts
+        # already waiting in this batch
+        if pm.is_registered(macaddress):
+            return None
+        if any(host.macaddress == macaddress for host in self.pending):
+            return None
+
+        if self.max_hosts is not None and self.registered + len(self.pending) >= self.max_hosts:
+            logger.warning("    WARNING: not registering macaddress %s, the maximum of %d hosts are registered",
+                           macaddress, self.max_hosts)
+            return None
+
+        ipaddress = self.next_ipaddress()
+        if ipaddress is None:
+            logger.warning("    WARNING: not registering macaddress %s, ip address pool is exhausted", macaddress)
+            return None
+
+        hostname = self.next_hostname()
+        self.allocator.allocate(ipaddress, hostname)
+        profile = self.select_profile(macaddress)
+        host = pm.Host(hostname, macaddress, ipaddress, profile, pm.status.DHCPOFFER)
+        logger.info("    -------- auto registering macaddress %s as host %s ip %s profile %s",
+                    macaddress, hostname, ipaddress, profile,
+                    extra={'hostname': hostname, 'macaddress': macaddress, 'ipaddress': ipaddress,
+                           'profile': profile, 'event': "registered"})
+
+        if not self.pending:
+            self.batch_started = time.monotonic()
+        self.pending.append(host)
+        return host
+
+    def flush_due(self):
+        """Register the current batch if its batch window has passed."""
+        if self.pending and time.monotonic() - self.batch_started >= self.batch_window:
+            self.flush()
+
+    def flush(self):
+        """Register all hosts waiting in the current batch now."""
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        self.batch_started = None
+        pm.register_host_batch(batch)
+        self.registered += len(batch)
+
+
+def parse_ip_range(ip_range):
+    """Parse an ip address range given as 'first-last'.  A single
+    address is a range of one address.
+
+    Parameters
+    ----------
+    ip_range - the range string, e.g. '192.168.0.100-192.168.0.199'
+
+    Returns
+    -------
+    (first, last) - a tuple of ipaddress.IPv4Address objects.
+    """
+    first, _, last = ip_range.partition('-')
+    first = ipaddress.IPv4Address(first.strip())
+    last = ipaddress.IPv4Address(last.strip()) if last else first
+    if last < first:
+        raise ValueError(f"invalid ip address range {ip_range}")
+    return first, last
+
+
+def parse_profile_rule(rule):
+    """Parse a profile rule given as MACPREFIX=PROFILE, e.g. from the
+    --profile-rule command line option.
+
+    Returns
+    -------
+    (prefix, profile) - the mac address prefix and the profile of hosts
+      whose mac address starts with it.
+    """
+    prefix, separator, profile = rule.partition('=')
+    if not separator or not prefix or not profile:
+        raise ValueError(f"profile rule {rule} is not of the form MACPREFIX=PROFILE")
+    return prefix, profile
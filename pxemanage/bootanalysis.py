@@ -0,0 +1,327 @@
+"""pxemanage module
+
+bootanalysis submodule
+
+Contents
+--------
+
+Boot timeline analytics over the current, rotated and compressed
+system events files (syslog, syslog.1, syslog.2.gz, ...).  Each file is
+scanned in its own process with parse_system_event, the same event
+parsing the monitors use, and only the few boot events are sent back.
+
+The events are correlated per host by mac address.  DHCP events log
+the mac address, tftp and kickstart fetches only the ip address, which
+is mapped back to a mac address from the DHCPACK that handed it out
+or else from the registry.  Each pxe boot of a host is a timeline of
+milestones
+
+    discover  - DHCPDISCOVER of the host
+    ack       - DHCPACK of its address
+    pxelinux  - tftp RRQ of the pxelinux boot loader
+    initrd    - tftp RRQ of the installer initrd
+    kickstart - http fetch of its ks (autoinstall) files
+
+and the time between consecutive milestones are the phases of the
+boot.  Percentile latency tables of each phase are given for all hosts
+and per profile.
+
+"""
+import glob
+import gzip
+import logging
+import math
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# the milestones of a pxe boot, in the order they happen
+boot_milestones = ("discover", "ack", "pxelinux", "initrd", "kickstart")
+
+# the phases of a boot, between consecutive milestones, and the whole boot
+boot_phases = [(boot_milestones[i], boot_milestones[i + 1]) for i in range(len(boot_milestones) - 1)]
+boot_phases.append(("discover", "kickstart"))
+
+# percentiles reported for each phase
+boot_percentiles = (50, 90, 99)
+
+# a boot that has not finished within this many seconds is abandoned,
+# the next DHCPDISCOVER of the host begins a new boot
+boot_window = 3600.0
+
+rotated_file_pattern = re.compile(r"\.(\d+)(\.gz)?")
+
+
+class BootTimeline:
+    """The milestones of one pxe boot of a host."""
+    def __init__(self, macaddress, started, hostname=None, profile=None):
+        """Define class constructor for a boot timeline.
+
+        Parameters
+        ----------
+        macaddress - the mac address of the booting host.
+        started - the time of the DHCPDISCOVER that began the boot.
+        hostname - the registered name of the host, None if it is not
+          registered.
+        profile - the profile of the registered host.
+        """
+        self.macaddress = macaddress
+        self.hostname = hostname
+        self.profile = profile or "unregistered"
+        self.milestones = {"discover": started}
+
+    @property
+    def started(self):
+        """The time the boot began."""
+        return self.milestones["discover"]
+
+    @property
+    def name(self):
+        """The hostname, or the mac address of unregistered hosts."""
+        return self.hostname or self.macaddress
+
+    def phase_durations(self):
+        """Return the seconds each phase of the boot took, for the
+        phases whose milestones were both seen.
+        """
+        return {phase: self.milestones[phase[1]] - self.milestones[phase[0]]
+                for phase in boot_phases
+                if phase[0] in self.milestones and phase[1] in self.milestones}
+
+
+def boot_event_files(filename=None):
+    """List the current and rotated system events files, oldest first.
+
+    Parameters
+    ----------
+    filename - the current system events file, by default the
+      system_event_file setting.
+
+    Returns
+    -------
+    filenames - the rotated files (e.g. syslog.3.gz, syslog.2.gz,
+      syslog.1) followed by the current file.
+    """
+    filename = filename or pm.settings['system_event_file']
+    rotated = []
+    for name in glob.glob(f"{glob.escape(filename)}.*"):
+        match = rotated_file_pattern.fullmatch(name[len(filename):])
+        if match:
+            rotated.append((int(match.group(1)), name))
+    filenames = [name for number, name in sorted(rotated, reverse=True)]
+    if os.path.exists(filename):
+        filenames.append(filename)
+    return filenames
+
+
+def scan_boot_events(filename, pxefilename):
+    """Read one system events file, compressed if it ends in .gz, and
+    return its boot events.  This runs in a worker process.
+
+    Parameters
+    ----------
+    filename - the system events file to scan.
+    pxefilename - the name of the pxelinux boot loader.
+
+    Returns
+    -------
+    events - a list of (time, kind, macaddress, ipaddress) tuples of
+      the boot events in the file.
+    """
+    # traditional syslog timestamps have no year, take it from when the
+    # file was last written, a date after that belongs to the year before
+    modified = os.stat(filename).st_mtime
+    year = time.localtime(modified).tm_year
+    kinds = set(boot_milestones)
+    events = []
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, mode="rb") as file:
+        for line in file:
+            line = line.decode(errors="replace")
+            event = pm.parse_system_event(line, pxefilename)
+            if event is None or event.kind not in kinds:
+                continue
+            logged = pm.parse_event_time(line, year)
+            if logged is None:
+                continue
+            if logged > modified + 86400:
+                logged = pm.parse_event_time(line, year - 1)
+            macaddress = event.macaddress.lower() if event.macaddress else None
+            events.append((logged, event.kind, macaddress, event.ipaddress))
+    return events
+
+
+def read_boot_events(filenames, processes=None):
+    """Scan system events files in parallel, one process per file.
+
+    Parameters
+    ----------
+    filenames - the system events files to scan.
+    processes - the most worker processes, by default one per cpu.
+
+    Returns
+    -------
+    events - the boot events of all the files, ordered by time.
+    """
+    pxefilename = pm.settings['pxefilename']
+    if len(filenames) <= 1 or processes == 1:
+        scanned = [scan_boot_events(filename, pxefilename) for filename in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            scanned = list(executor.map(scan_boot_events, filenames, [pxefilename] * len(filenames)))
+    events = [event for file_events in scanned for event in file_events]
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def correlate_boots(events):
+    """Group boot events into the boot timelines of each host.
+
+    Parameters
+    ----------
+    events - boot events ordered by time, see read_boot_events.
+
+    Returns
+    -------
+    boots - a list of BootTimeline, ordered by when they began.
+    """
+    # registered hosts by mac and ip address
+    mac_hosts = {}
+    ip_macs = {}
+    for host in pm.hosts.values():
+        if host.macaddress != "unknown":
+            mac_hosts[host.macaddress.lower()] = host
+            if host.ipaddress != "unknown":
+                ip_macs[host.ipaddress] = host.macaddress.lower()
+
+    boots = []
+    current = {}
+    for logged, kind, macaddress, ipaddress in events:
+        if macaddress is None:
+            macaddress = ip_macs.get(ipaddress)
+            if macaddress is None:
+                continue
+        elif kind == "ack":
+            # the address was handed to this mac, later tftp and http
+            # requests from it are this host
+            ip_macs[ipaddress] = macaddress
+
+        boot = current.get(macaddress)
+        if kind == "discover":
+            # the installer does a DHCPDISCOVER of its own after the
+            # initrd is loaded, that is still the same boot
+            if (boot is None or "kickstart" in boot.milestones
+                    or ("pxelinux" in boot.milestones and "initrd" not in boot.milestones)
+                    or logged - boot.started > boot_window):
+                host = mac_hosts.get(macaddress)
+                boot = BootTimeline(macaddress, logged,
+                                    host.hostname if host else None,
+                                    host.profile if host else None)
+                current[macaddress] = boot
+                boots.append(boot)
+            continue
+        if boot is None or logged - boot.started > boot_window:
+            continue
+        boot.milestones.setdefault(kind, logged)
+    return boots
+
+
+def percentile(values, percent):
+    """Return the nearest rank percentile of sorted values."""
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def boot_phase_statistics(boots):
+    """Collect the durations of each boot phase, over all hosts and
+    per profile.
+
+    Parameters
+    ----------
+    boots - the boot timelines.
+
+    Returns
+    -------
+    statistics - a dictionary of profile ('all' for every host) to a
+      dictionary of phase to the sorted list of its durations.
+    """
+    statistics = {'all': {phase: [] for phase in boot_phases}}
+    for boot in boots:
+        profile = statistics.setdefault(boot.profile, {phase: [] for phase in boot_phases})
+        for phase, duration in boot.phase_durations().items():
+            statistics['all'][phase].append(duration)
+            profile[phase].append(duration)
+    for phases in statistics.values():
+        for durations in phases.values():
+            durations.sort()
+    return statistics
+
+
+def report_boot_timelines(boots):
+    """Print the timeline of each boot, the milestones are given in
+    seconds after the DHCPDISCOVER.
+    """
+    print("======== Boot timelines ========")
+    for boot in boots:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(boot.started))
+        milestones = "  ".join(f"{milestone} +{boot.milestones[milestone] - boot.started:.1f}s"
+                               for milestone in boot_milestones if milestone in boot.milestones)
+        print(f"    -------- {boot.name} ({boot.profile}) {started}  {milestones}")
+    print("")
+
+
+def report_boot_latencies(statistics):
+    """Print the percentile latency table of each boot phase, for all
+    hosts and for each profile.
+    """
+    print("======== Boot phase latencies (seconds) ========")
+    percentiles = "".join(f"{f'p{percent}':>9}" for percent in boot_percentiles)
+    print(f"    {'profile':<14}{'phase':<22}{'count':>7}{percentiles}{'max':>9}")
+    for profile in sorted(statistics, key=lambda profile: (profile != 'all', profile)):
+        for phase in boot_phases:
+            durations = statistics[profile][phase]
+            if not durations:
+                continue
+            values = "".join(f"{percentile(durations, percent):>9.1f}" for percent in boot_percentiles)
+            print(f"    {profile:<14}{phase[0] + ' -> ' + phase[1]:<22}{len(durations):>7}{values}{durations[-1]:>9.1f}")
+    print("")
+
+
+def analyze_boots(filenames=None, hostnames=None, profile=None, processes=None, timelines=True):
+    """Analyze the pxe boots logged in the system events files, and
+    report their timelines and phase latencies.
+
+    Parameters
+    ----------
+    filenames - the system events files, by default the current and
+      rotated system_event_file.
+    hostnames - only report the boots of these hosts (names or mac
+      addresses).
+    profile - only report the boots of hosts with this profile.
+    processes - the most worker processes used to scan the files.
+    timelines - if True the timeline of each boot is printed.
+
+    Returns
+    -------
+    boots - the reported boot timelines.
+    """
+    filenames = filenames or boot_event_files()
+    logger.info("======== Analyze boots in %d system events files ========", len(filenames))
+    events = read_boot_events(filenames, processes)
+    boots = correlate_boots(events)
+    if hostnames:
+        wanted = set(hostnames)
+        boots = [boot for boot in boots if boot.hostname in wanted or boot.macaddress in wanted]
+    if profile:
+        boots = [boot for boot in boots if boot.profile == profile]
+    logger.info("    -------- %d boot events, %d boots", len(events), len(boots))
+    if timelines:
+        report_boot_timelines(boots)
+    report_boot_latencies(boot_phase_statistics(boots))
+    return boots
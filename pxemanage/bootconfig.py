@@ -14,12 +14,28 @@ address of the host NIC card that has been served dhcpd and is
 performint a netboot.  This module maintains and creates these files
 for the hosts under management in the cluster.
 
+All changes are made in a staged generation of the pxelinux.cfg tree
+and published atomically, see the generation submodule.
+
+With the boot_mode setting 'ipxe' the same files are iPXE scripts
+instead (rendered from ipxe.j2), that fetch the kernel and initrd over
+http from apache.  dhcpd chainloads iPXE (the ipxe_filename) over tftp,
+and hands iPXE the url of the host script (the ipxe_script_url
+setting), so apache must serve the pxelinux.cfg tree as well.  Both
+kinds of file keep the install or local boot default on a line of its
+own, ONTIMEOUT <label> or set boot <label>.
+
 """
-import subprocess
+import logging
+import os
+import re
 import pxemanage as pm
 
 
-def create_bootconfig_file(hostname):
+logger = logging.getLogger(__name__)
+
+
+def create_bootconfig_file(hostname, boot="install"):
     """A new host has been registered for this cluster.  Create the
     host pxelinux boot configuration file using the information 
     gathered for this host.
@@ -27,31 +43,77 @@ def create_bootconfig_file(hostname):
     Parameters
     ----------
     hostname - The new host name to create a boot configuration file for.
+    boot - the menu entry booted by default, 'install' or 'local'.  If
+      None the entry of the existing file is kept, this is used when
+      rebuilding stale files.
     """
     # lookup host in registration database
     host = pm.hosts[hostname]
-    bootconfig_file = f"{pm.settings['pxelinux_config_dir']}/{host.macaddress_file()}"
+    with pm.staged_generation():
+        _create_bootconfig_file(host, boot)
+
+
+# the default menu entry of a pxelinux bootconfig file or ipxe script
+ontimeout_pattern = re.compile(r"^(ONTIMEOUT|set boot)\s+(\w+)", re.MULTILINE)
+
+
+def ipxe_script_url(host):
+    """Return the url iPXE fetches the boot script of a host from."""
+    return pm.settings['ipxe_script_url'].format(apache_server_ip=pm.settings['apache_server_ip'],
+                                                 bootconfig=host.macaddress_file(),
+                                                 hostname=host.hostname)
+
+
+def host_boot_default(host):
+    """Return the default menu entry of the existing bootconfig file
+    of a host.  If the host has no bootconfig file, hosts that are
+    waiting to install get 'install', other hosts 'local'.
+    """
+    bootconfig_file = f"{pm.artifact_dir('pxelinux_config_dir')}/{host.macaddress_file()}"
+    try:
+        with open(bootconfig_file) as file:
+            match = ontimeout_pattern.search(file.read())
+        if match:
+            return match.group(2)
+    except FileNotFoundError:
+        pass
+    if host.status in (pm.status.DHCPOFFER, pm.status.REGISTERED, pm.status.REBOOTING):
+        return "install"
+    return "local"
+
+
+def _create_bootconfig_file(host, boot):
+    """Render and write the bootconfig file of a host into the
+    generation being staged, and record it in the build manifest.
+    """
+    hostname = host.hostname
+    pxelinux_config_dir = pm.artifact_dir('pxelinux_config_dir')
+    bootconfig_file = f"{pxelinux_config_dir}/{host.macaddress_file()}"
+    if boot is None:
+        boot = host_boot_default(host)
     
-    print("======== Create pxeboot configuration file ========")
-    print(f"    ----- creating boot configuration for mac: {host.macaddress}")
-    print(f"    -----                            hostname: {host.hostname}")
-    print(f"    -----                            filename: {bootconfig_file}")
-    print("")
+    logger.debug("    ----- creating boot configuration for host %s mac %s boot %s file %s",
+                 host.hostname, host.macaddress, boot, bootconfig_file)
 
     # get template and render
-    template = pm.j2.get_template("pxeboot.cfg.j2")
+    templates, inputs = pm.bootconfig_inputs(host)
+    template = pm.j2.get_template(templates[0])
     content = template.render(hostname = hostname,
-                              apache_server_ip = pm.settings['apache_server_ip'],
-                              iso_image_name = pm.settings['iso_image_name'])
-    file = open(bootconfig_file, mode="w")
-    file.write(content)
-    file.close()
+                              apache_server_ip = inputs['apache_server_ip'],
+                              iso_image_name = inputs['iso_image_name'],
+                              ipxe_kernel = inputs.get('ipxe_kernel'),
+                              ipxe_initrd = inputs.get('ipxe_initrd'),
+                              boot = boot)
+    pm.write_artifact(bootconfig_file, content)
     
     # make a symbolic link to this file but using the host name, which
-    # makes it much easier for humans to find the bootconfig
-    bootconfig_link = f"{pm.settings['pxelinux_config_dir']}/{host.hostname}"
-    command = f"ln -rs {bootconfig_file} {bootconfig_link}"
-    subprocess.run(command, shell=True)
+    # makes it much easier for humans to find the bootconfig.  The link
+    # is relative, both files are in the same directory
+    bootconfig_link = f"{pxelinux_config_dir}/{host.hostname}"
+    if os.path.lexists(bootconfig_link):
+        os.remove(bootconfig_link)
+    os.symlink(host.macaddress_file(), bootconfig_link)
+    pm.record_artifact(f"bootconfig/{hostname}", templates, inputs)
 
 
 def delete_bootconfig_file(hostname):
@@ -62,14 +124,29 @@ def delete_bootconfig_file(hostname):
     ----------
     hostname - The host whose bootconfig files should be deleted from the system.
     """
-    host = pm.hosts[hostname]
-    bootconfig_file = f"{pm.settings['pxelinux_config_dir']}/{host.macaddress_file()}"
-    command = f"rm -f {bootconfig_file}"
-    subprocess.run(command, shell=True)
+    delete_bootconfig_files([hostname])
 
-    bootconfig_link = f"{pm.settings['pxelinux_config_dir']}/{host.hostname}"
-    command = f"rm -f {bootconfig_link}"
-    subprocess.run(command, shell=True)
+
+def delete_bootconfig_files(hostnames):
+    """Delete the bootconfig files and links of many hosts from the
+    pxelinux.cfg directory in a single pass, without running a
+    command for each file.  Files that are already missing are
+    ignored.
+
+    Parameters
+    ----------
+    hostnames - The hosts whose bootconfig files should be deleted.
+    """
+    with pm.staged_generation():
+        pxelinux_config_dir = pm.artifact_dir('pxelinux_config_dir')
+        for hostname in hostnames:
+            host = pm.hosts[hostname]
+            for filename in (host.macaddress_file(), host.hostname):
+                try:
+                    os.remove(f"{pxelinux_config_dir}/{filename}")
+                except FileNotFoundError:
+                    pass
+            pm.forget_artifact(f"bootconfig/{hostname}")
 
 
 def set_host_local_boot(hostname):
@@ -85,16 +162,8 @@ def set_host_local_boot(hostname):
     # lookup host in registration database
     host = pm.hosts[hostname]
 
-    print(f"    -------- setting host {host.hostname} to perform local boot on reboot")
-    print("")
-    
-    # determine boot configuration file name
-    bootconfig_file = f"{pm.settings['pxelinux_config_dir']}/{host.macaddress_file()}"
-
-    # we will use a simple bash sed replace line infile, switching
-    # to sudo authority for the command
-    command = f"sed -i 's/ONTIMEOUT.*/ONTIMEOUT local/g' {bootconfig_file}"
-    subprocess.run(command, shell=True)
+    logger.debug("    -------- setting host %s to perform local boot on reboot", host.hostname)
+    set_host_boot_default(host, "local")
 
 
 def set_host_install_boot(hostname):
@@ -110,12 +179,24 @@ def set_host_install_boot(hostname):
     # lookup host in registration database
     host = pm.hosts[hostname]
 
-    print(f"    -------- setting host {host.hostname} to perform reinstall auto installation on reboot")
-    
-    # determine boot configuration file name
-    bootconfig_file = f"{pm.settings['pxelinux_config_dir']}/{host.macaddress_file()}"
+    logger.debug("    -------- setting host %s to perform reinstall auto installation on reboot", host.hostname)
+    set_host_boot_default(host, "install")
+
+
+def set_host_boot_default(host, label):
+    """Change the default (ONTIMEOUT) menu entry of a host bootconfig
+    file.  The changed file is written as a new file in the staged
+    generation, the file is never edited in place.
 
-    # we will use a simple bash sed replace line infile, switching
-    # to sudo authority for the command
-    command = f"sed -i 's/ONTIMEOUT.*/ONTIMEOUT install/g' {bootconfig_file}"
-    subprocess.run(command, shell=True)
+    Parameters
+    ----------
+    host - the Host whose bootconfig file should be changed.
+    label - the menu entry to boot by default, 'install' or 'local'
+    """
+    with pm.staged_generation():
+        # determine boot configuration file name
+        bootconfig_file = f"{pm.artifact_dir('pxelinux_config_dir')}/{host.macaddress_file()}"
+        with open(bootconfig_file) as file:
+            content = file.read()
+        content = ontimeout_pattern.sub(lambda match: f"{match.group(1)} {label}", content)
+        pm.write_artifact(bootconfig_file, content)
@@ -0,0 +1,395 @@
+"""pxemanage module
+
+daemon submodule
+
+Contents
+--------
+
+The pxemanaged management daemon, and the client functions the
+scripts use to talk to it.  The daemon loads the registry (dhcpd.conf)
+once and holds it in memory, starts the services once, and follows the
+system events file continuously, so hosts are detected and set to a
+local boot after install no matter which script asked for the change.
+
+Scripts talk to the daemon over a unix domain socket (the
+control_socket setting) using JSON-RPC: each request is one line of
+json
+
+    {"jsonrpc": "2.0", "id": 1, "method": "query", "params": {"profile": "compute"}}
+
+answered by one line of json with either a result or an error.  The
+methods are register, reinstall, unregister, status, query,
+discoveries and next_ipaddress, see the rpc_ methods of
+ManagementDaemon.
+
+Requests and system events are handled one at a time under a single
+lock, so the registry is never changed by two of them at once.  Slow
+work that does not change the registry, like power cycling the hosts
+of a reinstall, is done outside of the lock.
+
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(Exception):
+    """An error returned by the pxemanaged daemon for a request."""
+
+
+class ManagementDaemon:
+    """The state of the pxemanaged daemon: the hosts discovered but not
+    yet registered, the auto registration rules if any, and the
+    control socket server.  The registry itself is pm.hosts.
+    """
+    def __init__(self, autoregistration=None, watchdog=None, prober=None, discovery_filter=None):
+        """Define class constructor for the management daemon.
+
+        Parameters
+        ----------
+        autoregistration - if given, an AutoRegistration with the rules used
+          to register discovered hosts without asking an operator.
+          Otherwise discovered hosts are kept until a client registers
+          them.
+        watchdog - if given, an InstallWatchdog that power cycles hosts
+          that do not begin their install in time.
+        prober - if given, a ReadinessProber that moves hosts to RUNNING
+          once they are up after their install.
+        discovery_filter - the DiscoveryFilter discovered hosts must pass,
+          by default one built from the discovery settings.
+        """
+        self.autoregistration = autoregistration
+        self.watchdog = watchdog
+        self.prober = prober
+        self.discovery_filter = discovery_filter or pm.build_discovery_filter()
+        # clock time each host was last rebooted or registered for an
+        # install, used to time the whole install
+        self.install_started = {}
+        self.lock = threading.RLock()
+        if prober is not None:
+            # ready hosts are changed by the prober thread
+            prober.lock = self.lock
+        # macaddress of each unregistered host seen, mapped to the time
+        # it was first and last seen, least recently seen first.  At
+        # most discovery_cache_size hosts are kept, hosts not seen for
+        # discovery_report_ttl seconds are dropped
+        self.discovered = OrderedDict()
+        self.max_discovered = pm.settings['discovery_cache_size']
+        self.discovered_ttl = pm.settings['discovery_report_ttl']
+        self.started = time.time()
+        self.server = None
+        # hosts that began installing, set back to a local boot together
+        self.local_boot = pm.LocalBootBatch()
+
+    def rpc_status(self):
+        """Return a summary of the daemon and of the registered hosts."""
+        by_status = {}
+        for hostname in pm.hosts:
+            name = pm.hosts[hostname].status.name
+            by_status[name] = by_status.get(name, 0) + 1
+        return {
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started, 1),
+            'hosts': len(pm.hosts),
+            'status': by_status,
+            'discovered': len(self.discovered),
+            'autoregistration': self.autoregistration is not None,
+            'generation': pm.current_generation(),
+        }
+
+    def rpc_query(self, hostnames=None, profile=None, name_glob=None,
+                  name_regex=None, ip_range=None):
+        """Return the registered hosts, optionally only the named hosts
+        or those matching all of the selection criteria of select_hosts.
+        All hosts are returned when nothing is given.
+        """
+        if hostnames is not None:
+            selected = [hostname for hostname in hostnames if hostname in pm.hosts]
+        elif (profile, name_glob, name_regex, ip_range) == (None, None, None, None):
+            selected = sorted(pm.hosts)
+        else:
+            selected = pm.select_hosts(profile, name_glob, name_regex, ip_range)
+        return [host_record(pm.hosts[hostname]) for hostname in selected]
+
+    def rpc_discoveries(self):
+        """Return the unregistered hosts seen asking for a dhcp lease."""
+        return [{'macaddress': macaddress, 'first_seen': first_seen, 'last_seen': last_seen}
+                for macaddress, (first_seen, last_seen) in self.discovered.items()]
+
+    def rpc_decline(self, macaddress):
+        """The operator declined to register a discovered host, it is
+        no longer reported as a discovery.
+        """
+        self.discovered.pop(macaddress, None)
+        self.discovery_filter.decline(macaddress)
+        return True
+
+    def rpc_next_ipaddress(self, first=None, last=None):
+        """Return the next free ip address, see IPAllocator.next_free."""
+        return pm.build_ip_allocator().next_free(first, last)
+
+    def rpc_register(self, hosts):
+        """Register new hosts, given as a list of dictionaries with the
+        keys hostname, macaddress, ipaddress and profile.  The hosts are
+        validated as an inventory, nothing is registered if any of them
+        is invalid.
+        """
+        new_hosts, errors = pm.validate_host_inventory(hosts)
+        if errors:
+            raise ValueError("; ".join(errors))
+        pm.register_host_batch(new_hosts)
+        for host in new_hosts:
+            self.discovered.pop(host.macaddress, None)
+            self.discovery_filter.registered(host.macaddress)
+            self.install_started[host.hostname] = time.monotonic()
+        return [host_record(host) for host in new_hosts]
+
+    def rpc_reinstall(self, hostnames, reboot=True, power=None):
+        """Set hosts to reinstall on their next boot and reboot them,
+        with the named power control backend (by default the
+        power_backend setting).  The daemon sets them back to a local
+        boot once their install is seen to begin.
+
+        The hosts are rebooted by a background thread after the answer,
+        the system events and other requests are handled meanwhile.
+        """
+        hostnames = pm.configure_hosts_for_reinstall(hostnames)
+        for hostname in hostnames:
+            self.install_started[hostname] = time.monotonic()
+            pm.hosts[hostname].status = pm.status.REBOOTING
+        if reboot and hostnames:
+            backend = pm.get_power_backend(power)
+            thread = threading.Thread(target=pm.reboot_hosts, args=(hostnames, backend, self.watchdog, self.lock),
+                                      name="reboot", daemon=True)
+            thread.start()
+        return [host_record(pm.hosts[hostname]) for hostname in hostnames]
+
+    def rpc_unregister(self, hostnames=(), unregister_all=False, profile=None,
+                       name_glob=None, name_regex=None, ip_range=None, dry_run=False):
+        """Unregister hosts, see unregister_hosts.  The client is
+        expected to have confirmed with the operator, e.g. by asking
+        for a dry run first.
+        """
+        macaddresses = {hostname: host.macaddress for hostname, host in pm.hosts.items()}
+        unregistered = pm.unregister_hosts(unregister_all, list(hostnames), profile=profile,
+                                           name_glob=name_glob, name_regex=name_regex,
+                                           ip_range=ip_range, dry_run=dry_run, confirm=False)
+        if not dry_run:
+            for hostname in unregistered:
+                self.discovery_filter.forget(macaddresses[hostname])
+        if unregistered and not dry_run:
+            pm.restart_dhcpd_service()
+        return unregistered
+
+    def handle_request(self, request):
+        """Call the method of a JSON-RPC request.
+
+        Parameters
+        ----------
+        request - the decoded json request, a dictionary with the keys
+          method, params and id.
+
+        Returns
+        -------
+        response - the JSON-RPC response dictionary.
+        """
+        response = {'jsonrpc': "2.0", 'id': request.get('id')}
+        method = getattr(self, f"rpc_{request.get('method')}", None)
+        if method is None:
+            response['error'] = {'code': -32601, 'message': f"unknown method {request.get('method')}"}
+            return response
+        try:
+            with self.lock:
+                # a request sees the bootconfig files of hosts that began
+                # installing already set back to a local boot
+                self.local_boot.flush()
+                response['result'] = method(**(request.get('params') or {}))
+        except Exception as e:
+            response['error'] = {'code': -32000, 'message': str(e) or type(e).__name__}
+        return response
+
+    def handle_event(self, line):
+        """Act on one system event line, the same events that the
+        register-hosts and reinstall-hosts monitors act on.
+        """
+        with self.lock:
+            event = pm.parse_system_event(line)
+            if event and event.kind == "discover" and self.discovery_filter.admit(event.macaddress):
+                macaddress = event.macaddress
+                if self.autoregistration:
+                    if self.autoregistration.discover(macaddress):
+                        self.discovery_filter.registered(macaddress)
+                else:
+                    if macaddress not in self.discovered:
+                        logger.info("    detected DHCPDISCOVER from new macaddress: %s", macaddress,
+                                    extra={'macaddress': macaddress, 'event': "discovered"})
+                    self.discover(macaddress)
+
+            if self.autoregistration:
+                self.autoregistration.flush_due()
+            if self.watchdog:
+                # hosts are power cycled again without holding the lock,
+                # as rpc_reinstall reboots them
+                due = self.watchdog.check()
+                if due:
+                    thread = threading.Thread(target=self.watchdog.retry, args=(due, self.lock),
+                                              name="reboot", daemon=True)
+                    thread.start()
+
+            if event and event.kind == "initrd":
+                hostname = pm.install_host(event.ipaddress, self.local_boot)
+                if self.prober and hostname:
+                    self.prober.submit(hostname, self.install_started.pop(hostname, None))
+            self.local_boot.flush_due(idle=not line)
+
+    def discover(self, macaddress):
+        """Remember an unregistered host seen asking for a dhcp lease,
+        dropping the hosts not seen for too long or for longest.
+        """
+        now = time.time()
+        first_seen = self.discovered.get(macaddress, (now,))[0]
+        self.discovered[macaddress] = (first_seen, now)
+        self.discovered.move_to_end(macaddress)
+        while self.discovered:
+            oldest = next(iter(self.discovered))
+            if len(self.discovered) <= self.max_discovered and now - self.discovered[oldest][1] <= self.discovered_ttl:
+                break
+            del self.discovered[oldest]
+
+    def start_server(self):
+        """Start answering requests on the control socket, in a
+        background thread.
+        """
+        control_socket = pm.settings['control_socket']
+        if os.path.exists(control_socket):
+            if daemon_running():
+                raise RuntimeError(f"pxemanaged is already running on {control_socket}")
+            os.remove(control_socket)
+        os.makedirs(os.path.dirname(control_socket) or ".", exist_ok=True)
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        response = daemon.handle_request(request)
+                    except ValueError as e:
+                        response = {'jsonrpc': "2.0", 'id': None,
+                                    'error': {'code': -32700, 'message': f"invalid request: {e}"}}
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        self.server = socketserver.ThreadingUnixStreamServer(control_socket, RequestHandler)
+        self.server.daemon_threads = True
+        # only the owner and group may manage hosts
+        os.chmod(control_socket, 0o660)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop_server(self):
+        """Stop answering requests and remove the control socket."""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(pm.settings['control_socket']):
+                os.remove(pm.settings['control_socket'])
+
+    def run(self, systemevent=None):
+        """Serve requests and follow the system events until the
+        events are exhausted (only when replaying a log) or the
+        process is stopped.
+
+        Parameters
+        ----------
+        systemevent - an iterator of system event lines.  By default we
+          follow the configured event source, e.g. the system events
+          file (syslog) from the last checkpoint.
+        """
+        logger.info("======== pxemanaged serving requests ========")
+        logger.info("    -------- control socket %s", pm.settings['control_socket'])
+        if systemevent is None:
+            systemevent = pm.system_events(idle=True)
+        self.start_server()
+        if self.prober:
+            self.prober.start()
+        try:
+            for line in systemevent:
+                self.handle_event(line)
+        finally:
+            self.stop_server()
+            if self.prober:
+                self.prober.stop()
+            with self.lock:
+                self.local_boot.flush()
+                if self.autoregistration:
+                    self.autoregistration.flush()
+
+
+def host_record(host):
+    """Return the fields of a host as a json serializable dictionary."""
+    return {
+        'hostname': host.hostname,
+        'macaddress': host.macaddress,
+        'ipaddress': host.ipaddress,
+        'profile': host.profile,
+        'status': host.status.name,
+    }
+
+
+def call_daemon(method, timeout=30.0, **params):
+    """Call a method of the running pxemanaged daemon.
+
+    Parameters
+    ----------
+    method - the name of the method, e.g. 'status'
+    timeout - seconds to wait for the answer, None waits until the
+      daemon answers.
+    params - the keyword parameters of the method.
+
+    Returns
+    -------
+    result - the result returned by the method.
+
+    Raises
+    ------
+    DaemonError - if the daemon returned an error.
+    OSError - if the daemon is not running or did not answer within
+      the timeout.
+    """
+    request = {'jsonrpc': "2.0", 'id': 1, 'method': method, 'params': params}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(pm.settings['control_socket'])
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        with connection.makefile("rb") as answer:
+            line = answer.readline()
+    if not line:
+        raise DaemonError(f"pxemanaged closed the connection without answering {method}")
+    response = json.loads(line)
+    if 'error' in response:
+        raise DaemonError(response['error']['message'])
+    return response['result']
+
+
+def daemon_running():
+    """Return True if a pxemanaged daemon is answering on the control
+    socket.  Scripts use the daemon when it is running, and manage the
+    hosts themselves otherwise.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(1.0)
+            connection.connect(pm.settings['control_socket'])
+        return True
+    except OSError:
+        return False
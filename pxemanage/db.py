@@ -10,20 +10,37 @@ pxeboot installs.  We are actually using the dhcpd.conf configuration
 file of the dhcpd service as a flat file store.  We parse this file to
 get the current host database under management when we begin.  And
 whenever new hosts are registered we write out the database and
-restart dhcpd service.
+restart dhcpd service.  The hosts of each configured subnet (e.g. each
+rack) are kept in their own shard file, included from a small main
+dhcpd.conf, so only the shards of subnets that changed are rewritten.
 
 We are using a simple dictionary of Host classes as the database for
-now.  The Host class is an extension of the system dictionary class,
-so hosts can be accessed using key, or by using attributes.
+now.  The Host class is a compact slotted record, its fields can be
+accessed using attributes, or by key through a read only mapping view.
 
 """
+import fcntl
+import fnmatch
+import hashlib
+import logging
+import os
 import re
+import shutil
+import socket
 import subprocess
+import tempfile
+import threading
+import yaml
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from enum import Enum
 #from pxemanage import settings, j2
 import pxemanage as pm
 
 
+logger = logging.getLogger(__name__)
+
+
 # we will use a simple dictionary with hostname as key
 # to manage our host database for now
 hosts = {}
@@ -37,21 +54,69 @@ class status(Enum):
     INSTALLING = 3
     REBOOTING = 4
     RUNNING = 5
+    FAILED = 6
+
+
+# the status of each small integer status code stored in a Host,
+# indexed by the code
+_status_by_code = (None,) + tuple(status)
+
+# the fields of a Host that can be looked up by key, e.g. host['ipaddress']
+host_fields = ('hostname', 'macaddress', 'ipaddress', 'profile', 'status')
 
 
-class Host(dict):
+def macaddress_to_int(macaddress):
+    """Convert a mac address string like 11:22:33:44:55:66 to the
+    integer it represents, raises ValueError if it is not valid.
+    """
+    digits = macaddress.replace(':', '')
+    if len(digits) != 12:
+        raise ValueError(f"invalid mac address {macaddress}")
+    return int(digits, 16)
+
+
+def int_to_macaddress(value):
+    """Convert an integer mac address back to the 11:22:33:44:55:66
+    string form.
+    """
+    return value.to_bytes(6, 'big').hex(':')
+
+
+def ipaddress_to_int(ipaddress):
+    """Convert a dotted quad ip address string to the integer it
+    represents, raises ValueError if it is not valid.
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ipaddress), 'big')
+    except OSError:
+        raise ValueError(f"invalid ip address {ipaddress}")
+
+
+def int_to_ipaddress(value):
+    """Convert an integer ip address back to its dotted quad string."""
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+class Host:
     """Really just a structure that keeps track of all information about
     registered hosts we are managing.
 
-    Actually this class is a dict so that we can easily pass into j2
-    to render templates.  But it can act like a struct because we
-    override the getattr method.
+    The host is stored compactly using slots: the mac address and ip
+    address are held as integers (-1 when unknown), which lookups and
+    subnet checks compare, and the status as a small integer code.  The
+    usual string forms are available as attributes, so host.macaddress
+    gives '11:22:33:44:55:66' (always lower case).  They are formatted
+    once when the address is set, so templates read them as cheaply as
+    plain attributes.
 
     """
+    __slots__ = ('hostname', '_macaddress', '_ipaddress', 'profile', '_status',
+                 '_macaddress_text', '_ipaddress_text')
+
     def __init__(self, hostname, macaddress="unknown",
                  ipaddress="unknown", profile="default",
                  status=status.RUNNING):
-        """Define class constructor for our Host struct/dict
+        """Define class constructor for our Host struct
 
         Parameters
         ----------
@@ -69,22 +134,71 @@ class Host(dict):
         self.profile = profile
         self.status = status
 
-    def __getattr__(self, name):
-        """Overload member access (getting an attribute) so that we can
-        perform, for example, host.ipaddress and have it lookup the
-        value for the key for us.
+    @property
+    def macaddress(self):
+        """The hardware mac address as a string, or unknown."""
+        return self._macaddress_text
+
+    @macaddress.setter
+    def macaddress(self, macaddress):
+        if macaddress == "unknown":
+            self._macaddress = -1
+            self._macaddress_text = "unknown"
+        else:
+            self._macaddress = macaddress_to_int(macaddress)
+            self._macaddress_text = int_to_macaddress(self._macaddress)
+
+    @property
+    def ipaddress(self):
+        """The static ip address as a string, or unknown."""
+        return self._ipaddress_text
+
+    @ipaddress.setter
+    def ipaddress(self, ipaddress):
+        if ipaddress == "unknown":
+            self._ipaddress = -1
+            self._ipaddress_text = "unknown"
+        else:
+            self._ipaddress = ipaddress_to_int(ipaddress)
+            self._ipaddress_text = int_to_ipaddress(self._ipaddress)
+
+    @property
+    def status(self):
+        """The current status of the host."""
+        return _status_by_code[self._status]
+
+    @status.setter
+    def status(self, value):
+        self._status = value.value
+
+    def __getitem__(self, name):
+        """Allow fields to be looked up by key as well, e.g. host['ipaddress'],
+        as when Host was a dictionary.
 
         Parameters
         ----------
-        name - the attribute/key name to look up / retrieve for this host.
+        name - the field name to look up / retrieve for this host.
 
         Returns
         -------
-        value - returns the attribute value for the retrieved key.  An exception
-           will be thrown if you try to retrieve an attribute that is not a valid
-           key item currently for this host.
+        value - returns the field value.  A KeyError is raised if name is not
+           one of the host fields.
         """
-        return self.__getitem__(name)
+        if name not in host_fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __eq__(self, other):
+        """Hosts are equal when all of their fields are equal."""
+        if not isinstance(other, Host):
+            return NotImplemented
+        return (self.hostname == other.hostname and
+                self._macaddress == other._macaddress and
+                self._ipaddress == other._ipaddress and
+                self.profile == other.profile and
+                self._status == other._status)
+
+    __hash__ = None
 
     def __str__(self):
         """Overload the string representation of this class to create and return
@@ -163,9 +277,16 @@ def lookup_host_by_mac(macaddress):
       in the host database with that hardware mac address.  None is
       returned instead if no host is registered with that mac address.
     """
+    # compare the integer form of the mac addresses, so differences
+    # in case do not matter
+    try:
+        macaddress = macaddress_to_int(macaddress)
+    except ValueError:
+        return None
+
     # return first hostname found registered with that macaddress
-    for hostname in hosts:
-        if hosts[hostname].macaddress == macaddress:
+    for hostname, host in hosts.items():
+        if host._macaddress == macaddress:
             return hostname
 
     # indicate failure by returning None
@@ -188,35 +309,297 @@ def lookup_host_by_ipaddress(ipaddress):
       returned instead if no host is registered as using that ip
       address.
     """
-    # return first hostname found registered with that macaddress
-    for hostname in hosts:
-        if hosts[hostname].ipaddress == ipaddress:
+    try:
+        ipaddress = ipaddress_to_int(ipaddress)
+    except ValueError:
+        return None
+
+    # return first hostname found registered with that ipaddress
+    for hostname, host in hosts.items():
+        if host._ipaddress == ipaddress:
             return hostname
 
     # indicate failure by returning None
     return None
 
 
-def load_host_registration():
-    """Parse the host registration file (dhcpd.conf).  This file keeps
-    track of all host information for hosts being managed in our
-    cloudstack (or other) cluster.
+class HostIndex:
+    """Indexes over the hosts database used to select groups of hosts
+    by profile, name or ip address range without testing every host
+    against every criteria.
+    """
+    def __init__(self, hosts):
+        """Build the indexes for the given hosts database.
 
-    We are currently using the dhcpd.conf file to keep track of
-    managed host information.  This may be inadequate for more
-    advanced needs.  We use simple regular expressions to parse, but
-    this could be easily enhanced using a simple yaml parser or
-    equivalent here.
+        Parameters
+        ----------
+        hosts - a dictionary of Host objects keyed by hostname.
+        """
+        self.hostnames = sorted(hosts)
+        self.by_profile = {}
+        by_ipaddress = []
+        for hostname in self.hostnames:
+            host = hosts[hostname]
+            self.by_profile.setdefault(host.profile, set()).add(hostname)
+            if host._ipaddress >= 0:
+                by_ipaddress.append((host._ipaddress, hostname))
+        by_ipaddress.sort()
+        self.ipaddresses = [address for address, hostname in by_ipaddress]
+        self.ipaddress_hostnames = [hostname for address, hostname in by_ipaddress]
+
+    def select(self, profile=None, name_glob=None, name_regex=None, ip_range=None):
+        """Select the hosts matching all of the given criteria.  Criteria
+        that are None are not used, if no criteria are given no hosts
+        are selected.
+
+        Parameters
+        ----------
+        profile - select hosts installed with this profile.
+        name_glob - select hosts whose name matches this shell style
+          pattern, e.g. 'cloud1*'
+        name_regex - select hosts whose name matches this regular expression.
+        ip_range - select hosts whose ip address is in this range, given
+          as 'first-last'.
+
+        Returns
+        -------
+        hostnames - a sorted list of the names of the selected hosts.
+        """
+        selected = None
+
+        def narrow(candidates):
+            return set(candidates) if selected is None else selected.intersection(candidates)
+
+        if profile is not None:
+            selected = narrow(self.by_profile.get(profile, ()))
+        if ip_range is not None:
+            first, last = pm.parse_ip_range(ip_range)
+            start = bisect_left(self.ipaddresses, int(first))
+            end = bisect_right(self.ipaddresses, int(last))
+            selected = narrow(self.ipaddress_hostnames[start:end])
+        candidates = self.hostnames if selected is None else sorted(selected)
+        if name_glob is not None:
+            selected = narrow(fnmatch.filter(candidates, name_glob))
+        if name_regex is not None:
+            pattern = re.compile(name_regex)
+            selected = narrow(hostname for hostname in candidates if pattern.search(hostname))
+
+        return sorted(selected) if selected is not None else []
+
+
+def select_hosts(profile=None, name_glob=None, name_regex=None, ip_range=None):
+    """Select registered hosts by profile, name pattern or ip address
+    range.  See HostIndex.select for the criteria.
 
     Returns
     -------
-    No explicit values is returned, but implicitly the hosts
-    management database is populated with all hosts being managed
-    for dhcp/pxe boot for this cluster after this function
-    finishes.
+    hostnames - a sorted list of the names of the selected hosts.
+    """
+    index = HostIndex(hosts)
+    return index.select(profile, name_glob, name_regex, ip_range)
+
+
+class RegistryConflict(Exception):
+    """Another pxemanage process changed the same hosts in the
+    registration file that we changed, so our changes can not be
+    merged with theirs.
+    """
+
+
+# version stamp written at the top of the registration file, it is
+# increased by every update of the registration
+version_pattern = re.compile(r"^#\s*pxemanage registry version\s+(\d+)")
+
+# version of the registration file the hosts database was loaded from
+# (None if it was not loaded), and the (macaddress, ipaddress, profile)
+# of each host as loaded, the base our changes are merged from
+registry_version = None
+_registry_base = {}
+
+# the registry lock: a lock excluding the other threads of this
+# process, the flock excluding other processes taken by its holder,
+# and the nesting depth of each thread
+_registry_lock = threading.RLock()
+_registry_lock_file = None
+_registry_lock_local = threading.local()
+
+
+@contextmanager
+def registry_lock():
+    """Context manager holding the advisory lock on the registry (an
+    flock of the registry_lock_file) across a read-modify-write of the
+    registration or the generation trees.  Other pxemanage processes,
+    and the other threads of this process, wait until it is released.
+    The lock may be nested.
+    """
+    global _registry_lock_file
+    _registry_lock.acquire()
+    try:
+        depth = getattr(_registry_lock_local, 'depth', 0)
+        if depth == 0:
+            lock_filename = pm.settings['registry_lock_file']
+            os.makedirs(os.path.dirname(lock_filename) or ".", exist_ok=True)
+            lock_file = open(lock_filename, mode="a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+            _registry_lock_file = lock_file
+        _registry_lock_local.depth = depth + 1
+    except BaseException:
+        _registry_lock.release()
+        raise
+    try:
+        yield
+    finally:
+        _registry_lock_local.depth -= 1
+        if _registry_lock_local.depth == 0:
+            fcntl.flock(_registry_lock_file, fcntl.LOCK_UN)
+            _registry_lock_file.close()
+            _registry_lock_file = None
+        _registry_lock.release()
+
+
+def _host_fields(host):
+    """Return the registered fields of a host that are compared when
+    merging, or None for a missing host.
+    """
+    if host is None:
+        return None
+    return (host.macaddress, host.ipaddress, host.profile)
+
+
+def _remember_registry(version):
+    """Remember the version and hosts of the registration as the base
+    of later merges.
+    """
+    global registry_version, _registry_base
+    registry_version = version
+    _registry_base = {hostname: _host_fields(hosts[hostname]) for hostname in hosts}
+
+
+def read_registry_version(filename):
+    """Return the version stamp of a registration file, 0 if it has no
+    stamp or does not exist.  Only the head of the file is read.
+    """
+    try:
+        with open(filename) as file:
+            for line, _ in zip(file, range(20)):
+                match = version_pattern.match(line)
+                if match:
+                    return int(match.group(1))
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+def merge_host_registration(their_hosts):
+    """Merge the hosts registered by another process into the hosts
+    database.  A host changed (added, modified or removed) by only one
+    side keeps that change, a host changed the same way by both sides
+    is fine.  A host changed differently by both sides, or two hosts
+    ending up with the same mac or ip address, is a conflict.
+
+    Parameters
+    ----------
+    their_hosts - the hosts of the newer registration file, as parsed
+      by parse_host_registration.
+
+    Raises
+    ------
+    RegistryConflict - if the changes can not be merged, the hosts
+      database is not changed.
+    """
+    conflicts = []
+    merged = {}
+    for hostname in sorted(set(_registry_base) | set(hosts) | set(their_hosts)):
+        base = _registry_base.get(hostname)
+        ours = _host_fields(hosts.get(hostname))
+        theirs = _host_fields(their_hosts.get(hostname))
+        if ours == theirs or theirs == base:
+            merged[hostname] = hosts.get(hostname)
+        elif ours == base:
+            merged[hostname] = their_hosts.get(hostname)
+        else:
+            conflicts.append(f"host {hostname} was changed by another process, ours {ours} theirs {theirs}")
+
+    for index, field in ((0, "macaddress"), (1, "ipaddress")):
+        owners = {}
+        for hostname, host in merged.items():
+            if host is None:
+                continue
+            value = _host_fields(host)[index]
+            if value != "unknown" and value in owners:
+                conflicts.append(f"hosts {owners[value]} and {hostname} have the same {field} {value}")
+            owners[value] = hostname
+
+    if conflicts:
+        raise RegistryConflict("; ".join(conflicts))
+
+    # change the hosts database in place, other modules share it
+    for hostname, host in merged.items():
+        if host is None:
+            hosts.pop(hostname, None)
+        elif hosts.get(hostname) is not host:
+            logger.info("    -------- merged host %s registered by another process", hostname)
+            hosts[hostname] = host
+
+
+# include statements, used to read the per subnet host shards
+include_pattern = re.compile(r'^\s*include\s+"([^"]+)";.*$')
+
+
+def _registration_lines(filename, included=False, sources=None):
+    """Yield the lines of a registration file, with the lines of the
+    files it includes in place of the include statements.  Included
+    files that are missing (e.g. a shard not yet installed) are
+    skipped.  The name and stat of every file read is appended to
+    sources, if given.
     """
+    try:
+        file = open(filename)
+    except FileNotFoundError:
+        if not included:
+            raise
+        logger.warning("    WARNING: included registration file %s not found", filename)
+        return
+    with file:
+        if sources is not None:
+            sources.append((filename, os.fstat(file.fileno())))
+        for line in file:
+            match = include_pattern.match(line)
+            if match:
+                yield from _registration_lines(match.group(1), included=True, sources=sources)
+            else:
+                yield line
+
+
+def parse_host_registration(filename, sources=None):
+    """Parse a host registration file (dhcpd.conf), and the shards it
+    includes, without changing the hosts database.
+
+    Parameters
+    ----------
+    filename - the registration file to parse.
+    sources - an optional list the (filename, stat) of the registration
+      file and of every file it includes is appended to.
+
+    Returns
+    -------
+    (parsed_hosts, version) - a dictionary of hostname to the Host
+      parsed, and the version stamp of the registration file (0 if
+      it has none).
+    """
+    parsed_hosts = {}
+    version = 0
     current_host = None
-    for line in open(pm.settings['registration_file']).readlines():
+    for line in _registration_lines(filename, sources=sources):
+        # the version stamp written by update_host_registration
+        match = version_pattern.match(line)
+        if match:
+            version = int(match.group(1))
+
         # search for a host block, all options read
         # from subsequent lines pertain to this host until
         # we see the next host block
@@ -226,7 +609,7 @@ def load_host_registration():
             hostname = match.group(1)
             #print(f"Parsing host: {hostname}")
             current_host = Host(hostname)
-            hosts[hostname] = current_host
+            parsed_hosts[hostname] = current_host
 
         # search for hardware ethernet mac address
         mac_pattern = "..:..:..:..:..:.."
@@ -254,11 +637,153 @@ def load_host_registration():
             #print(f"    matched profile: {profile}")
             current_host.profile = profile
 
-    print("======== Read Host Registration ========")
-    print("The list of registered hosts discovered")
-    for hostname in hosts:
-        print(hosts[hostname])
-    print("")
+    return parsed_hosts, version
+
+
+def load_host_registration():
+    """Parse the host registration file (dhcpd.conf).  This file keeps
+    track of all host information for hosts being managed in our
+    cloudstack (or other) cluster.
+
+    We are currently using the dhcpd.conf file to keep track of
+    managed host information.  This may be inadequate for more
+    advanced needs.  We use simple regular expressions to parse, but
+    this could be easily enhanced using a simple yaml parser or
+    equivalent here.  The per subnet host shards are read by
+    following the include statements of the registration file.
+
+    The version of the registration and the hosts as loaded are
+    remembered, so that update_host_registration can detect and merge
+    changes made by other pxemanage processes in the meantime.
+
+    Returns
+    -------
+    No explicit values is returned, but implicitly the hosts
+    management database is populated with all hosts being managed
+    for dhcp/pxe boot for this cluster after this function
+    finishes.
+    """
+    with registry_lock():
+        parsed_hosts, version = parse_host_registration(pm.settings['registration_file'])
+    hosts.update(parsed_hosts)
+    _remember_registry(version)
+
+    report_registered_hosts("Read Host Registration")
+
+
+def report_registered_hosts(banner):
+    """Log the number of registered hosts, and every host when debug
+    logging is enabled.  Listing every host is costly with thousands
+    of hosts, so it is skipped unless asked for.
+
+    Parameters
+    ----------
+    banner - the title logged first.
+    """
+    logger.info("======== %s ========", banner)
+    logger.info("    -------- %d registered hosts", len(hosts))
+    if logger.isEnabledFor(logging.DEBUG):
+        for hostname in hosts:
+            logger.debug("%s", hosts[hostname])
+
+
+# hosts whose address is in none of the configured subnets are written
+# to a shard of this name, included outside of any subnet block
+unassigned_shard = "unassigned"
+
+
+def configured_subnets():
+    """Return the subnets dhcpd serves registered hosts on.  The
+    subnet given by the top level subnet settings is always the first
+    and is named 'default'; any further subnets (e.g. one per rack)
+    are listed in the subnets setting.  Extra subnets use the default
+    dns servers unless they give their own.
+
+    Returns
+    -------
+    subnets - a list of dictionaries with the keys name, subnet,
+      netmask, gateway_ip and dns_servers.
+    """
+    subnets = [{
+        'name': "default",
+        'subnet': pm.settings['subnet'],
+        'netmask': pm.settings['netmask'],
+        'gateway_ip': pm.settings['gateway_ip'],
+        'dns_servers': pm.settings['dns_servers'],
+    }]
+    for entry in pm.settings['subnets'] or []:
+        for key in ('name', 'subnet', 'netmask'):
+            if key not in entry:
+                raise ValueError(f"subnet setting {entry} has no {key}")
+        subnets.append({
+            'name': entry['name'],
+            'subnet': entry['subnet'],
+            'netmask': entry['netmask'],
+            'gateway_ip': entry.get('gateway_ip'),
+            'dns_servers': entry.get('dns_servers', pm.settings['dns_servers']),
+        })
+    names = [subnet['name'] for subnet in subnets]
+    if len(set(names)) != len(names) or unassigned_shard in names:
+        raise ValueError(f"subnet names must be unique and not '{unassigned_shard}': {names}")
+    return subnets
+
+
+def group_hosts_by_subnet(subnets):
+    """Sort the registered hosts into the subnet their ip address
+    belongs to.
+
+    Parameters
+    ----------
+    subnets - the subnets as returned by configured_subnets.
+
+    Returns
+    -------
+    shards - a dictionary of subnet name to the list of Hosts in that
+      subnet, sorted by hostname.  Hosts in none of the subnets are
+      listed under the name in unassigned_shard.
+    """
+    networks = []
+    for subnet in subnets:
+        netmask = ipaddress_to_int(subnet['netmask'])
+        networks.append((ipaddress_to_int(subnet['subnet']) & netmask, netmask, subnet['name']))
+
+    shards = {subnet['name']: [] for subnet in subnets}
+    shards[unassigned_shard] = []
+    for hostname in sorted(hosts):
+        host = hosts[hostname]
+        shard = unassigned_shard
+        if host._ipaddress >= 0:
+            for network, netmask, name in networks:
+                if host._ipaddress & netmask == network:
+                    shard = name
+                    break
+        shards[shard].append(host)
+    return shards
+
+
+def boot_loader_inputs():
+    """Return the boot loader settings rendered into the host shards,
+    the ipxe settings only matter in the ipxe boot mode.
+    """
+    if pm.settings['boot_mode'] == "ipxe":
+        return {'boot_mode': "ipxe", 'ipxe_filename': pm.settings['ipxe_filename'],
+                'ipxe_script_url': pm.settings['ipxe_script_url']}
+    return {'boot_mode': "pxelinux"}
+
+
+def _shard_signature(shard_hosts, subnet, template_source):
+    """Return a digest of everything that goes into a shard file: the
+    fields of its hosts, the subnet options and the template, so a
+    shard is only rewritten when one of them changed.
+    """
+    digest = hashlib.sha1()
+    digest.update(template_source.encode())
+    digest.update(repr(sorted(subnet.items())).encode())
+    digest.update(pm.settings['pxefilename'].encode())
+    digest.update(repr(boot_loader_inputs()).encode())
+    for host in shard_hosts:
+        digest.update(f"{host.hostname} {host._macaddress} {host._ipaddress} {host.profile}\n".encode())
+    return digest.hexdigest()
 
 
 def update_host_registration():
@@ -266,23 +791,136 @@ def update_host_registration():
     dhcpd.conf file that we are using to maintain our cloudstack
     cluster host registration information in.
 
-    We recreate the whole file with all registered hosts entered to
-    make this routine simple.
+    The hosts of each subnet are written to their own shard file in
+    the registration_shard_dir, which the main dhcpd.conf includes
+    from the subnet block.  Only shards whose hosts (or subnet
+    options) changed since the last update are rewritten, which keeps
+    updates cheap for large multi rack clusters.  The signatures of
+    the installed shards are kept in the registration_shard_state
+    file.
+
+    The update holds the registry lock.  If another process updated
+    the registration since we loaded it (its version stamp is newer),
+    its changes are merged into our hosts database first, see
+    merge_host_registration.
+
+    Returns
+    -------
+    changed - the list of the names of the shards that were rewritten.
+
+    Raises
+    ------
+    RegistryConflict - if our changes conflict with those of another
+      process, nothing is written.
     """
-    print("======== Update dhcpd.conf registration file ========")
-    print("")
-    new_registration_file = "./dhcpd.conf"
+    with registry_lock():
+        registration_file = pm.settings['registration_file']
+        version = read_registry_version(registration_file)
+        if registry_version is not None and version != registry_version:
+            logger.info("    -------- registration changed by another process (version %s -> %s), merging",
+                        registry_version, version)
+            their_hosts, version = parse_host_registration(registration_file)
+            merge_host_registration(their_hosts)
+        changed = _write_host_registration(version + 1)
+    return changed
+
+
+def _write_host_registration(version):
+    """Render and install the registration shards and main file with
+    the given version stamp, see update_host_registration.  The files
+    are rendered into a temporary directory that is removed once they
+    are installed.
+    """
+    staging_dir = tempfile.mkdtemp(prefix="pxemanage-dhcpd.")
+    try:
+        return _install_host_registration(version, staging_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
 
-    # get dhcpd.conf template and render its contents
-    # TODO: should templatize the router and dns information
-    #   in this template as well.
+def _install_host_registration(version, staging_dir):
+    """Render the registration into the staging directory and install
+    it, see _write_host_registration.
+    """
+    logger.info("======== Update dhcpd.conf registration file ========")
+    new_registration_file = f"{staging_dir}/dhcpd.conf"
+    new_shard_dir = f"{staging_dir}/dhcpd.d"
+    shard_dir = pm.settings['registration_shard_dir']
+    state_file = pm.settings['registration_shard_state']
+
+    subnets = configured_subnets()
+    shards = group_hosts_by_subnet(subnets)
+    for host in shards[unassigned_shard]:
+        logger.warning("    WARNING: host %s ip address %s is in none of the configured subnets",
+                       host.hostname, host.ipaddress)
+
+    try:
+        with open(state_file) as file:
+            signatures = yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        signatures = {}
+    # forget subnets that are no longer configured
+    signatures = {name: signatures[name] for name in shards if name in signatures}
+
+    # render the shards whose signature changed, or that are missing
+    template = pm.j2.get_template("dhcpd-hosts.conf.j2")
+    template_source = pm.j2.loader.get_source(pm.j2, "dhcpd-hosts.conf.j2")[0]
+    subnet_by_name = {subnet['name']: subnet for subnet in subnets}
+    subnet_by_name[unassigned_shard] = {'name': unassigned_shard, 'gateway_ip': None, 'dns_servers': []}
+    os.makedirs(new_shard_dir, exist_ok=True)
+    changed = []
+    for name, shard_hosts in shards.items():
+        subnet = subnet_by_name[name]
+        signature = _shard_signature(shard_hosts, subnet, template_source)
+        if signatures.get(name) == signature and os.path.exists(f"{shard_dir}/{name}.conf"):
+            continue
+        content = template.render(hosts=shard_hosts, subnet=subnet,
+                                  pxefilename=pm.settings['pxefilename'],
+                                  boot_mode=pm.settings['boot_mode'],
+                                  ipxe_filename=pm.settings['ipxe_filename'],
+                                  ipxe_script_url=pm.ipxe_script_url)
+        with open(f"{new_shard_dir}/{name}.conf", mode="w") as file:
+            file.write(content)
+        signatures[name] = signature
+        changed.append(name)
+    logger.info("    -------- %d of %d dhcpd host shards changed %s", len(changed), len(shards), " ".join(changed))
+
+    # get the main dhcpd.conf template, which only includes the shards
     template = pm.j2.get_template("dhcpd.conf.j2")
-    content = template.render(hosts=hosts)
+    content = template.render(
+        version=version,
+        subnets=[dict(subnet, include_file=f"{shard_dir}/{subnet['name']}.conf") for subnet in subnets],
+        unassigned_include_file=f"{shard_dir}/{unassigned_shard}.conf" if shards[unassigned_shard] else None)
     file = open(f"{new_registration_file}", mode="w")
     file.write(content)
     file.close()
-    
-    # now use sudo root authentication to copy the updated
-    # dhcpd.conf / registration to correct location
-    command = f"sudo cp {new_registration_file} {pm.settings['registration_file']}"
-    subprocess.run(command, shell=True)
+
+    # now use sudo root authentication to copy the updated shards and
+    # dhcpd.conf / registration to correct location.  Each file is copied
+    # next to its target and renamed over it, so dhcpd never sees a
+    # partially written file.  The shards are installed first so the
+    # main file never includes a shard that does not exist yet
+    commands = [f"sudo mkdir -p {shard_dir}"]
+    for name in changed:
+        commands.append(f"sudo cp {new_shard_dir}/{name}.conf {shard_dir}/{name}.conf.new && "
+                        f"sudo mv -f {shard_dir}/{name}.conf.new {shard_dir}/{name}.conf")
+    registration_file = pm.settings['registration_file']
+    commands.append(f"sudo cp {new_registration_file} {registration_file}.new && "
+                    f"sudo mv -f {registration_file}.new {registration_file}")
+    result = subprocess.run(" && ".join(commands), shell=True)
+
+    # only remember the new signatures once the shards are installed
+    if result.returncode == 0:
+        os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+        with open(f"{state_file}.new", mode="w") as file:
+            yaml.safe_dump(signatures, file)
+        os.replace(f"{state_file}.new", state_file)
+        _remember_registry(version)
+        pm.record_artifact('registration', *pm.registration_inputs())
+        pm.save_build_manifest()
+        if pm.settings['inventory_dir']:
+            try:
+                pm.export_inventory()
+            except OSError as e:
+                logger.warning("    WARNING: could not update the ansible inventory: %s", e)
+    return changed
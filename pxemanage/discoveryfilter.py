@@ -0,0 +1,128 @@
+"""pxemanage module
+
+discoveryfilter submodule
+
+Contents
+--------
+
+A filter in front of host registration for the DHCPDISCOVER noise of
+machines we will never register.  BMCs, desktops and hosts stuck in a
+pxe boot loop on our segment ask for a lease every few seconds, and
+without the filter every one of them costs two scans of the hosts
+database and another question to the operator.
+
+The verdict on each mac address is cached in a bounded LRU dictionary
+with a time to live, so repeated discovers cost a single dictionary
+lookup:
+
+    new        - not registered, registration goes ahead
+    registered - already registered, ignored
+    declined   - the operator declined to register it, ignored for
+                 the (long) declined time to live
+    ignored    - in the discovery_ignore list of mac addresses
+    denied     - starts with one of the discovery_deny_prefixes, e.g.
+                 the OUI of the BMC network cards
+
+"""
+import time
+from collections import OrderedDict
+import pxemanage as pm
+
+
+class DiscoveryFilter:
+    """Cached verdicts on the mac addresses of discovered hosts."""
+    def __init__(self, ignore=(), deny_prefixes=(), ttl=300.0, declined_ttl=86400.0,
+                 max_entries=4096, clock=time.monotonic):
+        """Define class constructor for the discovery filter.
+
+        Parameters
+        ----------
+        ignore - mac addresses that are never registered.
+        deny_prefixes - mac address prefixes (e.g. an OUI '00:25:90')
+          of hosts that are never registered.
+        ttl - seconds a verdict is cached.
+        declined_ttl - seconds a host the operator declined is ignored.
+        max_entries - the most mac addresses cached, the least recently
+          seen are dropped first.
+        clock - function returning the current time in seconds.
+        """
+        self.ignore = {macaddress.lower() for macaddress in ignore}
+        self.deny_prefixes = tuple(prefix.lower() for prefix in deny_prefixes)
+        self.ttl = ttl
+        self.declined_ttl = declined_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # mac address to (expires, verdict), least recently seen first
+        self._verdicts = OrderedDict()
+
+    def _remember(self, key, verdict, ttl):
+        """Cache the verdict on a lower case mac address."""
+        self._verdicts[key] = (self.clock() + ttl, verdict)
+        self._verdicts.move_to_end(key)
+        while len(self._verdicts) > self.max_entries:
+            self._verdicts.popitem(last=False)
+
+    def verdict(self, macaddress):
+        """Return the verdict on a discovered mac address, see the
+        module description.
+        """
+        key = macaddress.lower()
+        cached = self._verdicts.get(key)
+        if cached is not None:
+            if cached[0] > self.clock():
+                self._verdicts.move_to_end(key)
+                return cached[1]
+            del self._verdicts[key]
+
+        if key in self.ignore:
+            verdict = "ignored"
+        elif self.deny_prefixes and key.startswith(self.deny_prefixes):
+            verdict = "denied"
+        elif pm.is_registered(macaddress):
+            verdict = "registered"
+        else:
+            verdict = "new"
+        self._remember(key, verdict, self.ttl)
+        return verdict
+
+    def admit(self, macaddress):
+        """Return True if a discovered mac address should go on to
+        registration.
+        """
+        return self.verdict(macaddress) == "new"
+
+    def decline(self, macaddress):
+        """The operator declined to register a host, ignore it for the
+        declined time to live.
+        """
+        self._remember(macaddress.lower(), "declined", self.declined_ttl)
+
+    def registered(self, macaddress):
+        """A host was registered (or is waiting to be)."""
+        self._remember(macaddress.lower(), "registered", self.ttl)
+
+    def forget(self, macaddress):
+        """Drop the cached verdict on a host, e.g. once it is
+        unregistered.
+        """
+        self._verdicts.pop(macaddress.lower(), None)
+
+
+def build_discovery_filter(ignore=(), deny_prefixes=()):
+    """Create a discovery filter from the discovery settings.
+
+    Parameters
+    ----------
+    ignore - mac addresses to ignore besides the discovery_ignore setting.
+    deny_prefixes - mac address prefixes to deny besides the
+      discovery_deny_prefixes setting.
+
+    Returns
+    -------
+    discovery_filter - the DiscoveryFilter.
+    """
+    return DiscoveryFilter(list(pm.settings['discovery_ignore']) + list(ignore),
+                           list(pm.settings['discovery_deny_prefixes']) + list(deny_prefixes),
+                           ttl=pm.settings['discovery_ttl'],
+                           declined_ttl=pm.settings['discovery_declined_ttl'],
+                           max_entries=pm.settings['discovery_cache_size'])
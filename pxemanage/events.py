@@ -0,0 +1,355 @@
+"""pxemanage module
+
+events submodule
+
+Contents
+--------
+
+Functions for reading the system events file (syslog).  The register
+and reinstall monitors react to DHCPDISCOVER and tftp RRQ events that
+the dhcpd and tftpd services log there, and in the ipxe boot mode to
+the fetches of the boot files that apache logs (its access log piped
+to syslog, e.g. CustomLog "|/usr/bin/logger -t apache2" combined).
+
+While following the system events file we keep a small checkpoint
+file recording the inode and byte offset of the last event we
+handled.  When pxemanage is restarted we use the checkpoint to replay
+any events that were logged while we were not running, before we
+switch over to live tailing of the file.  Without this a host that
+started its install while the monitor was down would never have its
+bootconfig set back to a local boot, and would reinstall in a loop.
+
+Every reader of the system events (the monitors, the daemon and the
+boot analysis) recognizes events with parse_system_event, so they all
+agree on what a DHCP, tftp or kickstart event looks like.
+
+"""
+import calendar
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+import yaml
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# size of the read buffer used for the system events file.  A large
+# buffer lets us replay a backlog of missed events at full speed.
+event_buffer_size = 1024 * 1024
+
+# number of lines handled between checkpoint saves while we are
+# catching up on a backlog, we always save when we reach the end of
+# the file as well
+checkpoint_interval = 1000
+
+# a system event we recognize.  The kind is one of discover, offer,
+# request, ack (dhcpd), pxelinux, bootconfig, kernel, initrd, tftp
+# (tftpd read requests) or kickstart (a host fetching its ks files from
+# apache).  In the ipxe boot mode the bootconfig, kernel and initrd are
+# fetched from apache, and are recognized from the access log as well.
+# The fields that the event does not log are None
+SystemEvent = namedtuple('SystemEvent', ['kind', 'macaddress', 'ipaddress', 'filename'])
+
+dhcp_event_pattern = re.compile(
+    r"DHCP(DISCOVER|OFFER|REQUEST|ACK)\s+(?:(?:on|for)\s+(\d+\.\d+\.\d+\.\d+)\s+.*?)?"
+    r"(?:from|to)\s+(..:..:..:..:..:..)")
+tftp_event_pattern = re.compile(r"RRQ\s+from\s+(\d+\.\d+\.\d+\.\d+)\s+filename\s+(\S+)")
+http_event_pattern = re.compile(r"(\d+\.\d+\.\d+\.\d+)\s+\S+\s+\S+\s+\[[^\]]*\]\s+\"GET\s+/(\S*)")
+
+# the timestamp formats of traditional and RFC 3339 syslog lines, and
+# of the apache access log
+traditional_time_pattern = re.compile(r"^([A-Z][a-z]{2})\s+(\d{1,2})\s+(\d\d):(\d\d):(\d\d)\s")
+rfc3339_time_pattern = re.compile(r"^(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:\.\d+)?)(Z|[+-]\d\d:?\d\d)?\s")
+apache_time_pattern = re.compile(r"\[(\d\d)/([A-Z][a-z]{2})/(\d{4}):(\d\d):(\d\d):(\d\d)\s+([+-]\d{4})\]")
+months = {name: number for number, name in enumerate(calendar.month_abbr) if name}
+
+
+def load_event_checkpoint():
+    """Read the system events checkpoint saved by a previous run
+    of the monitors.
+
+    Returns
+    -------
+    checkpoint - a tuple of (inode, offset) of the system events file
+      position last handled, or None if no checkpoint has been saved.
+    """
+    checkpoint_file = pm.settings['system_event_checkpoint_file']
+    try:
+        with open(checkpoint_file) as file:
+            checkpoint = yaml.safe_load(file)
+    except FileNotFoundError:
+        return None
+
+    if not checkpoint:
+        return None
+    return checkpoint['inode'], checkpoint['offset']
+
+
+def save_event_checkpoint(inode, offset):
+    """Save the position of the last handled system event.  The
+    checkpoint is written to a temporary file and renamed into place
+    so a crash never leaves a partially written checkpoint behind.
+
+    Parameters
+    ----------
+    inode - the inode of the system events file being followed.
+    offset - the byte offset just past the last handled event line.
+    """
+    checkpoint_file = pm.settings['system_event_checkpoint_file']
+    os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
+    new_checkpoint_file = f"{checkpoint_file}.tmp"
+    with open(new_checkpoint_file, mode="w") as file:
+        yaml.safe_dump({'inode': inode, 'offset': offset}, file)
+    os.replace(new_checkpoint_file, checkpoint_file)
+
+
+def parse_system_event(line, pxefilename=None):
+    """Recognize a system event line that pxemanage acts on.  Cheap
+    substring tests come first, so the many unrelated lines of syslog
+    are rejected without running a regular expression.
+
+    Parameters
+    ----------
+    line - a line of the system events file (syslog).
+    pxefilename - the name of the pxelinux boot loader, by default the
+      pxefilename setting.
+
+    Returns
+    -------
+    event - a SystemEvent, or None if the line is not an event we know.
+    """
+    if "DHCP" in line:
+        match = dhcp_event_pattern.search(line)
+        if match:
+            kind, ipaddress, macaddress = match.groups()
+            return SystemEvent(kind.lower(), macaddress, ipaddress, None)
+    elif "RRQ" in line:
+        match = tftp_event_pattern.search(line)
+        if match:
+            ipaddress, filename = match.groups()
+            if pxefilename is None:
+                pxefilename = pm.settings['pxefilename']
+            basename = os.path.basename(filename)
+            if filename.lstrip("/") == pxefilename or basename == pxefilename:
+                kind = "pxelinux"
+            elif "pxelinux.cfg/" in filename:
+                kind = "bootconfig"
+            elif basename.startswith("initrd"):
+                kind = "initrd"
+            elif basename.startswith("vmlinuz") or basename.startswith("linux"):
+                kind = "kernel"
+            else:
+                kind = "tftp"
+            return SystemEvent(kind, None, ipaddress, filename)
+    elif "GET /" in line:
+        match = http_event_pattern.search(line)
+        if match:
+            ipaddress, filename = match.groups()
+            basename = os.path.basename(filename)
+            if filename.startswith("ks/"):
+                kind = "kickstart"
+            elif "pxelinux.cfg/" in filename:
+                kind = "bootconfig"
+            elif basename.startswith("initrd"):
+                kind = "initrd"
+            elif basename.startswith("vmlinuz") or basename.startswith("linux"):
+                kind = "kernel"
+            else:
+                # the iso and any other page served by apache
+                return None
+            return SystemEvent(kind, None, ipaddress, filename)
+    return None
+
+
+def parse_event_time(line, year=None):
+    """Return the time a system event was logged, from the timestamp at
+    the start of a syslog line or of an apache access log entry.
+
+    Parameters
+    ----------
+    line - the system event line.
+    year - the year of traditional syslog timestamps, which do not log
+      it, by default the current year.
+
+    Returns
+    -------
+    time - the seconds since the epoch, or None if the line has no
+      timestamp we know.
+    """
+    match = traditional_time_pattern.match(line)
+    if match:
+        month, day, hour, minute, second = match.groups()
+        if month not in months:
+            return None
+        return time.mktime((year or time.localtime().tm_year, months[month], int(day),
+                            int(hour), int(minute), int(second), 0, 0, -1))
+    match = rfc3339_time_pattern.match(line)
+    if match:
+        timestamp, zone = match.groups()
+        if zone == "Z":
+            zone = "+00:00"
+        logged = datetime.fromisoformat(timestamp.replace(" ", "T") + (zone or ""))
+        return logged.timestamp()
+    match = apache_time_pattern.search(line)
+    if match and match.group(2) in months:
+        day, month, year, hour, minute, second, zone = match.groups()
+        logged = datetime.strptime(f"{year}-{months[month]:02d}-{day} {hour}:{minute}:{second} {zone}",
+                                   "%Y-%m-%d %H:%M:%S %z")
+        return logged.timestamp()
+    return None
+
+
+def replay_system_events_file(filename):
+    """Setup a generator that yields every line of a (historical)
+    system events file as fast as it can be read, and then stops.
+    This is used to process logs offline, no checkpoint is read or
+    updated.
+
+    Parameters
+    ----------
+    filename - the system events (syslog) file to replay.
+
+    Returns
+    -------
+    system event string - Each yield returns the next line of the file.
+    """
+    with open(filename, mode="rb", buffering=event_buffer_size) as file:
+        for line in file:
+            yield line.decode(errors="replace")
+
+
+def _rotated_file_offset(filename, inode, offset):
+    """Search for the rotated copy of the system events file that a
+    checkpoint was taken in, e.g. syslog.1 after logrotate has run.
+
+    Returns
+    -------
+    rotated filename - the name of the rotated file if it is the file
+      the checkpoint refers to and it still has unread events, None
+      otherwise.
+    """
+    rotated_file = f"{filename}.1"
+    try:
+        info = os.stat(rotated_file)
+    except FileNotFoundError:
+        return None
+    if info.st_ino == inode and info.st_size > offset:
+        return rotated_file
+    return None
+
+
+def follow_system_events_file(checkpoint=True, idle=False):
+    """From: https://medium.com/@aliasav/how-follow-a-file-in-python-tail-f-in-python-bca026a901cf
+    Setup up generator that yields new lines of the system events file
+    as they are logged.  This works by actually never returning, if it
+    performs a read but the file is at the end of the file, it sleeps
+    a bit and trys to keep reading again.
+
+    If a checkpoint from a previous run exists, we first replay all of
+    the lines logged since that checkpoint at full speed (no sleeps,
+    large buffered reads), including the tail of the rotated file if
+    the log was rotated while we were not running.  Without a
+    checkpoint we seek to the end of the file and only yield new
+    events.  The checkpoint is updated as lines are handled.
+
+    Parameters
+    ----------
+    checkpoint - if True (the default) the saved checkpoint is used
+      and updated, if False we simply tail the file from its end.
+    idle - if True an empty string is yielded each time we wait for
+      new events, so the caller gets a chance to do periodic work
+      while the system events file is quiet.
+
+    Returns
+    -------
+    system event string - Each yield retuns a line from the system events
+       log (syslog), as soon as it become available.
+    """
+    filename = pm.settings['system_event_file']
+    saved = load_event_checkpoint() if checkpoint else None
+
+    # replay anything left unread in the rotated file first
+    if saved:
+        rotated_file = _rotated_file_offset(filename, *saved)
+        if rotated_file:
+            logger.info("    -------- replaying missed system events from %s", rotated_file)
+            with open(rotated_file, mode="rb", buffering=event_buffer_size) as file:
+                file.seek(saved[1])
+                for line in file:
+                    yield line.decode(errors="replace")
+
+    # open the systems events file (syslog) and determine where to
+    # begin reading it
+    systemfile = open(filename, mode="rb", buffering=event_buffer_size)
+    info = os.fstat(systemfile.fileno())
+    inode = info.st_ino
+    if saved and saved[0] == inode and saved[1] <= info.st_size:
+        offset = saved[1]
+    elif saved and saved[0] != inode:
+        # file was rotated since the checkpoint, everything in the new
+        # file was logged while we were not running
+        offset = 0
+    else:
+        offset = info.st_size
+    if offset < info.st_size:
+        logger.info("    -------- replaying %d bytes of missed system events", info.st_size - offset)
+    systemfile.seek(offset)
+
+    # start infinite loop
+    handled = 0
+    rotated_size = None
+    while True:
+        # read next line of file
+        line = systemfile.readline()
+
+        # only yield complete lines, the checkpoint is saved once the
+        # caller has asked for the next line so it never records an
+        # event that was not yet handled
+        if line.endswith(b"\n"):
+            offset += len(line)
+            yield line.decode(errors="replace")
+            handled += 1
+            if checkpoint and handled >= checkpoint_interval:
+                save_event_checkpoint(inode, offset)
+                handled = 0
+            continue
+
+        # at the end of the file, back up over any partially written line
+        if line:
+            systemfile.seek(offset)
+        if checkpoint and handled:
+            save_event_checkpoint(inode, offset)
+            handled = 0
+
+        # if the file was rotated, switch to the new file once we have
+        # read everything from the old one
+        try:
+            rotated = os.stat(filename).st_ino != inode
+        except FileNotFoundError:
+            rotated = False
+        if rotated and line:
+            # the last line of the rotated file may never be finished,
+            # it is taken as complete once the file stopped growing
+            size = os.fstat(systemfile.fileno()).st_size
+            if size == rotated_size:
+                offset += len(line)
+                yield line.decode(errors="replace") + "\n"
+                line = b""
+            rotated_size = size
+        if rotated and not line:
+            systemfile.close()
+            systemfile = open(filename, mode="rb", buffering=event_buffer_size)
+            inode = os.fstat(systemfile.fileno()).st_ino
+            offset = 0
+            rotated_size = None
+            continue
+
+        # sleep if file hasn't been updated
+        time.sleep(0.5)
+        if idle:
+            yield ""
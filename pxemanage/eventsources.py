@@ -0,0 +1,309 @@
+"""pxemanage module
+
+eventsources submodule
+
+Contents
+--------
+
+The sources of the system events the monitors and the daemon act on.
+Each source has an events method returning an iterator of system event
+lines in the format of the system events file (syslog), so they can be
+given to parse_system_event.
+
+    file  - follow the system_event_file (syslog) as rsyslog writes
+            it, with the checkpoint replay of the events submodule.
+    udp   - receive syslog messages as datagrams on the
+            syslog_listen_address (host:port).
+    unix  - receive syslog messages as datagrams on the unix socket
+            syslog_socket.
+
+The source is chosen with the event_source setting.  The syslog
+receivers accept RFC 3164 messages (as sent by the syslog() library
+call and by rsyslog forwarding, with or without a hostname) and RFC
+5424 messages.  An event then reaches the monitors as soon as it is
+sent instead of after rsyslog wrote it to disk and the next poll of
+the file, e.g. with an rsyslog forwarding rule
+
+    if $programname == 'dhcpd' or $programname == 'in.tftpd' then @127.0.0.1:5514
+
+Events sent while no receiver is listening are lost, there is no
+checkpoint replay for the syslog receivers.
+
+"""
+import logging
+import os
+import re
+import socket
+import time
+from collections import namedtuple
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# largest syslog datagram we receive, RFC 5424 asks receivers to take
+# at least 2048 bytes, we take the largest udp payload
+syslog_datagram_size = 65535
+
+# receive buffer asked for, so a burst of events (a rack booting at
+# once) is not dropped while the monitor is busy with an event
+syslog_receive_buffer = 4 * 1024 * 1024
+
+# seconds the syslog receivers wait for a datagram before an idle
+# caller is given an empty string to do periodic work
+syslog_idle_timeout = 0.5
+
+# a syslog message, the fields not sent are None
+SyslogMessage = namedtuple('SyslogMessage',
+                           ['facility', 'severity', 'timestamp', 'hostname', 'tag', 'message'])
+
+priority_pattern = re.compile(r"^<(\d{1,3})>")
+rfc5424_header_pattern = re.compile(r"^1 (\S+) (\S+) (\S+) (\S+) (\S+) ")
+rfc3164_timestamp_pattern = re.compile(r"^([A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) ")
+rfc3164_tag_pattern = re.compile(r"^[^\s:\[]+(?:\[[^\]]*\])?:")
+
+
+def _skip_structured_data(text):
+    """Return the text following the structured data of an RFC 5424
+    message, which is either - or a run of [id param="value" ...]
+    elements whose values may contain escaped ] characters.
+    """
+    if text.startswith("-"):
+        return text[1:]
+    position = 0
+    while position < len(text) and text[position] == "[":
+        position += 1
+        while position < len(text) and text[position] != "]":
+            if text[position] == "\\":
+                position += 1
+            elif text[position] == '"':
+                # quoted parameter value
+                position += 1
+                while position < len(text) and text[position] != '"':
+                    if text[position] == "\\":
+                        position += 1
+                    position += 1
+            position += 1
+        position += 1
+    return text[position:]
+
+
+def parse_syslog_message(data):
+    """Parse a syslog datagram.
+
+    Parameters
+    ----------
+    data - the bytes (or string) received.
+
+    Returns
+    -------
+    message - a SyslogMessage, the timestamp, hostname and tag are None
+      when the message does not send them.
+    """
+    if isinstance(data, bytes):
+        data = data.decode(errors="replace")
+    text = data.rstrip("\0\r\n").replace("\n", " ")
+    facility = severity = None
+    match = priority_pattern.match(text)
+    if match:
+        priority = int(match.group(1))
+        facility, severity = priority // 8, priority % 8
+        text = text[match.end():]
+
+    # RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID SD [MSG]
+    match = rfc5424_header_pattern.match(text)
+    if match:
+        timestamp, hostname, app, procid, msgid = (None if field == "-" else field
+                                                   for field in match.groups())
+        tag = app
+        if tag and procid:
+            tag = f"{tag}[{procid}]"
+        message = _skip_structured_data(text[match.end():])
+        message = message[1:] if message.startswith(" ") else message
+        if message.startswith("\ufeff"):
+            message = message[1:]
+        return SyslogMessage(facility, severity, timestamp, hostname, tag, message)
+
+    # RFC 3164: TIMESTAMP [HOSTNAME] TAG: MSG, the syslog() library
+    # call does not send a hostname
+    timestamp = hostname = tag = None
+    match = rfc3164_timestamp_pattern.match(text)
+    if match:
+        timestamp = match.group(1)
+        text = text[match.end():]
+        if not rfc3164_tag_pattern.match(text):
+            hostname, _, rest = text.partition(" ")
+            if rfc3164_tag_pattern.match(rest):
+                text = rest
+            else:
+                hostname = None
+    match = rfc3164_tag_pattern.match(text)
+    if match:
+        tag = match.group(0)[:-1]
+        text = text[match.end():].lstrip(" ")
+    return SyslogMessage(facility, severity, timestamp, hostname, tag, text)
+
+
+def syslog_line(message, default_hostname=None):
+    """Format a syslog message as a line of the system events file,
+    the way rsyslog writes it.
+
+    Parameters
+    ----------
+    message - the SyslogMessage.
+    default_hostname - the hostname used if the message has none, by
+      default the name of this machine.
+
+    Returns
+    -------
+    line - the system event line, ending with a newline.
+    """
+    timestamp = message.timestamp or time.strftime("%b %e %H:%M:%S")
+    hostname = message.hostname or default_hostname or socket.gethostname()
+    if message.tag:
+        return f"{timestamp} {hostname} {message.tag}: {message.message}\n"
+    return f"{timestamp} {hostname} {message.message}\n"
+
+
+class FileEventSource:
+    """Follow the system events file (syslog)."""
+    name = "file"
+
+    def __init__(self, checkpoint=True):
+        """Define class constructor for the file event source.
+
+        Parameters
+        ----------
+        checkpoint - if True (the default) events missed since the saved
+          checkpoint are replayed first, see follow_system_events_file.
+        """
+        self.checkpoint = checkpoint
+
+    def events(self, idle=False):
+        """Return an iterator of the system event lines, yielding an
+        empty string while waiting if idle is True.
+        """
+        return pm.follow_system_events_file(checkpoint=self.checkpoint, idle=idle)
+
+    def close(self):
+        """Nothing to release, the file is closed with its iterator."""
+
+
+class SyslogEventSource:
+    """Receive syslog messages as datagrams.  The socket is bound when
+    the source is created, so messages sent from then on are kept in
+    the socket buffer until they are read.
+    """
+    name = "syslog"
+
+    def __init__(self, family, address):
+        """Define class constructor for the syslog receiver.
+
+        Parameters
+        ----------
+        family - socket.AF_INET for udp or socket.AF_UNIX.
+        address - the (host, port) or unix socket path to bind.
+        """
+        self.family = family
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, syslog_receive_buffer)
+        except OSError:
+            pass
+        if family == socket.AF_UNIX:
+            os.makedirs(os.path.dirname(address) or ".", exist_ok=True)
+            if os.path.exists(address):
+                os.remove(address)
+        self.sock.bind(address)
+        if family == socket.AF_UNIX:
+            # the dhcpd and tftpd senders do not run as our user
+            os.chmod(address, 0o666)
+        self.address = self.sock.getsockname()
+        logger.info("    -------- receiving system events on %s", self.address)
+
+    def receive(self, timeout=None):
+        """Receive one syslog datagram.
+
+        Parameters
+        ----------
+        timeout - the most seconds to wait, None waits for ever.
+
+        Returns
+        -------
+        line - the system event line of the message, or an empty string
+          if none arrived within the timeout.
+        """
+        self.sock.settimeout(timeout)
+        try:
+            data, sender = self.sock.recvfrom(syslog_datagram_size)
+        except socket.timeout:
+            return ""
+        # messages forwarded without a hostname are from the sender
+        hostname = sender[0] if self.family == socket.AF_INET else None
+        return syslog_line(parse_syslog_message(data), hostname)
+
+    def events(self, idle=False):
+        """Return an iterator of the system event lines, yielding an
+        empty string while waiting if idle is True.
+        """
+        timeout = syslog_idle_timeout if idle else None
+        try:
+            while True:
+                line = self.receive(timeout)
+                if line or idle:
+                    yield line
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the socket, removing a unix socket."""
+        if self.sock.fileno() < 0:
+            return
+        self.sock.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def udp_event_source():
+    """Create a syslog receiver on the syslog_listen_address."""
+    host, _, port = pm.settings['syslog_listen_address'].rpartition(":")
+    return SyslogEventSource(socket.AF_INET, (host or "0.0.0.0", int(port)))
+
+
+def unix_event_source():
+    """Create a syslog receiver on the syslog_socket."""
+    return SyslogEventSource(socket.AF_UNIX, pm.settings['syslog_socket'])
+
+
+# the available system event sources by name
+event_sources = {
+    'file': FileEventSource,
+    'udp': udp_event_source,
+    'unix': unix_event_source,
+}
+
+
+def get_event_source(name=None):
+    """Create a system event source.
+
+    Parameters
+    ----------
+    name - the source name, by default the event_source setting.
+
+    Returns
+    -------
+    source - the system event source.
+    """
+    name = name or pm.settings['event_source']
+    if name not in event_sources:
+        raise ValueError(f"unknown event source {name}, expected one of {', '.join(event_sources)}")
+    return event_sources[name]()
+
+
+def system_events(idle=False):
+    """Return an iterator of the system event lines of the configured
+    event source, yielding an empty string while waiting if idle is
+    True.
+    """
+    return get_event_source().events(idle)
@@ -0,0 +1,280 @@
+"""pxemanage module
+
+facts submodule
+
+Contents
+--------
+
+Gather a fixed set of hardware facts from the managed hosts over ssh
+(with the management identity), and cache them locally, so checking the
+disks, nics and memory of a rack does not mean logging in to every
+host by hand.  The facts of a host are
+
+    hostname, kernel, os   - what the running system reports
+    cpus                   - the number of online cpus
+    memory_mb              - the total memory
+    disks                  - name and size_gb of every whole disk
+    nics                   - name, macaddress and speed_mbps (-1 when
+                             the link is down) of every network interface
+
+Hosts are contacted concurrently, at most facts_parallel at a time,
+and each ssh command is given facts_timeout seconds.  The facts are
+kept in the facts_cache_file with the time they were gathered, and are
+used instead of contacting the host again for facts_ttl seconds.  The
+reinstall preflight checks the (cached) facts against the minimum disk
+and memory sizes before a host is rebooted into an install.
+
+"""
+import json
+import logging
+import os
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# the shell script run on each host, printing one key=value fact per line
+fact_script = r"""
+echo "hostname=$(hostname)"
+echo "kernel=$(uname -r)"
+echo "cpus=$(nproc)"
+awk '/^MemTotal:/ {print "memory_kb=" $2}' /proc/meminfo
+. /etc/os-release 2>/dev/null && echo "os=$PRETTY_NAME"
+lsblk -dnbo NAME,SIZE,TYPE 2>/dev/null | awk '$3 == "disk" {print "disk=" $1 " " $2}'
+for nic in /sys/class/net/*; do
+    name=${nic##*/}
+    [ "$name" = lo ] && continue
+    echo "nic=$name $(cat $nic/address) $(cat $nic/speed 2>/dev/null || echo -1)"
+done
+"""
+
+
+def parse_facts(output):
+    """Parse the output of the fact script.
+
+    Parameters
+    ----------
+    output - the key=value lines printed by the fact script.
+
+    Returns
+    -------
+    facts - a dictionary of the facts of the host.
+    """
+    facts = {'disks': [], 'nics': []}
+    for line in output.splitlines():
+        key, _, value = line.partition("=")
+        value = value.strip()
+        if key in ('hostname', 'kernel', 'os'):
+            facts[key] = value
+        elif key == 'cpus':
+            facts['cpus'] = int(value)
+        elif key == 'memory_kb':
+            facts['memory_mb'] = int(value) // 1024
+        elif key == 'disk':
+            name, size = value.split()
+            facts['disks'].append({'name': name, 'size_gb': int(size) // 1000 ** 3})
+        elif key == 'nic':
+            fields = value.split()
+            if len(fields) == 3:
+                speed = int(fields[2]) if fields[2].lstrip("-").isdigit() else -1
+                facts['nics'].append({'name': fields[0], 'macaddress': fields[1], 'speed_mbps': speed})
+    return facts
+
+
+def run_fact_script(host, timeout):
+    """Run the fact script on a host over ssh.
+
+    Parameters
+    ----------
+    host - the Host to gather facts from.
+    timeout - the most seconds the ssh command may take.
+
+    Returns
+    -------
+    output - the output of the fact script.
+
+    Raises
+    ------
+    RuntimeError - if the host could not be reached in time or the
+      script failed.
+    """
+    command = ["ssh", "-i", pm.settings['identity']] + shlex.split(pm.settings['ssh_args']) + [
+        "-o", "BatchMode=yes", "-o", f"ConnectTimeout={max(1, int(timeout))}",
+        f"{pm.settings['username']}@{host.ipaddress}", fact_script]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"no answer within {timeout} seconds")
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+                           else f"ssh exit status {result.returncode}")
+    return result.stdout
+
+
+def load_facts_cache():
+    """Return the cached facts, a dictionary of hostname to a dictionary
+    with the time the facts were gathered and the facts.
+    """
+    try:
+        with open(pm.settings['facts_cache_file']) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_facts_cache(cache):
+    """Save the cached facts, written to a temporary file and renamed
+    into place.
+    """
+    cache_file = pm.settings['facts_cache_file']
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    new_cache_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(new_cache_file, mode="w") as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+    os.replace(new_cache_file, cache_file)
+
+
+def cached_facts(hostname, ttl=None, cache=None):
+    """Return the cached facts of a host if they are fresh.
+
+    Parameters
+    ----------
+    hostname - the host.
+    ttl - the most seconds ago the facts may have been gathered, by
+      default the facts_ttl setting.
+    cache - the loaded facts cache, by default it is read.
+
+    Returns
+    -------
+    facts - the facts of the host, or None if none are cached or they
+      are older than the ttl.
+    """
+    ttl = pm.settings['facts_ttl'] if ttl is None else ttl
+    entry = (load_facts_cache() if cache is None else cache).get(hostname)
+    if not entry or time.time() - entry['gathered'] > ttl:
+        return None
+    return entry['facts']
+
+
+def gather_facts(hostnames, parallel=None, timeout=None, ttl=None, refresh=False):
+    """Gather the facts of hosts, contacting only the hosts whose cached
+    facts are missing or stale.
+
+    Parameters
+    ----------
+    hostnames - the registered hosts to gather facts of.
+    parallel - the most hosts contacted at once, by default the
+      facts_parallel setting.
+    timeout - the most seconds given to each host, by default the
+      facts_timeout setting.
+    ttl - cached facts younger than this many seconds are used, by
+      default the facts_ttl setting.
+    refresh - if True every host is contacted.
+
+    Returns
+    -------
+    (facts, errors) - dictionaries of hostname to the facts of the hosts
+      and to the error of the hosts that could not be gathered from.
+    """
+    parallel = parallel or pm.settings['facts_parallel']
+    timeout = timeout or pm.settings['facts_timeout']
+    cache = load_facts_cache()
+    facts = {}
+    stale = []
+    for hostname in hostnames:
+        host_facts = None if refresh else cached_facts(hostname, ttl, cache)
+        if host_facts is None:
+            stale.append(hostname)
+        else:
+            facts[hostname] = host_facts
+    logger.info("======== Gather facts of %d hosts, %d cached ========", len(stale), len(facts))
+
+    def gather(hostname):
+        try:
+            return hostname, parse_facts(run_fact_script(pm.hosts[hostname], timeout)), None
+        except (RuntimeError, ValueError) as e:
+            return hostname, None, str(e)
+
+    errors = {}
+    if stale:
+        with ThreadPoolExecutor(max_workers=min(parallel, len(stale))) as executor:
+            for hostname, host_facts, error in executor.map(gather, stale):
+                if error:
+                    logger.warning("    WARNING: could not gather facts of host %s: %s", hostname, error,
+                                   extra={'hostname': hostname})
+                    errors[hostname] = error
+                    continue
+                logger.debug("    -------- gathered facts of host %s", hostname)
+                facts[hostname] = host_facts
+                cache[hostname] = {'gathered': time.time(), 'facts': host_facts}
+        save_facts_cache(cache)
+    return facts, errors
+
+
+def preflight_problems(facts, min_disk_gb=None, min_memory_mb=None):
+    """Check the facts of a host before it is reinstalled.
+
+    Parameters
+    ----------
+    facts - the facts of the host.
+    min_disk_gb - the size of the smallest disk we install on, by
+      default the preflight_min_disk_gb setting.
+    min_memory_mb - the least memory we install on, by default the
+      preflight_min_memory_mb setting.
+
+    Returns
+    -------
+    problems - a list of the reasons the host should not be reinstalled,
+      empty if it passed.
+    """
+    min_disk_gb = pm.settings['preflight_min_disk_gb'] if min_disk_gb is None else min_disk_gb
+    min_memory_mb = pm.settings['preflight_min_memory_mb'] if min_memory_mb is None else min_memory_mb
+    problems = []
+    if not any(disk['size_gb'] >= min_disk_gb for disk in facts['disks']):
+        problems.append(f"no disk of at least {min_disk_gb} GB")
+    if facts.get('memory_mb', 0) < min_memory_mb:
+        problems.append(f"{facts.get('memory_mb', 0)} MB memory, less than {min_memory_mb} MB")
+    if not facts['nics']:
+        problems.append("no network interface")
+    return problems
+
+
+def preflight_reinstall(hostnames):
+    """Check the hosts about to be reinstalled against their facts,
+    gathering the facts of hosts that have none cached.  Hosts whose
+    facts can not be gathered are kept, they may be down and be power
+    cycled by a BMC backend.
+
+    Parameters
+    ----------
+    hostnames - the hosts to be reinstalled.
+
+    Returns
+    -------
+    hostnames - the hosts that passed the preflight checks.
+    """
+    logger.info("======== Reinstall preflight checks ========")
+    # hosts that are not registered are left for the reinstall to reject
+    facts, errors = gather_facts([hostname for hostname in hostnames if hostname in pm.hosts])
+    passed = []
+    for hostname in hostnames:
+        if hostname not in pm.hosts:
+            passed.append(hostname)
+            continue
+        if hostname in errors:
+            logger.warning("    WARNING: host %s has no facts, reinstalling it unchecked", hostname,
+                           extra={'hostname': hostname})
+            passed.append(hostname)
+            continue
+        problems = preflight_problems(facts[hostname])
+        if problems:
+            logger.warning("    WARNING: not reinstalling host %s: %s", hostname, ", ".join(problems),
+                           extra={'hostname': hostname})
+            continue
+        passed.append(hostname)
+    return passed
@@ -0,0 +1,293 @@
+"""pxemanage module
+
+generation submodule
+
+Contents
+--------
+
+Functions for publishing changes to the served boot configuration
+(pxelinux.cfg) and kickstart (ks) trees atomically.  Each tree is
+kept as a series of numbered generation directories next to it, and
+the configured directory itself is a symbolic link to the current
+generation:
+
+    files/tftp/pxelinux.cfg -> .pxelinux.cfg.generations/000042
+    files/html/ks           -> .ks.generations/000042
+
+A change set (registering a batch of hosts, unregistering hosts,
+setting hosts to reinstall) is written into a new generation, which
+starts as a hard linked copy of the current one, so unchanged files
+cost no copying.  Linking still visits every file of both trees, about
+a second per 10000 files, so changes arriving together are staged as
+one change set (see LocalBootBatch and AutoRegistration).  When the change set is complete, the symbolic link
+of each tree is replaced by a single atomic rename.  A host that is
+booting never sees a mix of old and new files, and a crash part way
+through a change set leaves the published trees untouched.  The ks
+tree is published before the pxelinux.cfg tree, so a bootconfig
+never refers to kickstart files that are not yet served.
+
+Older generations are kept so that a change can be rolled back
+instantly by pointing the links at an older generation again.
+
+Files in a generation must never be modified in place, as they may
+be hard links shared with older generations.  Use write_artifact,
+which writes a new file and renames it over the old one.
+
+"""
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pxemanage as pm
+
+
+# the artifact trees that are published together as a generation, in
+# the order they are published
+generation_trees = ['ks_config_dir', 'pxelinux_config_dir']
+
+# the generation being staged by each thread: the generation number
+# and the directory each tree setting is staged in.  Threads helping
+# with a change set share the staging of the thread that began it, see
+# generation_map
+_local = threading.local()
+
+
+def _generations_dir(key):
+    """Return the directory holding the generations of a tree."""
+    live_dir = os.path.normpath(pm.settings[key])
+    parent, name = os.path.split(live_dir)
+    return os.path.join(parent, f".{name}.generations")
+
+
+def list_generations():
+    """List the generation numbers that exist for all of the trees.
+
+    Returns
+    -------
+    generations - a sorted list of generation numbers.
+    """
+    generations = None
+    for key in generation_trees:
+        generations_dir = _generations_dir(key)
+        try:
+            numbers = {int(name) for name in os.listdir(generations_dir) if name.isdigit()}
+        except FileNotFoundError:
+            numbers = set()
+        generations = numbers if generations is None else generations & numbers
+    return sorted(generations)
+
+
+def current_generation():
+    """Return the number of the published generation, or None if the
+    trees have not been published as generations yet.
+    """
+    live_dir = os.path.normpath(pm.settings[generation_trees[-1]])
+    if not os.path.islink(live_dir):
+        return None
+    return int(os.path.basename(os.readlink(live_dir)))
+
+
+def artifact_dir(key):
+    """Return the directory artifact files of a tree should be read
+    from and written to.  While a generation is being staged this is
+    the staging directory, otherwise it is the published tree.
+
+    Parameters
+    ----------
+    key - the setting naming the tree, 'pxelinux_config_dir' or
+      'ks_config_dir'
+    """
+    staging = getattr(_local, 'staging', None)
+    if staging is not None:
+        return staging['dirs'][key]
+    return pm.settings[key]
+
+
+def write_artifact(filename, content):
+    """Write an artifact file.  The content is written to a new file
+    that is renamed over any existing file, so files shared with older
+    generations are never changed.
+
+    Parameters
+    ----------
+    filename - the file to write.
+    content - the string content of the file.
+    """
+    new_filename = f"{filename}.new-{threading.get_ident()}"
+    with open(new_filename, mode="w") as file:
+        file.write(content)
+    os.replace(new_filename, filename)
+
+
+def _clone_tree(source_dir, target_dir):
+    """Create target_dir as a copy of source_dir where every file is a
+    hard link to the file in source_dir.  Symbolic links are copied as
+    links.  Files we are not allowed to hard link are copied.
+    """
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        relative = os.path.relpath(dirpath, source_dir)
+        target_path = os.path.normpath(os.path.join(target_dir, relative))
+        os.makedirs(target_path, exist_ok=True)
+        shutil.copystat(dirpath, target_path)
+        try:
+            os.chown(target_path, -1, os.stat(dirpath).st_gid)
+        except PermissionError:
+            pass
+        for name in dirnames + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_path, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+            elif name in filenames:
+                try:
+                    os.link(source, target)
+                except PermissionError:
+                    shutil.copy2(source, target)
+
+
+def _publish(key, number):
+    """Point the link of a tree at the given generation with a single
+    atomic rename.  The first time a tree is published the existing
+    directory is moved into the generations directory.
+    """
+    live_dir = os.path.normpath(pm.settings[key])
+    generations_dir = _generations_dir(key)
+    target = os.path.join(os.path.basename(generations_dir), f"{number:06d}")
+
+    new_link = f"{live_dir}.new-link"
+    if os.path.lexists(new_link):
+        os.remove(new_link)
+    os.symlink(target, new_link)
+    if os.path.isdir(live_dir) and not os.path.islink(live_dir):
+        # migrate a plain directory, its files were already cloned into
+        # the new generation
+        os.rename(live_dir, os.path.join(generations_dir, "000000"))
+    os.replace(new_link, live_dir)
+
+
+def _prune_generations(keep):
+    """Remove the oldest generations, keeping the given number of most
+    recent generations (including the published one).
+    """
+    current = current_generation()
+    for number in list_generations()[:-keep]:
+        if number == current:
+            continue
+        for key in generation_trees:
+            shutil.rmtree(os.path.join(_generations_dir(key), f"{number:06d}"), ignore_errors=True)
+
+
+@contextmanager
+def staged_generation():
+    """Context manager that stages all artifact changes made inside it
+    into a new generation, and publishes the generation when the
+    block finishes.  If the block raises an exception the staged
+    generation is discarded and nothing is published.
+
+    Staging joins an enclosing staged generation of the same thread if
+    one is in progress, so functions that change a single host can be
+    used both on their own and as part of a larger change set.  Other
+    threads of this process wait until the generation is published.
+
+    The registry lock is held while a generation is staged, so the
+    change sets of other pxemanage processes, and of the other threads
+    of this process, are never lost by staging from the same published
+    generation.
+    """
+    if getattr(_local, 'staging', None) is not None:
+        yield
+        return
+    with pm.registry_lock(), _staged_generation():
+        yield
+
+
+@contextmanager
+def _staged_generation():
+    """Stage and publish a generation, see staged_generation."""
+    generations = list_generations()
+    number = (generations[-1] if generations else 0) + 1
+    dirs = {}
+    for key in generation_trees:
+        generation_dir = os.path.join(_generations_dir(key), f"{number:06d}")
+        shutil.rmtree(generation_dir, ignore_errors=True)
+        if os.path.isdir(pm.settings[key]):
+            _clone_tree(pm.settings[key], generation_dir)
+        else:
+            os.makedirs(generation_dir)
+        dirs[key] = generation_dir
+    _local.staging = {'number': number, 'dirs': dirs}
+
+    try:
+        yield
+    except BaseException:
+        _local.staging = None
+        for generation_dir in dirs.values():
+            shutil.rmtree(generation_dir, ignore_errors=True)
+        pm.discard_build_manifest()
+        raise
+
+    _local.staging = None
+    for key in generation_trees:
+        _publish(key, number)
+    # the build manifest describes the published artifacts
+    pm.save_build_manifest()
+    _prune_generations(pm.settings['generations_kept'])
+
+
+def generation_map(function, items, max_workers=8):
+    """Call a function for each item on a pool of threads.  The threads
+    stage their artifact changes into the generation being staged by
+    the calling thread, so it is published once with all of them.
+
+    Parameters
+    ----------
+    function - the function called with each item.
+    items - the items.
+    max_workers - the number of items handled at once.
+
+    Returns
+    -------
+    results - the list of the results of the calls, in the order of
+      the items.
+    """
+    staging = getattr(_local, 'staging', None)
+
+    def call(item):
+        _local.staging = staging
+        try:
+            return function(item)
+        finally:
+            _local.staging = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(call, items))
+
+
+def rollback_generation(number=None):
+    """Publish an older generation again.
+
+    Parameters
+    ----------
+    number - the generation to publish, by default the generation
+      before the current one.
+
+    Returns
+    -------
+    number - the generation that was published, or None if there is
+      no older generation to roll back to.
+    """
+    generations = list_generations()
+    current = current_generation()
+    if number is None:
+        older = [generation for generation in generations if current is None or generation < current]
+        if not older:
+            return None
+        number = older[-1]
+    elif number not in generations:
+        return None
+
+    with pm.registry_lock():
+        for key in generation_trees:
+            _publish(key, number)
+    return number
@@ -0,0 +1,193 @@
+"""pxemanage module
+
+hostimport submodule
+
+Contents
+--------
+
+Functions for registering many hosts at once from an inventory file,
+for example a new rack whose mac addresses we already have from the
+vendor.  The inventory is a csv file with a header line, or a yaml
+file, giving the hostname, macaddress, ipaddress and profile of each
+host:
+
+    hostname,macaddress,ipaddress,profile
+    cloud01,18:03:73:c5:91:89,192.168.0.101,compute
+
+    - hostname: cloud01
+      macaddress: 18:03:73:c5:91:89
+      ipaddress: 192.168.0.101
+      profile: compute
+
+The whole inventory is validated against itself and against the
+registry before anything is changed.  If it is valid all hosts are
+registered as a single batch, with one dhcpd.conf write and one dhcpd
+restart.
+
+"""
+import csv
+import logging
+import os
+import re
+import yaml
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# host names must be simple words so that we can parse them back out
+# of the registration file (dhcpd.conf)
+hostname_pattern = re.compile(r"^\w+$")
+macaddress_pattern = re.compile(r"^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5}$")
+
+# alternative column names accepted in inventory files
+field_aliases = {
+    'name': 'hostname',
+    'host': 'hostname',
+    'mac': 'macaddress',
+    'ip': 'ipaddress',
+}
+
+
+def read_host_inventory(filename):
+    """Read the hosts described in a csv or yaml inventory file.
+
+    Parameters
+    ----------
+    filename - the inventory file, files ending in .yml or .yaml are read
+      as yaml, anything else as csv.
+
+    Returns
+    -------
+    rows - a list of dictionaries, one per host, with the keys hostname,
+      macaddress, ipaddress and profile (profile may be missing).  A
+      malformed host has an error key instead, reported by
+      validate_host_inventory.
+    """
+    if filename.endswith((".yml", ".yaml")):
+        with open(filename) as file:
+            rows = yaml.safe_load(file) or []
+        # also accept a mapping of hostname to the host fields
+        if isinstance(rows, dict):
+            rows = [dict(fields or {}, hostname=hostname) if isinstance(fields or {}, dict)
+                    else {'hostname': hostname, 'error': f"host fields are not a mapping: {fields!r}"}
+                    for hostname, fields in rows.items()]
+    else:
+        with open(filename, newline="") as file:
+            rows = list(csv.DictReader(file))
+
+    inventory = []
+    for row in rows:
+        if not isinstance(row, dict):
+            inventory.append({'error': f"host fields are not a mapping: {row!r}"})
+            continue
+        host = {}
+        for key, value in row.items():
+            # the cells of a csv line beyond the header are given the key None
+            if key is None:
+                host['error'] = f"{len(value)} more fields than the header: {','.join(value)}"
+                continue
+            key = str(key).strip().lower()
+            key = field_aliases.get(key, key)
+            host[key] = str(value).strip() if value is not None else ""
+        inventory.append(host)
+    return inventory
+
+
+def validate_host_inventory(inventory):
+    """Check an inventory of new hosts for mistakes before we register
+    any of them.  Hosts are checked against each other and against
+    the registry: names, mac addresses and ip addresses must be
+    unique, ip addresses must be free in the subnet and the profile
+    must exist.
+
+    Parameters
+    ----------
+    inventory - a list of host dictionaries as returned by
+      read_host_inventory.
+
+    Returns
+    -------
+    (new_hosts, errors) - a list of the new Host objects, and a list of
+      error messages.  The hosts should only be registered if there
+      are no errors.
+    """
+    errors = []
+    new_hosts = []
+    allocator = pm.build_ip_allocator()
+    macaddresses = {pm.hosts[hostname].macaddress.lower(): hostname for hostname in pm.hosts}
+    hostnames = set(pm.hosts)
+    profiles = {}
+
+    for line, row in enumerate(inventory, start=1):
+        error_count = len(errors)
+        hostname = row.get('hostname', "")
+        macaddress = row.get('macaddress', "").lower()
+        ipaddress = row.get('ipaddress', "")
+        profile = row.get('profile') or "default"
+        where = f"host {line} ({hostname or 'no hostname'})"
+
+        if row.get('error'):
+            errors.append(f"{where}: {row['error']}")
+            continue
+
+        if not hostname_pattern.match(hostname):
+            errors.append(f"{where}: invalid hostname '{hostname}'")
+        elif hostname in hostnames:
+            errors.append(f"{where}: hostname {hostname} is already registered")
+
+        if not macaddress_pattern.match(macaddress):
+            errors.append(f"{where}: invalid macaddress '{macaddress}'")
+        elif macaddress in macaddresses:
+            errors.append(f"{where}: macaddress {macaddress} is already registered to {macaddresses[macaddress]}")
+
+        conflict = allocator.conflict(ipaddress)
+        if conflict:
+            errors.append(f"{where}: {conflict}")
+        else:
+            allocator.allocate(ipaddress, hostname)
+
+        if profile not in profiles:
+            profiles[profile] = os.path.isdir(f"templates/profiles/{profile}")
+        if not profiles[profile]:
+            errors.append(f"{where}: unknown profile {profile}")
+
+        hostnames.add(hostname)
+        macaddresses[macaddress] = hostname
+        if len(errors) == error_count:
+            new_hosts.append(pm.Host(hostname, macaddress, ipaddress, profile, pm.status.DHCPOFFER))
+
+    return new_hosts, errors
+
+
+def import_hosts(filename, dry_run=False):
+    """Register all of the hosts in an inventory file.  Nothing is
+    registered if any host in the inventory is invalid.
+
+    Parameters
+    ----------
+    filename - the csv or yaml inventory file of new hosts.
+    dry_run - if True only validate the inventory, do not register.
+
+    Returns
+    -------
+    bool - True if the inventory was valid (and registered unless this
+      is a dry run), False if errors were found.
+    """
+    logger.info("======== Import hosts from inventory ========")
+    inventory = read_host_inventory(filename)
+    new_hosts, errors = validate_host_inventory(inventory)
+
+    if errors:
+        logger.error("    -------- %d errors found in inventory %s, no hosts imported", len(errors), filename)
+        for error in errors:
+            logger.error("    ERROR: %s", error)
+        return False
+
+    logger.info("    -------- %d valid hosts found in inventory %s", len(new_hosts), filename)
+    if dry_run or not new_hosts:
+        return True
+
+    pm.register_host_batch(new_hosts)
+    return True
@@ -0,0 +1,278 @@
+"""pxemanage module
+
+inventory submodule
+
+Contents
+--------
+
+Export the registered hosts as an Ansible inventory, so the hosts are
+handed off to Ansible without keeping a second host list by hand.
+Each profile becomes an inventory group, with the hosts of the profile
+and their ip address (ansible_host) and mac address, and the
+management username and identity as group variables.
+
+The inventory is kept in the inventory_dir as one file per group and
+format, e.g. default.yml and default.ini, which Ansible reads as one
+inventory when given the directory (use one of the formats, the
+inventory_formats setting).  The files are refreshed every time the
+registration is updated, only the files of groups whose hosts changed
+are rewritten, the signatures of the written group files are kept in
+the inventory_state_file.  The files are written line by line, as is
+the whole inventory when it is streamed to a file by export-inventory,
+so no inventory document of the whole fleet is built in memory.
+
+export-inventory --list answers as an Ansible dynamic inventory script,
+from the registry snapshot, see the snapshot submodule.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import yaml
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# increased whenever the layout of the inventory files changes, so all
+# group files are rewritten
+inventory_version = 1
+
+# file suffix of the group files of each format
+inventory_suffixes = {
+    'yaml': ".yml",
+    'ini': ".ini",
+}
+
+
+def inventory_group_name(profile):
+    """Return the Ansible group name of a profile, group names may only
+    hold letters, digits and underscores and not begin with a digit.
+    """
+    name = re.sub(r"\W", "_", profile or "default")
+    return f"_{name}" if name[0].isdigit() else name
+
+
+def inventory_group_vars():
+    """Return the variables given to every group of the inventory."""
+    return {
+        'ansible_user': pm.settings['username'],
+        'ansible_ssh_private_key_file': pm.settings['identity'],
+    }
+
+
+def inventory_host_vars(macaddress, ipaddress):
+    """Return the variables of a host in the inventory."""
+    return {
+        'ansible_host': ipaddress,
+        'macaddress': macaddress,
+    }
+
+
+def registered_inventory_hosts():
+    """Return the registered hosts as a dictionary of hostname to
+    (macaddress, ipaddress, profile), the form of the registry
+    snapshot.
+    """
+    return {hostname: (host.macaddress, host.ipaddress, host.profile) for hostname, host in pm.hosts.items()}
+
+
+def inventory_groups(registered):
+    """Group the hosts by profile.
+
+    Parameters
+    ----------
+    registered - a dictionary of hostname to (macaddress, ipaddress,
+      profile).
+
+    Returns
+    -------
+    groups - a dictionary of group name to the sorted list of
+      (hostname, macaddress, ipaddress) of the hosts of the group.
+    """
+    groups = {}
+    for hostname, (macaddress, ipaddress, profile) in registered.items():
+        groups.setdefault(inventory_group_name(profile), []).append((hostname, macaddress, ipaddress))
+    for group_hosts in groups.values():
+        group_hosts.sort()
+    return groups
+
+
+def _yaml_scalar(value):
+    """Quote a value for the inventory yaml, a json string is a valid
+    yaml double quoted scalar.
+    """
+    return json.dumps(value)
+
+
+def _yaml_group_lines(group, group_hosts):
+    """Generate the lines of a group, under the children of all."""
+    yield f"    {group}:\n"
+    yield "      vars:\n"
+    for name, value in inventory_group_vars().items():
+        yield f"        {name}: {_yaml_scalar(value)}\n"
+    yield "      hosts:\n"
+    for hostname, macaddress, ipaddress in group_hosts:
+        yield f"        {hostname}:\n"
+        for name, value in inventory_host_vars(macaddress, ipaddress).items():
+            yield f"          {name}: {_yaml_scalar(value)}\n"
+
+
+def _ini_group_lines(group, group_hosts):
+    """Generate the lines of a group in the ini inventory format."""
+    yield f"[{group}]\n"
+    for hostname, macaddress, ipaddress in group_hosts:
+        host_vars = " ".join(f"{name}={value}" for name, value in inventory_host_vars(macaddress, ipaddress).items())
+        yield f"{hostname} {host_vars}\n"
+    yield f"\n[{group}:vars]\n"
+    for name, value in inventory_group_vars().items():
+        yield f"{name}={value}\n"
+    yield "\n"
+
+
+inventory_header = "# generated by pxemanage from the host registration, do not edit\n"
+
+
+def inventory_lines(groups, inventory_format="yaml"):
+    """Generate the lines of an inventory of the given groups.
+
+    Parameters
+    ----------
+    groups - a dictionary of group name to the list of (hostname,
+      macaddress, ipaddress) of its hosts, see inventory_groups.
+    inventory_format - 'yaml' or 'ini'.
+    """
+    yield inventory_header
+    if inventory_format == 'yaml':
+        yield "all:\n"
+        yield "  children:\n"
+        for group in sorted(groups):
+            yield from _yaml_group_lines(group, groups[group])
+    elif inventory_format == 'ini':
+        for group in sorted(groups):
+            yield from _ini_group_lines(group, groups[group])
+    else:
+        raise ValueError(f"unknown inventory format: {inventory_format}")
+
+
+def write_inventory(file, registered=None, inventory_format="yaml"):
+    """Stream the whole inventory to a file.
+
+    Parameters
+    ----------
+    file - the open text file written to, e.g. sys.stdout.
+    registered - a dictionary of hostname to (macaddress, ipaddress,
+      profile), by default the registered hosts.
+    inventory_format - 'yaml' or 'ini'.
+    """
+    if registered is None:
+        registered = registered_inventory_hosts()
+    file.writelines(inventory_lines(inventory_groups(registered), inventory_format))
+
+
+def _group_signature(inventory_format, group_hosts):
+    """Return a digest of everything that goes into a group file, the
+    file is only rewritten when it changed.
+    """
+    digest = hashlib.sha256(f"{inventory_version} {inventory_format}".encode())
+    digest.update(repr(sorted(inventory_group_vars().items())).encode())
+    for host in group_hosts:
+        digest.update(" ".join(host).encode() + b"\n")
+    return digest.hexdigest()
+
+
+def export_inventory(registered=None, inventory_dir=None, formats=None):
+    """Bring the inventory group files up to date with the registered
+    hosts, rewriting only the files of groups that changed and removing
+    the files of groups that no longer have hosts.
+
+    Parameters
+    ----------
+    registered - a dictionary of hostname to (macaddress, ipaddress,
+      profile), by default the registered hosts.
+    inventory_dir - the directory of the group files, by default the
+      inventory_dir setting.
+    formats - the inventory formats written, by default the
+      inventory_formats setting.
+
+    Returns
+    -------
+    changed - the list of the group files written or removed.
+    """
+    if registered is None:
+        registered = registered_inventory_hosts()
+    inventory_dir = inventory_dir or pm.settings['inventory_dir']
+    formats = formats or pm.settings['inventory_formats']
+    state_file = pm.settings['inventory_state_file']
+    try:
+        with open(state_file) as file:
+            signatures = yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        signatures = {}
+    if signatures.get('inventory_dir') != os.path.abspath(inventory_dir):
+        signatures = {'inventory_dir': os.path.abspath(inventory_dir)}
+    files = signatures.setdefault('files', {})
+
+    groups = inventory_groups(registered)
+    os.makedirs(inventory_dir, exist_ok=True)
+    changed = []
+    wanted = set()
+    for inventory_format in formats:
+        suffix = inventory_suffixes[inventory_format]
+        for group, group_hosts in groups.items():
+            filename = f"{group}{suffix}"
+            wanted.add(filename)
+            signature = _group_signature(inventory_format, group_hosts)
+            path = os.path.join(inventory_dir, filename)
+            if files.get(filename) == signature and os.path.exists(path):
+                continue
+            with open(f"{path}.new", mode="w") as file:
+                file.writelines(inventory_lines({group: group_hosts}, inventory_format))
+            os.replace(f"{path}.new", path)
+            files[filename] = signature
+            changed.append(filename)
+
+    # the files of groups without hosts left, or of formats no longer
+    # exported, are removed
+    for filename in sorted(set(files) - wanted):
+        try:
+            os.remove(os.path.join(inventory_dir, filename))
+        except FileNotFoundError:
+            pass
+        del files[filename]
+        changed.append(filename)
+
+    if changed:
+        os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+        with open(f"{state_file}.new", mode="w") as file:
+            yaml.safe_dump(signatures, file)
+        os.replace(f"{state_file}.new", state_file)
+    logger.info("    -------- %d ansible inventory files changed %s", len(changed), " ".join(changed))
+    return changed
+
+
+def dynamic_inventory(registered=None):
+    """Return the inventory as an Ansible dynamic inventory script
+    answers --list, with the variables of every host in _meta so
+    Ansible does not call the script for each host.
+
+    Parameters
+    ----------
+    registered - a dictionary of hostname to (macaddress, ipaddress,
+      profile), by default the hosts of the registry snapshot.
+    """
+    if registered is None:
+        registered = pm.load_registry_snapshot()['hosts']
+    groups = inventory_groups(registered)
+    group_vars = inventory_group_vars()
+    inventory = {
+        'all': {'children': sorted(groups)},
+        '_meta': {'hostvars': {hostname: inventory_host_vars(macaddress, ipaddress)
+                               for hostname, (macaddress, ipaddress, profile) in registered.items()}},
+    }
+    for group, group_hosts in groups.items():
+        inventory[group] = {'hosts': [host[0] for host in group_hosts], 'vars': group_vars}
+    return inventory
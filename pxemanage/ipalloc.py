@@ -0,0 +1,284 @@
+"""pxemanage module
+
+ipalloc submodule
+
+Contents
+--------
+
+Static ip address management for the hosts we register.  The
+allocator keeps the addresses in use in the configured subnets as a
+sorted set of disjoint intervals.  Adjacent addresses are merged into
+a single interval, so a rack of hosts numbered in sequence costs only
+one interval no matter how many hosts it has.  Lookups use a binary
+search over the interval starts, so conflict checks and finding the
+next free address are O(log n) in the number of intervals, even for
+a /16 network.  Allocating and releasing an address also insert
+into or delete from the sorted lists of interval starts and ends,
+which shifts the later intervals and is O(n); as the intervals are
+few this is a short memory move.
+
+Addresses are in use if they are assigned to a registered host, or if
+they fall in one of the reserved ranges: the gateway, dns servers, the
+apache server and any ranges listed in the reserved_ip_ranges setting
+(for example the dhcpd dynamic pool).
+
+"""
+import ipaddress
+import logging
+from bisect import bisect_left, bisect_right
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class IPAllocator:
+    """Interval set of the ip addresses in use in one or more
+    subnets.
+    """
+    def __init__(self, subnet, netmask):
+        """Define class constructor for the ip address allocator.
+
+        Parameters
+        ----------
+        subnet - the network address of the subnet, e.g. '192.168.0.0'
+        netmask - the netmask of the subnet, e.g. '255.255.255.0'
+        """
+        # sorted inclusive [first, last] assignable ranges of each subnet
+        self._ranges = []
+        self.add_subnet(subnet, netmask)
+        # inclusive [start, end] intervals of addresses in use
+        self._starts = []
+        self._ends = []
+        # hostname owning each address assigned to a host
+        self._owners = {}
+        # (start, end, reason) of each reserved range
+        self._reserved = []
+
+    def add_subnet(self, subnet, netmask):
+        """Add another subnet whose addresses can be assigned, e.g.
+        the subnet of another rack.
+
+        Parameters
+        ----------
+        subnet - the network address of the subnet, e.g. '192.168.1.0'
+        netmask - the netmask of the subnet, e.g. '255.255.255.0'
+        """
+        network = ipaddress.IPv4Network(f"{subnet}/{netmask}")
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        if network.prefixlen < 31:
+            # the network and broadcast addresses can not be assigned
+            first += 1
+            last -= 1
+        for range_first, range_last, other in self._ranges:
+            if first <= range_last and range_first <= last:
+                raise ValueError(f"subnet {network} overlaps subnet {other}")
+        self._ranges.append((first, last, network))
+        self._ranges.sort(key=lambda r: r[0])
+
+    def _range(self, address):
+        """Return the (first, last, network) of the subnet range that
+        address can be assigned in, or None.
+        """
+        for assignable in self._ranges:
+            if assignable[0] <= address <= assignable[1]:
+                return assignable
+        return None
+
+    def _find(self, ip):
+        """Return the index of the interval containing ip, or -1."""
+        i = bisect_right(self._starts, ip) - 1
+        if i >= 0 and self._ends[i] >= ip:
+            return i
+        return -1
+
+    def _insert(self, start, end):
+        """Add the free range [start, end] to the intervals in use,
+        merging it with the intervals on either side it touches.
+        """
+        i = bisect_left(self._starts, start)
+        if i > 0 and self._ends[i - 1] == start - 1:
+            i -= 1
+            start = self._starts[i]
+            del self._starts[i]
+            del self._ends[i]
+        if i < len(self._starts) and self._starts[i] == end + 1:
+            end = self._ends[i]
+            del self._starts[i]
+            del self._ends[i]
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+    def in_subnet(self, ip):
+        """Return true if the given ip address can be assigned in
+        one of the subnets.
+        """
+        return self._range(int(ipaddress.IPv4Address(ip))) is not None
+
+    def conflict(self, ip):
+        """Check if the given ip address can be assigned to a new host.
+
+        Parameters
+        ----------
+        ip - the ip address to check, as a string.
+
+        Returns
+        -------
+        reason - None if the address is free, otherwise a description of
+          why the address can not be assigned.
+        """
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return f"{ip} is not a valid ip address"
+        if self._range(address) is None:
+            networks = ", ".join(str(network) for _, _, network in self._ranges)
+            return f"{ip} is not an assignable address in subnet {networks}"
+        if self._find(address) < 0:
+            return None
+        if address in self._owners:
+            return f"{ip} is already assigned to host {self._owners[address]}"
+        for start, end, reason in self._reserved:
+            if start <= address <= end:
+                return f"{ip} is reserved for {reason}"
+        return f"{ip} is in use"
+
+    def allocate(self, ip, hostname):
+        """Assign the given ip address to a host.
+
+        Parameters
+        ----------
+        ip - the ip address to assign, as a string.
+        hostname - the host the address is assigned to.
+
+        Raises
+        ------
+        ValueError - if the address is not free in the subnets.
+        """
+        reason = self.conflict(ip)
+        if reason:
+            raise ValueError(reason)
+        address = int(ipaddress.IPv4Address(ip))
+        self._insert(address, address)
+        self._owners[address] = hostname
+
+    def reserve(self, first, last=None, reason="reserved range"):
+        """Reserve a range of addresses so they are never assigned to
+        hosts.  Parts of the range outside of the subnets are ignored,
+        as are parts that are already in use.
+
+        Parameters
+        ----------
+        first - the first ip address of the range, as a string.
+        last - the last ip address of the range, defaults to first.
+        reason - a description of what the range is reserved for.
+        """
+        low = int(ipaddress.IPv4Address(first))
+        high = int(ipaddress.IPv4Address(last or first))
+        for range_first, range_last, _ in self._ranges:
+            start = max(low, range_first)
+            end = min(high, range_last)
+            if start <= end:
+                self._reserve(start, end, reason)
+
+    def _reserve(self, start, end, reason):
+        """Reserve the range [start, end] inside a single subnet."""
+        self._reserved.append((start, end, reason))
+
+        # only insert the gaps in the range that are not already in use
+        address = start
+        while address <= end:
+            i = self._find(address)
+            if i >= 0:
+                address = self._ends[i] + 1
+                continue
+            gap_end = end
+            j = bisect_right(self._starts, address)
+            if j < len(self._starts):
+                gap_end = min(end, self._starts[j] - 1)
+            self._insert(address, gap_end)
+            address = gap_end + 1
+
+    def release(self, ip):
+        """Return an ip address assigned to a host to the free pool.
+
+        Parameters
+        ----------
+        ip - the ip address to release, as a string.
+        """
+        address = int(ipaddress.IPv4Address(ip))
+        if self._owners.pop(address, None) is None:
+            return
+        i = self._find(address)
+        start, end = self._starts[i], self._ends[i]
+        del self._starts[i]
+        del self._ends[i]
+        if start < address:
+            self._insert(start, address - 1)
+        if address < end:
+            self._insert(address + 1, end)
+
+    def next_free(self, first=None, last=None):
+        """Find the lowest free ip address, optionally limited to
+        a range of addresses such as an auto registration pool.
+
+        Parameters
+        ----------
+        first - the lowest ip address to consider, as a string.
+        last - the highest ip address to consider, as a string.
+
+        Returns
+        -------
+        ip - the free ip address as a string, or None if every address
+          in the range is in use.
+        """
+        for range_first, range_last, _ in self._ranges:
+            low = range_first if first is None else max(int(ipaddress.IPv4Address(first)), range_first)
+            high = range_last if last is None else min(int(ipaddress.IPv4Address(last)), range_last)
+            i = self._find(low)
+            if i >= 0:
+                # intervals are merged, so the address after this one is free
+                low = self._ends[i] + 1
+            if low <= high:
+                return str(ipaddress.IPv4Address(low))
+        return None
+
+
+def build_ip_allocator():
+    """Create an ip address allocator for the configured subnets,
+    with the addresses of all registered hosts and the reserved
+    addresses marked as in use.
+
+    Returns
+    -------
+    allocator - an IPAllocator for the subnets in the settings.
+    """
+    subnets = pm.configured_subnets()
+    allocator = IPAllocator(subnets[0]['subnet'], subnets[0]['netmask'])
+    for subnet in subnets[1:]:
+        allocator.add_subnet(subnet['subnet'], subnet['netmask'])
+
+    for subnet in subnets:
+        if subnet['gateway_ip']:
+            allocator.reserve(subnet['gateway_ip'], reason=f"the gateway of subnet {subnet['name']}")
+        for dns_server in subnet['dns_servers']:
+            allocator.reserve(dns_server, reason="a dns server")
+    allocator.reserve(pm.settings['apache_server_ip'], reason="the apache server")
+    for ip_range in pm.settings['reserved_ip_ranges']:
+        first, _, last = ip_range.partition('-')
+        allocator.reserve(first.strip(), last.strip() or None, reason=f"reserved range {ip_range}")
+
+    # registered hosts that conflict with a reservation or with each
+    # other are reported, they keep their address in the registry
+    for hostname in pm.hosts:
+        host = pm.hosts[hostname]
+        if host.ipaddress == "unknown":
+            continue
+        reason = allocator.conflict(host.ipaddress)
+        if reason:
+            logger.warning("    WARNING: host %s has ip address conflict, %s", hostname, reason)
+            continue
+        allocator.allocate(host.ipaddress, hostname)
+
+    return allocator
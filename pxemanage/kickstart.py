@@ -25,12 +25,21 @@ maintain a separate directory of profiles, which are used as jinga
 templates to create the specific 'user-data' file for a new host,
 filling in any parameter specific to the host.
 
+All changes are made in a staged generation of the ks tree and
+published atomically, see the generation submodule.
+
 """
+import logging
+import os
+import shutil
 import subprocess
 import pxemanage as pm
 
 
-def create_kickstart_file(hostname):
+logger = logging.getLogger(__name__)
+
+
+def create_kickstart_file(hostname, chown=True):
     """Create a host kickstart file from the profile registered for
     this host.  Given the name of the host, we lookup the host
     in our hosts database.  We use the hosts profile to 
@@ -42,47 +51,67 @@ def create_kickstart_file(hostname):
     ----------
     hostname - We are given the name of the new host that needs 
       a new kickstart file for it.  
+    chown - if False the ownership of the new kickstart files is not
+      fixed, the caller is expected to call chown_kickstart_files
+      for a whole batch of hosts instead.
     """
     # lookup host in registration database
     host = pm.hosts[hostname]
-    ks_config = f"{pm.settings['ks_config_dir']}/{host.hostname}"
+    with pm.staged_generation():
+        _create_kickstart_file(host, chown)
+
+
+def _create_kickstart_file(host, chown):
+    """Render and write the kickstart files of a host into the
+    generation being staged, and record them in the build manifest.
+    """
+    ks_config = f"{pm.artifact_dir('ks_config_dir')}/{host.hostname}"
     
-    print("======== Create kickstart files ========")
-    print(f"    ----- creating kickstart files for : {host.hostname}")
-    print(f"    -----                 using profile: {host.profile}")
-    print(f"    -----                kickstart name: {ks_config}")
-    print("")
+    logger.debug("    ----- creating kickstart files for host %s profile %s in %s",
+                 host.hostname, host.profile, ks_config)
     
     # create new subdirectory in ks hierarchy to hold this hosts kickstart file
-    command = f"mkdir -p {ks_config}"
-    subprocess.run(command, shell=True)
+    os.makedirs(ks_config, exist_ok=True)
 
     # get user-data template and render it contents
     # TODO: we should probably render the gateway and name servers
     #   into the user-data here as well.
-    management_key = open(pm.settings['ansible_manager_key']).readlines()[0].strip()
-    management_key = f'"{management_key}"'
-    template = pm.j2.get_template(f"profiles/{host.profile}/user-data.j2")
-    content = template.render(hostname = host.hostname,
-                              ipaddress = host.ipaddress,
-                              management_key = management_key)
-    file = open(f"{ks_config}/user-data", mode="w")
-    file.write(content)
-    file.close()
+    templates, inputs = pm.kickstart_inputs(host)
+    template = pm.j2.get_template(templates[0])
+    content = template.render(hostname = inputs['hostname'],
+                              ipaddress = inputs['ipaddress'],
+                              management_key = inputs['management_key'])
+    pm.write_artifact(f"{ks_config}/user-data", content)
         
     # copy the meta-data file from profile, these currently don't
     # have any templates to render, but we'll keep in just in case
-    template = pm.j2.get_template(f"profiles/{host.profile}/meta-data.j2")
+    template = pm.j2.get_template(templates[1])
     content = template.render()
-    file = open(f"{ks_config}/meta-data", mode="w")
-    file.write(content)
-    file.close()
+    pm.write_artifact(f"{ks_config}/meta-data", content)
+    pm.record_artifact(f"kickstart/{host.hostname}", templates, inputs)
 
     # TODO: this is getting kludgy, as a result of trying to move
     #    location of served files to own directory, need to have permissions
     #    exactly correct.  This needs to be run after the sed updates?
-    command = f"sudo chown -R dash:www-data {ks_config}"
-    subprocess.run(command, shell=True)
+    if chown:
+        chown_kickstart_files([host.hostname])
+
+
+def chown_kickstart_files(hostnames, batch_size=500):
+    """Give the kickstart files of the given hosts the ownership the
+    web server needs to serve them.  The directories of many hosts
+    are changed with a single command, so a large batch of new hosts
+    does not need a sudo process per host.
+
+    Parameters
+    ----------
+    hostnames - the hosts whose kickstart files should be changed.
+    batch_size - the most host directories given to one command.
+    """
+    ks_configs = [f"{pm.artifact_dir('ks_config_dir')}/{hostname}" for hostname in hostnames]
+    for start in range(0, len(ks_configs), batch_size):
+        command = ["sudo", "chown", "-R", "dash:www-data"] + ks_configs[start:start + batch_size]
+        subprocess.run(command)
 
 
 def delete_kickstart_file(hostname):
@@ -92,8 +121,21 @@ def delete_kickstart_file(hostname):
     hostname - We are given the name of the host whose
       kickstart files should be removed for it.  
     """   
-    # lookup host in registration database
-    host = pm.hosts[hostname]
-    ks_config_dir = f"{pm.settings['ks_config_dir']}/{host.hostname}"
-    command = f"rm -rf {ks_config_dir}"
-    subprocess.run(command, shell=True)    
+    delete_kickstart_files([hostname])
+
+
+def delete_kickstart_files(hostnames):
+    """Delete the kickstart files of many hosts in a single pass,
+    without running a command for each host.
+
+    Parameters
+    ----------
+    hostnames - the hosts whose kickstart files should be removed.
+    """
+    with pm.staged_generation():
+        for hostname in hostnames:
+            # lookup host in registration database
+            host = pm.hosts[hostname]
+            ks_config_dir = f"{pm.artifact_dir('ks_config_dir')}/{host.hostname}"
+            shutil.rmtree(ks_config_dir, ignore_errors=True)
+            pm.forget_artifact(f"kickstart/{hostname}")
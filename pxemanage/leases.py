@@ -0,0 +1,305 @@
+"""pxemanage module
+
+leases submodule
+
+Contents
+--------
+
+An index of every mac address dhcpd has handed a lease to, built from
+the dhcpd lease journal (dhcpd.leases).  dhcpd appends a lease block to
+the journal each time a lease changes
+
+    lease 192.168.0.150 {
+      starts 3 2026/10/14 10:00:01;
+      ends 3 2026/10/14 10:15:01;
+      cltt 3 2026/10/14 10:00:01;
+      binding state active;
+      hardware ethernet 11:22:33:44:55:66;
+      set vendor-class-identifier = "PXEClient:Arch:00000:UNDI:002001";
+      client-hostname "localhost";
+    }
+
+so the journal holds the whole lease history.  The index keeps the
+first and last time each mac address was seen, its last ip address,
+vendor class and client hostname, and the inode and byte offset of the
+journal it has read up to.  Each update only parses the lease blocks
+appended since, a block that is still being written is left for the
+next update.  When dhcpd rewrites the journal (it does on start and
+periodically) the new file is read from its start, the first seen times
+already in the index are kept.
+
+Unlike the DHCPDISCOVERs in syslog, the index knows about every
+machine that ever booted on the network, not only those that booted
+while register-hosts was running, so it is used to report unregistered
+machines and to register them in bulk.
+
+"""
+import calendar
+import json
+import logging
+import os
+import time
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# version of the saved lease index, an index of another version is
+# rebuilt from the start of the journal
+lease_index_format = 1
+
+
+class LeaseRecord:
+    """What the lease journal tells us about one mac address."""
+    __slots__ = ('macaddress', 'ipaddress', 'first_seen', 'last_seen', 'vendor_class', 'client_hostname')
+
+    def __init__(self, macaddress, ipaddress, first_seen, last_seen,
+                 vendor_class=None, client_hostname=None):
+        """Define class constructor for the lease record.
+
+        Parameters
+        ----------
+        macaddress - the hardware mac address of the client.
+        ipaddress - the address of the latest lease of the client.
+        first_seen, last_seen - the seconds since the epoch of the first
+          and the latest lease of the client.
+        vendor_class - the vendor class identifier the client sent, e.g.
+          'PXEClient:Arch:00000:UNDI:002001', None if it sent none.
+        client_hostname - the hostname the client sent, None if none.
+        """
+        self.macaddress = macaddress
+        self.ipaddress = ipaddress
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.vendor_class = vendor_class
+        self.client_hostname = client_hostname
+
+    def fields(self):
+        """Return the fields of the record as a list, as it is saved."""
+        return [self.ipaddress, self.first_seen, self.last_seen, self.vendor_class, self.client_hostname]
+
+
+def parse_lease_time(fields):
+    """Parse the time of a starts or cltt statement of a lease block,
+    given as 'starts 3 2026/10/14 10:00:01;' (UTC) or, with the local
+    db-time-format, as 'starts epoch 1791972001; # ...'.
+
+    Returns
+    -------
+    time - the seconds since the epoch, or None for 'never'.
+    """
+    if len(fields) < 3 or fields[1].rstrip(";") == "never":
+        return None
+    if fields[1] == "epoch":
+        return int(fields[2].rstrip(";"))
+    return calendar.timegm(time.strptime(f"{fields[2]} {fields[3].rstrip(';')}", "%Y/%m/%d %H:%M:%S"))
+
+
+def _quoted_value(text):
+    """Return the quoted string of a lease statement."""
+    start = text.find('"')
+    end = text.rfind('"')
+    return text[start + 1:end] if 0 <= start < end else None
+
+
+class LeaseIndex:
+    """The mac addresses seen in the lease journal, and the position up
+    to which the journal was read.
+    """
+    def __init__(self, filename=None):
+        """Define class constructor for an empty lease index.
+
+        Parameters
+        ----------
+        filename - the lease journal, by default the dhcpd_leases_file
+          setting.
+        """
+        self.filename = filename or pm.settings['dhcpd_leases_file']
+        self.inode = None
+        self.offset = 0
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def _add_lease(self, lease):
+        """Merge a lease block parsed from the journal into the index."""
+        macaddress = lease.get('macaddress')
+        seen = lease.get('cltt') or lease.get('starts')
+        if not macaddress or seen is None:
+            return
+        record = self.records.get(macaddress)
+        if record is None:
+            self.records[macaddress] = LeaseRecord(macaddress, lease['ipaddress'], seen, seen,
+                                                   lease.get('vendor_class'), lease.get('client_hostname'))
+            return
+        record.first_seen = min(record.first_seen, seen)
+        if seen >= record.last_seen:
+            record.last_seen = seen
+            record.ipaddress = lease['ipaddress']
+        if lease.get('vendor_class'):
+            record.vendor_class = lease['vendor_class']
+        if lease.get('client_hostname'):
+            record.client_hostname = lease['client_hostname']
+
+    def update(self):
+        """Read the lease blocks appended to the journal since the last
+        update.
+
+        Returns
+        -------
+        count - the number of lease blocks read.
+        """
+        try:
+            file = open(self.filename, mode="rb")
+        except FileNotFoundError:
+            logger.warning("    WARNING: dhcpd lease file %s not found", self.filename)
+            return 0
+        count = 0
+        with file:
+            info = os.fstat(file.fileno())
+            if info.st_ino != self.inode or info.st_size < self.offset:
+                # dhcpd rewrote the journal, read the new file from its start
+                self.inode = info.st_ino
+                self.offset = 0
+            file.seek(self.offset)
+            position = self.offset
+            lease = None
+            for line in file:
+                # a partially written line, and the block it is in, are
+                # read again by the next update
+                if not line.endswith(b"\n"):
+                    break
+                position += len(line)
+                text = line.decode(errors="replace").strip()
+                if lease is None:
+                    if text.startswith("lease ") and text.endswith("{"):
+                        lease = {'ipaddress': text.split()[1]}
+                    else:
+                        # comments and the other statements of the journal
+                        self.offset = position
+                    continue
+                if text == "}":
+                    self._add_lease(lease)
+                    lease = None
+                    self.offset = position
+                    count += 1
+                elif text.startswith("hardware ethernet "):
+                    lease['macaddress'] = text.split()[2].rstrip(";")
+                elif text.startswith("starts ") or text.startswith("cltt "):
+                    lease[text.split()[0]] = parse_lease_time(text.split())
+                elif text.startswith("set vendor-class-identifier ") or text.startswith("vendor-class-identifier "):
+                    lease['vendor_class'] = _quoted_value(text)
+                elif text.startswith("client-hostname "):
+                    lease['client_hostname'] = _quoted_value(text)
+        logger.debug("    -------- read %d dhcpd leases, %d mac addresses known", count, len(self.records))
+        return count
+
+    def unregistered(self):
+        """Return the records of the mac addresses that are not registered,
+        most recently seen first.
+        """
+        return sorted((record for record in self.records.values() if not pm.is_registered(record.macaddress)),
+                      key=lambda record: record.last_seen, reverse=True)
+
+    def save(self, index_file=None):
+        """Save the index, written to a temporary file and renamed into
+        place.
+
+        Parameters
+        ----------
+        index_file - the file saved to, by default the lease_index_file
+          setting.
+        """
+        index_file = index_file or pm.settings['lease_index_file']
+        os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+        state = {
+            'format': lease_index_format,
+            'filename': self.filename,
+            'inode': self.inode,
+            'offset': self.offset,
+            'leases': {macaddress: record.fields() for macaddress, record in self.records.items()},
+        }
+        new_index_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(new_index_file, mode="w") as file:
+            json.dump(state, file, separators=(",", ":"))
+        os.replace(new_index_file, index_file)
+
+    @classmethod
+    def load(cls, index_file=None, filename=None):
+        """Load the saved index of a lease journal.
+
+        Parameters
+        ----------
+        index_file - the saved index, by default the lease_index_file
+          setting.
+        filename - the lease journal, by default the dhcpd_leases_file
+          setting.
+
+        Returns
+        -------
+        index - the saved LeaseIndex, or an empty one if none was saved
+          for the journal.
+        """
+        index = cls(filename)
+        try:
+            with open(index_file or pm.settings['lease_index_file']) as file:
+                state = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return index
+        if state.get('format') != lease_index_format or state.get('filename') != index.filename:
+            return index
+        index.inode = state['inode']
+        index.offset = state['offset']
+        index.records = {macaddress: LeaseRecord(macaddress, *fields)
+                         for macaddress, fields in state['leases'].items()}
+        return index
+
+
+def update_lease_index():
+    """Bring the saved lease index up to date with the lease journal.
+
+    Returns
+    -------
+    index - the updated LeaseIndex.
+    """
+    index = LeaseIndex.load()
+    if index.update():
+        index.save()
+    return index
+
+
+def register_leased_hosts(autoregistration, discovery_filter=None, index=None):
+    """Register the unregistered hosts of the lease index with the auto
+    registration rules, as if each had just sent a DHCPDISCOVER.  The
+    hosts are registered as one batch.
+
+    Parameters
+    ----------
+    autoregistration - the AutoRegistration naming the new hosts.
+    discovery_filter - if given, hosts it does not admit (ignored and
+      denied mac addresses) are not registered.
+    index - the LeaseIndex, by default the updated saved index.
+
+    Returns
+    -------
+    hosts - the list of hosts registered.
+    """
+    if index is None:
+        index = update_lease_index()
+    logger.info("======== Register unregistered hosts of the dhcpd leases ========")
+    hosts = []
+    for record in index.unregistered():
+        if discovery_filter and not discovery_filter.admit(record.macaddress):
+            continue
+        host = autoregistration.discover(record.macaddress)
+        if host:
+            hosts.append(host)
+            if discovery_filter:
+                discovery_filter.registered(record.macaddress)
+    autoregistration.flush()
+    return hosts
@@ -0,0 +1,102 @@
+"""pxemanage module
+
+logs submodule
+
+Contents
+--------
+
+Logging for the pxemanage package and scripts.  Every submodule logs
+to its own logger below the 'pxemanage' logger, with the usual levels:
+
+    debug   - per host detail of bulk operations, e.g. every host read
+              from the registration or every file written
+    info    - the progress of an operation (the default level)
+    warning - something was skipped or needs the operator's attention
+    error   - an operation failed
+
+Messages are formatted lazily (logger.info("host %s", hostname)), and
+loops that would only build debug messages check isEnabledFor first,
+so disabled log statements cost next to nothing on hot paths.
+
+The scripts call setup_logging from their -v/-q/--log-json options.
+Text output looks like the original console output of the scripts,
+with --log-json each record is written as one json object per line
+instead, for shipping to a log pipeline.
+
+"""
+import json
+import logging
+import sys
+import time
+
+
+package_logger = logging.getLogger("pxemanage")
+
+# extra attributes of a log record that are included in json lines,
+# e.g. logger.info("...", extra={'hostname': hostname})
+json_extra_fields = ('hostname', 'macaddress', 'ipaddress', 'profile', 'event')
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Format log records as single line json objects."""
+    def format(self, record):
+        entry = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                    + f".{int(record.msecs):03d}Z",
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            # the banner and indentation decorations are for terminals
+            'message': record.getMessage().strip(" -=\n"),
+        }
+        for field in json_extra_fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_logging(verbosity=0, json_lines=False, stream=None):
+    """Send the pxemanage log to a stream.
+
+    Parameters
+    ----------
+    verbosity - 0 logs info and above, 1 or more also logs debug
+      messages, negative values only log warnings and errors.
+    json_lines - if True log records are written as json lines,
+      otherwise as plain messages.
+    stream - the stream logged to, by default standard output.
+    """
+    if verbosity < 0:
+        level = logging.WARNING
+    elif verbosity == 0:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if json_lines:
+        handler.setFormatter(JSONLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    for old_handler in list(package_logger.handlers):
+        package_logger.removeHandler(old_handler)
+    package_logger.addHandler(handler)
+    package_logger.setLevel(level)
+    package_logger.propagate = False
+
+
+def add_logging_arguments(parser):
+    """Add the -v/--verbose, -q/--quiet and --log-json options to the
+    argument parser of a script.
+    """
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='log more detail, e.g. every host of bulk operations')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only log warnings and errors')
+    parser.add_argument('--log-json', action='store_true',
+                        help='log json lines, one object per record, for a log pipeline')
+
+
+def setup_script_logging(args):
+    """Set up logging from the options added by add_logging_arguments."""
+    setup_logging(-1 if args.quiet else args.verbose, args.log_json)
@@ -0,0 +1,337 @@
+"""pxemanage module
+
+manifest submodule
+
+Contents
+--------
+
+The build manifest records, for every artifact we generate, the hashes
+of the templates it was rendered from and of the inputs it was
+rendered with.  The artifacts are
+
+    bootconfig/<hostname>  the pxelinux.cfg file of a host
+    kickstart/<hostname>   the ks user-data and meta-data files of a host
+    registration           the dhcpd.conf registration and its shards
+
+An artifact is stale when the current hash of one of its templates
+(including the templates it includes or extends) or of its inputs
+(host fields, the settings used and the management key) differs from
+the recorded one, or it was never recorded.  sync_artifacts rebuilds
+only the stale artifacts, so editing one profile template only
+rebuilds the kickstart files of the hosts using that profile.
+
+The manifest is kept in memory while artifacts are created and is
+saved when the generation they were staged in is published.  It
+records the generation it describes, after a rollback to another
+generation every artifact is treated as stale.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from jinja2 import meta
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# the manifest being updated, loaded from the manifest file when first
+# needed
+_manifest = None
+_manifest_lock = threading.RLock()
+
+# hash of the source of each template, with the file stat it was
+# computed for
+_template_source_digests = {}
+
+# management key read for the key file stat
+_management_key = (None, None)
+
+
+def _load_manifest():
+    """Return the in memory manifest, reading it from the manifest
+    file the first time.
+    """
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(pm.settings['build_manifest_file']) as file:
+                _manifest = json.load(file)
+        except FileNotFoundError:
+            _manifest = {'generation': None, 'artifacts': {}}
+    return _manifest
+
+
+def save_build_manifest():
+    """Write the in memory manifest to the manifest file, recording the
+    currently published generation.
+    """
+    with _manifest_lock:
+        manifest = _load_manifest()
+        manifest['generation'] = pm.current_generation()
+        manifest_file = pm.settings['build_manifest_file']
+        os.makedirs(os.path.dirname(manifest_file) or ".", exist_ok=True)
+        with open(f"{manifest_file}.new", mode="w") as file:
+            json.dump(manifest, file)
+        os.replace(f"{manifest_file}.new", manifest_file)
+
+
+def discard_build_manifest():
+    """Forget the records made since the manifest was last saved, e.g.
+    when a staged generation is discarded.
+    """
+    global _manifest
+    with _manifest_lock:
+        _manifest = None
+
+
+def template_digest(name):
+    """Return the hash of a template and of every template it includes,
+    imports or extends.
+
+    Parameters
+    ----------
+    name - the template name, e.g. 'profiles/compute/user-data.j2'
+    """
+    digest = hashlib.sha1()
+    seen = set()
+    pending = [name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        source, filename, _ = pm.j2.loader.get_source(pm.j2, name)
+        stat = os.stat(filename)
+        cached = _template_source_digests.get(filename)
+        if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+            references = [reference for reference in meta.find_referenced_templates(pm.j2.parse(source))
+                          if reference is not None]
+            cached = ((stat.st_mtime_ns, stat.st_size), hashlib.sha1(source.encode()).hexdigest(), references)
+            _template_source_digests[filename] = cached
+        digest.update(f"{name} {cached[1]}\n".encode())
+        pending.extend(cached[2])
+    return digest.hexdigest()
+
+
+def inputs_digest(inputs):
+    """Return the hash of the inputs an artifact is rendered with.
+
+    Parameters
+    ----------
+    inputs - a json serializable dictionary of the inputs.
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def management_key():
+    """Return the public key of the management account, quoted to be
+    rendered into user-data files.  The key file is only read again
+    when it changes.
+    """
+    global _management_key
+    key_file = pm.settings['ansible_manager_key']
+    stat = os.stat(key_file)
+    if _management_key[0] != (key_file, stat.st_mtime_ns, stat.st_size):
+        with open(key_file) as file:
+            key = file.readlines()[0].strip()
+        _management_key = ((key_file, stat.st_mtime_ns, stat.st_size), f'"{key}"')
+    return _management_key[1]
+
+
+def bootconfig_inputs(host):
+    """Return the templates and inputs of the bootconfig file of a host.
+    The boot label (install or local) is not an input, it is state
+    kept in the file that rebuilding preserves.
+    """
+    templates = ["pxeboot.cfg.j2"]
+    inputs = {
+        'hostname': host.hostname,
+        'macaddress': host.macaddress,
+        'apache_server_ip': pm.settings['apache_server_ip'],
+        'iso_image_name': pm.settings['iso_image_name'],
+    }
+    if pm.settings['boot_mode'] == "ipxe":
+        templates = ["ipxe.j2"]
+        inputs['ipxe_kernel'] = pm.settings['ipxe_kernel']
+        inputs['ipxe_initrd'] = pm.settings['ipxe_initrd']
+    return templates, inputs
+
+
+def kickstart_inputs(host):
+    """Return the templates and inputs of the kickstart files of a host."""
+    templates = [f"profiles/{host.profile}/user-data.j2", f"profiles/{host.profile}/meta-data.j2"]
+    inputs = {
+        'hostname': host.hostname,
+        'ipaddress': host.ipaddress,
+        'management_key': management_key(),
+    }
+    return templates, inputs
+
+
+def registration_inputs():
+    """Return the templates and inputs of the registration (dhcpd.conf
+    and its shards).  The host fields are summarized as a single hash.
+    """
+    templates = ["dhcpd.conf.j2", "dhcpd-hosts.conf.j2"]
+    digest = hashlib.sha1()
+    for hostname in sorted(pm.hosts):
+        host = pm.hosts[hostname]
+        digest.update(f"{host.hostname} {host.macaddress} {host.ipaddress} {host.profile}\n".encode())
+    inputs = {
+        'subnets': pm.configured_subnets(),
+        'pxefilename': pm.settings['pxefilename'],
+        'registration_shard_dir': pm.settings['registration_shard_dir'],
+        'hosts': digest.hexdigest(),
+    }
+    if pm.settings['boot_mode'] == "ipxe":
+        inputs['boot_loader'] = pm.boot_loader_inputs()
+    return templates, inputs
+
+
+def record_artifact(key, templates, inputs):
+    """Record the templates and inputs an artifact was just built with.
+
+    Parameters
+    ----------
+    key - the artifact, e.g. 'kickstart/cloud01'
+    templates - the names of the templates it was rendered from.
+    inputs - the dictionary of inputs it was rendered with.
+    """
+    record = {
+        'templates': {name: template_digest(name) for name in templates},
+        'inputs': inputs_digest(inputs),
+    }
+    with _manifest_lock:
+        _load_manifest()['artifacts'][key] = record
+
+
+def forget_artifact(key):
+    """Remove an artifact that was deleted from the manifest."""
+    with _manifest_lock:
+        _load_manifest()['artifacts'].pop(key, None)
+
+
+def stale_reason(key, templates, inputs):
+    """Check if an artifact needs to be rebuilt.
+
+    Returns
+    -------
+    reason - None if the artifact is up to date, otherwise a short
+      description of why it is stale.
+    """
+    with _manifest_lock:
+        manifest = _load_manifest()
+        record = manifest['artifacts'].get(key)
+        generation = manifest['generation']
+    if record is None:
+        return "not in manifest"
+    if generation != pm.current_generation():
+        return f"manifest is for generation {generation}"
+    for name in templates:
+        if record['templates'].get(name) != template_digest(name):
+            return f"template {name} changed"
+    if record['inputs'] != inputs_digest(inputs):
+        return "inputs changed"
+    return None
+
+
+def stale_artifacts():
+    """Find the artifacts of the registered hosts that are stale.
+
+    Returns
+    -------
+    stale - a list of (key, reason) tuples, e.g.
+      ('kickstart/cloud01', 'template profiles/compute/user-data.j2 changed')
+    """
+    stale = []
+    for hostname in sorted(pm.hosts):
+        host = pm.hosts[hostname]
+        for kind, inputs_of in (('bootconfig', bootconfig_inputs), ('kickstart', kickstart_inputs)):
+            key = f"{kind}/{hostname}"
+            reason = stale_reason(key, *inputs_of(host))
+            if reason:
+                stale.append((key, reason))
+    reason = stale_reason('registration', *registration_inputs())
+    if reason:
+        stale.append(('registration', reason))
+    return stale
+
+
+def sync_artifacts(dry_run=False, max_workers=8):
+    """Rebuild only the stale artifacts.  Host files are rebuilt in
+    parallel into one staged generation, the registration is rewritten
+    (and dhcpd restarted) only if it is stale.
+
+    Parameters
+    ----------
+    dry_run - if True only report the stale artifacts.
+    max_workers - the number of host files rebuilt at once.
+
+    Returns
+    -------
+    stale - the list of (key, reason) of the stale artifacts found.
+    """
+    logger.info("======== Sync generated artifacts ========")
+    stale = stale_artifacts()
+    for key, reason in stale:
+        logger.info("    -------- stale %s: %s", key, reason)
+    logger.info("    -------- %d stale artifacts", len(stale))
+    if dry_run or not stale:
+        return stale
+
+    bootconfigs = [key.partition('/')[2] for key, _ in stale if key.startswith("bootconfig/")]
+    kickstarts = [key.partition('/')[2] for key, _ in stale if key.startswith("kickstart/")]
+    if bootconfigs or kickstarts:
+        with pm.staged_generation():
+            pm.generation_map(lambda hostname: pm.create_bootconfig_file(hostname, boot=None), bootconfigs,
+                              max_workers)
+            pm.generation_map(lambda hostname: pm.create_kickstart_file(hostname, chown=False), kickstarts,
+                              max_workers)
+            pm.chown_kickstart_files(kickstarts)
+    if any(key == 'registration' for key, _ in stale):
+        pm.update_host_registration()
+        pm.restart_dhcpd_service()
+    return stale
+
+
+def _watched_files():
+    """Return the stat of every template and of the management key."""
+    stats = {}
+    for dirpath, dirnames, filenames in os.walk("templates/"):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            stat = os.stat(filename)
+            stats[filename] = (stat.st_mtime_ns, stat.st_size)
+    key_file = pm.settings['ansible_manager_key']
+    if os.path.exists(key_file):
+        stat = os.stat(key_file)
+        stats[key_file] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def watch_artifacts(interval=0.1):
+    """Sync the artifacts, then keep watching the templates and the
+    management key, syncing again as soon as one of them changes.
+    Runs until interrupted.
+
+    Parameters
+    ----------
+    interval - seconds between checks of the watched files.
+    """
+    stats = _watched_files()
+    sync_artifacts()
+    logger.info("    -------- watching templates for changes, use ctrl-c to stop")
+    while True:
+        time.sleep(interval)
+        new_stats = _watched_files()
+        if new_stats != stats:
+            changed = sorted(name for name in new_stats.keys() | stats.keys()
+                             if new_stats.get(name) != stats.get(name))
+            logger.info("    -------- changed: %s", " ".join(changed))
+            stats = new_stats
+            sync_artifacts()
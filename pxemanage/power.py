@@ -0,0 +1,206 @@
+"""pxemanage module
+
+power submodule
+
+Contents
+--------
+
+Power control backends used to (re)boot hosts into a network install.
+Each backend has a power_cycle method that tries to restart a host so
+that it pxe boots, and returns True if the restart was accepted.
+
+    ssh      - ssh to the running host and run 'sudo reboot', the
+               original way we reboot hosts, it can not restart a host
+               that is hung or powered off.
+    ipmi     - ask the host BMC with ipmitool to pxe boot once and power
+               cycle (or power on) the host.
+    redfish  - the same through the Redfish REST api of the BMC.
+    mock     - records the hosts it is asked to restart, for tests and
+               dry runs.
+
+The backend is chosen with the power_backend setting (or a command
+line option), the BMC of a host is found with the bmc_address setting,
+a format string given the hostname and ipaddress of the host, e.g.
+'{hostname}-ipmi'.
+
+"""
+import base64
+import json
+import logging
+import os
+import ssl
+import subprocess
+import urllib.request
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class SSHPower:
+    """Reboot running hosts over ssh with the management identity."""
+    name = "ssh"
+
+    def power_cycle(self, host):
+        """Reboot a host with ssh, it must be up and accept the
+        management identity.
+
+        Parameters
+        ----------
+        host - the Host to reboot.
+
+        Returns
+        -------
+        rebooted - True if the reboot command was sent.
+        """
+        key = pm.settings['identity']
+        args = pm.settings['ssh_args']
+        username = pm.settings['username']
+
+        # we first detect if machine has working ssh communication with
+        # the identity we are using
+        command = f"ssh -i {key} {args} {username}@{host.ipaddress} 'sudo hostname'"
+        try:
+            subprocess.run(command, shell=True, check=True, capture_output=True)
+        except subprocess.CalledProcessError:
+            logger.error("    -------- Error, could not connect to %s, is identity correct?", host.hostname)
+            return False
+
+        # it is normal for this command to fail with a 255 returncode because we
+        # will loose the connection
+        command = f"ssh -i {key} {args} {username}@{host.ipaddress} 'sudo reboot'"
+        logger.debug("    -------- running command <%s>", command)
+        try:
+            subprocess.run(command, shell=True, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            return e.returncode == 255
+        return True
+
+
+class IPMIPower:
+    """Power cycle hosts through their BMC with ipmitool."""
+    name = "ipmi"
+
+    def _ipmitool(self, host, *args):
+        """Run an ipmitool command against the BMC of a host, the
+        password is passed in the environment so it is not visible in
+        the process list.
+        """
+        command = ["ipmitool", "-I", "lanplus", "-H", bmc_address(host),
+                   "-U", pm.settings['bmc_username'], "-E"] + list(args)
+        environment = dict(os.environ, IPMI_PASSWORD=str(pm.settings['bmc_password']))
+        try:
+            result = subprocess.run(command, env=environment, capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.error("    -------- Error, ipmitool failed for %s: %s", host.hostname, e)
+            return False
+        if result.returncode != 0:
+            logger.error("    -------- Error, ipmitool %s failed for %s: %s",
+                         " ".join(args), host.hostname, result.stderr.strip())
+        return result.returncode == 0
+
+    def power_cycle(self, host):
+        """Set a host to pxe boot once and power cycle it, powering it
+        on if it is off.
+        """
+        if not self._ipmitool(host, "chassis", "bootdev", "pxe"):
+            return False
+        return (self._ipmitool(host, "chassis", "power", "cycle")
+                or self._ipmitool(host, "chassis", "power", "on"))
+
+
+class RedfishPower:
+    """Power cycle hosts through the Redfish api of their BMC."""
+    name = "redfish"
+
+    def _request(self, host, method, path, body):
+        """Send a json request to the BMC of a host, returning True if
+        it was accepted.
+        """
+        url = f"https://{bmc_address(host)}{path}"
+        credentials = f"{pm.settings['bmc_username']}:{pm.settings['bmc_password']}"
+        request = urllib.request.Request(url, data=json.dumps(body).encode(), method=method, headers={
+            'Content-Type': "application/json",
+            'Authorization': "Basic " + base64.b64encode(credentials.encode()).decode(),
+        })
+        context = ssl.create_default_context()
+        if not pm.settings['redfish_verify_tls']:
+            # BMCs usually have self signed certificates
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        try:
+            with urllib.request.urlopen(request, context=context, timeout=30) as response:
+                return 200 <= response.status < 300
+        except OSError as e:
+            logger.error("    -------- Error, redfish %s %s failed for %s: %s", method, path, host.hostname, e)
+            return False
+
+    def power_cycle(self, host):
+        """Set a host to pxe boot once and force a restart."""
+        system = f"/redfish/v1/Systems/{pm.settings['redfish_system_id']}"
+        boot = {'Boot': {'BootSourceOverrideEnabled': "Once", 'BootSourceOverrideTarget': "Pxe"}}
+        if not self._request(host, "PATCH", system, boot):
+            return False
+        return self._request(host, "POST", f"{system}/Actions/ComputerSystem.Reset",
+                             {'ResetType': "ForceRestart"})
+
+
+class MockPower:
+    """Power control that only records the hosts it is asked to
+    restart, for tests and dry runs.
+    """
+    name = "mock"
+
+    def __init__(self, succeed=True, on_power_cycle=None):
+        """Define class constructor for the mock power control.
+
+        Parameters
+        ----------
+        succeed - the result returned by power_cycle.
+        on_power_cycle - an optional function called with each host
+          that is power cycled, e.g. to simulate it booting.
+        """
+        self.succeed = succeed
+        self.on_power_cycle = on_power_cycle
+        self.calls = []
+
+    def power_cycle(self, host):
+        """Record the host, and report the configured result."""
+        logger.info("    -------- mock power cycle of host %s", host.hostname)
+        self.calls.append(host.hostname)
+        if self.on_power_cycle:
+            self.on_power_cycle(host)
+        return self.succeed
+
+
+# the available power control backends by name
+power_backends = {
+    'ssh': SSHPower,
+    'ipmi': IPMIPower,
+    'redfish': RedfishPower,
+    'mock': MockPower,
+}
+
+
+def get_power_backend(name=None):
+    """Create a power control backend.
+
+    Parameters
+    ----------
+    name - the backend name, by default the power_backend setting.
+
+    Returns
+    -------
+    backend - the power control backend.
+    """
+    name = name or pm.settings['power_backend']
+    if name not in power_backends:
+        raise ValueError(f"unknown power backend {name}, expected one of {', '.join(power_backends)}")
+    return power_backends[name]()
+
+
+def bmc_address(host):
+    """Return the address of the BMC of a host from the bmc_address
+    setting.
+    """
+    return pm.settings['bmc_address'].format(hostname=host.hostname, ipaddress=host.ipaddress)
@@ -0,0 +1,168 @@
+"""pxemanage module
+
+prewarm submodule
+
+Contents
+--------
+
+Load the files every installing host downloads (the installer iso
+served by apache, and the kernel and initrd served by tftpd) into the
+page cache before the hosts ask for them.  Otherwise the first hosts
+of a reinstall wave wait for cold disk reads of a multi gigabyte iso.
+
+Each file is prewarmed by advising the kernel that we will need it
+(posix_fadvise WILLNEED starts the readahead) and then reading it
+through, and its page cache residency is measured before and after
+with mincore.  Files are prewarmed one after the other in a background
+thread, so the reboot of the hosts is not held up and the disk reads
+sequentially.
+
+"""
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import namedtuple
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# size of the reads used to pull a file into the page cache
+prewarm_read_size = 4 * 1024 * 1024
+
+# the result of prewarming a file, residency is the fraction of its
+# pages in the page cache (None where it could not be measured)
+PrewarmReport = namedtuple('PrewarmReport', ['filename', 'size', 'resident_before', 'resident_after', 'seconds'])
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+_libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+map_failed = ctypes.c_void_p(-1).value
+
+
+def prewarm_file_list():
+    """Return the files downloaded by every installing host: the
+    installer iso and the kernel and initrd, from the tftp root or in
+    the ipxe boot mode from the images directory.
+    """
+    if pm.settings['boot_mode'] == "ipxe":
+        return [os.path.join(pm.settings['images_dir'], pm.settings[key])
+                for key in ('iso_image_name', 'ipxe_kernel', 'ipxe_initrd')]
+    return [
+        os.path.join(pm.settings['images_dir'], pm.settings['iso_image_name']),
+        os.path.join(pm.settings['tftp_root_dir'], "vmlinuz"),
+        os.path.join(pm.settings['tftp_root_dir'], "initrd"),
+    ]
+
+
+def file_residency(filename):
+    """Measure how much of a file is in the page cache.
+
+    Parameters
+    ----------
+    filename - the file to check.
+
+    Returns
+    -------
+    residency - the fraction of the pages of the file that are
+      resident, 1.0 for an empty file, or None if it can not be
+      measured.
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return 1.0
+        address = _libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if address in (None, map_failed):
+            return None
+        try:
+            pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vector = (ctypes.c_ubyte * pages)()
+            if _libc.mincore(address, size, vector) != 0:
+                return None
+            return sum(page & 1 for page in vector) / pages
+        finally:
+            _libc.munmap(address, size)
+    finally:
+        os.close(fd)
+
+
+def prewarm_file(filename):
+    """Load a file into the page cache.
+
+    Parameters
+    ----------
+    filename - the file to prewarm.
+
+    Returns
+    -------
+    report - a PrewarmReport of the residency of the file before and
+      after, and the seconds taken.
+    """
+    started = time.monotonic()
+    resident_before = file_residency(filename)
+    with open(filename, mode="rb", buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        buffer = bytearray(prewarm_read_size)
+        while file.readinto(buffer):
+            pass
+    resident_after = file_residency(filename)
+    return PrewarmReport(filename, size, resident_before, resident_after, time.monotonic() - started)
+
+
+def _percent(residency):
+    """Format a residency fraction for the log."""
+    return "unknown" if residency is None else f"{residency * 100:.0f}%"
+
+
+def prewarm_files(filenames=None):
+    """Load files into the page cache one after the other, logging the
+    residency of each and the time taken.
+
+    Parameters
+    ----------
+    filenames - the files to prewarm, by default those of prewarm_file_list.
+
+    Returns
+    -------
+    reports - a list of the PrewarmReport of each file prewarmed, missing
+      files are skipped with a warning.
+    """
+    reports = []
+    for filename in filenames or prewarm_file_list():
+        try:
+            report = prewarm_file(filename)
+        except OSError as e:
+            logger.warning("    -------- could not prewarm %s: %s", filename, e)
+            continue
+        logger.info("    -------- prewarmed %s (%d MB) %s resident, was %s, in %.2f seconds",
+                    filename, report.size // (1024 * 1024), _percent(report.resident_after),
+                    _percent(report.resident_before), report.seconds)
+        reports.append(report)
+    return reports
+
+
+def start_prewarm(filenames=None):
+    """Prewarm files in a background thread.
+
+    Parameters
+    ----------
+    filenames - the files to prewarm, by default those of prewarm_file_list.
+
+    Returns
+    -------
+    thread - the started prewarm thread.
+    """
+    logger.info("======== Prewarm install files into the page cache ========")
+    thread = threading.Thread(target=prewarm_files, args=(filenames,), name="prewarm", daemon=True)
+    thread.start()
+    return thread
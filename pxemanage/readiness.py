@@ -0,0 +1,252 @@
+"""pxemanage module
+
+readiness submodule
+
+Contents
+--------
+
+Detect when an installing host has finished its install and is up and
+running.  A host is probed until its ssh server (port 22 of its
+registered ip address) accepts a connection and answers with an ssh
+banner ('SSH-2.0-...').  An answering ssh server is not enough, the
+Ubuntu live server installer runs its own sshd on the same address
+during the install.  So the host is only ready once we can also log in
+with the management identity and username, which only the installed
+system accepts, and it reports the registered hostname.  Ready hosts
+are moved to the RUNNING status.
+
+Hosts are probed from a single asyncio event loop, so thousands of
+hosts can be waited on at once without a thread per host.  Each host
+is probed with exponential backoff (with some jitter so a rack of
+hosts does not probe in lock step), and the number of probes in
+flight at once is limited by a semaphore.  The time from when the
+reinstall of each host started until it was ready is recorded, giving
+the end to end reinstall time of every host.
+
+"""
+import asyncio
+import logging
+import random
+import shlex
+import threading
+import time
+from contextlib import nullcontext
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessProber:
+    """Probe installing hosts until their ssh server is ready."""
+    def __init__(self, port=22, timeout=3600.0, concurrency=500,
+                 initial_backoff=5.0, max_backoff=60.0, connect_timeout=5.0,
+                 on_ready=None, clock=time.monotonic, lock=None):
+        """Define class constructor for the readiness prober.
+
+        Parameters
+        ----------
+        port - the tcp port of the ssh server.
+        timeout - seconds after the reinstall started that we give up on
+          a host.
+        concurrency - the most probes in flight at once.
+        initial_backoff - seconds between the first probes of a host, the
+          time is doubled after every failed probe.
+        max_backoff - the most seconds between the probes of a host.
+        connect_timeout - seconds a single probe may take.
+        on_ready - optional function called with each host that becomes
+          ready, after its status is set to RUNNING.
+        clock - function returning the current time in seconds.
+        lock - if given, the lock held while the status of a ready host
+          is changed and on_ready is called, e.g. the lock of the
+          pxemanaged daemon, as hosts are probed in their own thread.
+        """
+        self.port = port
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.on_ready = on_ready
+        self.clock = clock
+        self.lock = lock
+        # seconds from the reinstall start until each host was ready,
+        # None for hosts we gave up on
+        self.results = {}
+        self._semaphore = None
+        self._loop = None
+        self._thread = None
+
+    async def probe(self, ipaddress):
+        """Probe the ssh server of a host once.
+
+        Parameters
+        ----------
+        ipaddress - the ip address of the host.
+
+        Returns
+        -------
+        banner - the ssh banner of the host, or None if it is not ready.
+        """
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ipaddress, self.port), self.connect_timeout)
+            banner = await asyncio.wait_for(reader.readline(), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+        banner = banner.decode(errors="replace").strip()
+        return banner if banner.startswith("SSH-") else None
+
+    async def login(self, host):
+        """Log in to a host whose ssh server answers with the management
+        identity and username, and ask it for its hostname.
+
+        Parameters
+        ----------
+        host - the Host.
+
+        Returns
+        -------
+        hostname - the hostname reported by the host, or None if we
+          could not log in, e.g. to the sshd of the installer.
+        """
+        # a reinstalled host has new host keys, and the installer has
+        # keys of its own, so host keys are not checked or remembered
+        command = ["ssh", "-i", pm.settings['identity']] + shlex.split(pm.settings['ssh_args']) + [
+            "-o", "BatchMode=yes", "-o", f"ConnectTimeout={max(1, int(self.connect_timeout))}",
+            "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "LogLevel=ERROR",
+            "-p", str(self.port), f"{pm.settings['username']}@{host.ipaddress}", "hostname"]
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return None
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), self.connect_timeout * 2)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return None
+        if process.returncode != 0:
+            return None
+        return output.decode(errors="replace").strip() or None
+
+    async def ready(self, host):
+        """Determine if a host is up and running its installed system:
+        its ssh server answers, we can log in and it reports its
+        registered hostname.
+
+        Returns
+        -------
+        banner - the ssh banner of the host, or None if it is not ready.
+        """
+        banner = await self.probe(host.ipaddress)
+        if not banner:
+            return None
+        reported = await self.login(host)
+        if reported is None or reported.split(".")[0] != host.hostname:
+            logger.debug("    -------- host %s ssh answers but it is not the installed system (%s)",
+                         host.hostname, reported)
+            return None
+        return banner
+
+    async def wait_ready(self, hostname, started=None):
+        """Probe a host with exponential backoff until it is ready or
+        the timeout passes.
+
+        Parameters
+        ----------
+        hostname - the installing host.
+        started - the clock time the reinstall of the host started, by
+          default now.
+
+        Returns
+        -------
+        ready - True if the host is ready.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if started is None:
+            started = self.clock()
+        host = pm.hosts[hostname]
+        delay = self.initial_backoff
+        while True:
+            async with self._semaphore:
+                banner = await self.ready(host)
+            elapsed = self.clock() - started
+            if banner:
+                logger.info("    -------- host %s is ready after %.0fs: %s", hostname, elapsed, banner,
+                            extra={'hostname': hostname, 'event': "ready"})
+                with self.lock or nullcontext():
+                    host.status = pm.status.RUNNING
+                    self.results[hostname] = elapsed
+                    if self.on_ready:
+                        self.on_ready(host)
+                return True
+            if elapsed + delay > self.timeout:
+                logger.warning("    -------- Warning: host %s not ready after %.0fs, giving up", hostname, elapsed)
+                self.results[hostname] = None
+                return False
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, self.max_backoff)
+
+    async def wait_all_ready(self, hostnames, started=None):
+        """Wait for all of the given hosts at once, see wait_ready."""
+        return await asyncio.gather(*(self.wait_ready(hostname, started) for hostname in hostnames))
+
+    def wait_for_hosts(self, hostnames, started=None):
+        """Wait until all of the given hosts are ready or given up on.
+
+        Parameters
+        ----------
+        hostnames - the installing hosts.
+        started - the clock time their reinstall started, by default now.
+
+        Returns
+        -------
+        results - a dictionary of hostname to the seconds it took to be
+          ready, None for hosts that were given up on.
+        """
+        logger.info("======== Wait for %d hosts to be ready ========", len(hostnames))
+        self._semaphore = None
+        asyncio.run(self.wait_all_ready(hostnames, started))
+        return {hostname: self.results[hostname] for hostname in hostnames}
+
+    def start(self):
+        """Run an event loop in a background thread, so hosts can be
+        submitted as they begin installing, e.g. by the daemon.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, hostname, started=None):
+        """Start waiting for a host in the background event loop."""
+        return asyncio.run_coroutine_threadsafe(self.wait_ready(hostname, started), self._loop)
+
+    def stop(self):
+        """Stop the background event loop."""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+    def report(self):
+        """Print the time each host took to be ready, and a summary."""
+        logger.info("======== Reinstall readiness report ========")
+        times = sorted(elapsed for elapsed in self.results.values() if elapsed is not None)
+        for hostname in sorted(self.results):
+            elapsed = self.results[hostname]
+            if elapsed is None:
+                logger.warning("    -------- host %s NOT READY", hostname)
+            else:
+                logger.debug("    -------- host %s ready after %.0fs", hostname, elapsed)
+        if times:
+            logger.info("    -------- %d of %d hosts ready, fastest %.0fs median %.0fs slowest %.0fs",
+                        len(times), len(self.results), times[0], times[len(times) // 2], times[-1])
@@ -22,14 +22,15 @@ tftp RRQ for initrd file: When a machine is performing a netboot
   itself currently.
 
 """
-import os
-import re
-import sys
+import logging
 import time
 import pxemanage as pm
 
 
-def monitor_host_registrations():
+logger = logging.getLogger(__name__)
+
+
+def monitor_host_registrations(systemevent=None, autoregistration=None, discovery_filter=None):
     """Begin monitoring syslog for DHCPDISCOVER requests.  A node when
     netbooted will make a DHCPDISCOVER to try and be assigned its ip
     addanss.  If we see a discover request, it may be from a node we
@@ -42,84 +43,77 @@ def monitor_host_registrations():
     Then we have to update the registration database, and update
     the dhcp configuration and reload dhcpd configuration.
 
-    This method runs until the user quits the registration.
+    This method runs until the user quits the registration, or until
+    the given system events are exhausted when replaying a log file.
 
     TODO: we may want/need asynchronous monitoring here, so we can
        either prompt user when we discover an event needing input
        asynchronously, or allow the user to quit the monitoring
        once done.
 
+    Parameters
+    ----------
+    systemevent - an iterator of system event lines to monitor.  By
+      default we follow the configured event source, e.g. the system
+      events file (syslog) replaying any events missed since the last
+      checkpoint, see the eventsources submodule.
+    autoregistration - if given, an AutoRegistration with the rules used
+      to register new hosts in batches without asking the operator.
+    discovery_filter - the DiscoveryFilter that discovered hosts must
+      pass, by default one built from the discovery settings.
     """
-    print("======== Monotor Syslog for Host Registration Requests ========")
-    systemevent = follow_system_events_file()
+    logger.info("======== Monotor Syslog for Host Registration Requests ========")
+    if systemevent is None:
+        # wake up regularly to register the batch of auto registered
+        # hosts and set the installing hosts to a local boot once
+        # events pause
+        systemevent = pm.system_events(idle=True)
+    if discovery_filter is None:
+        discovery_filter = pm.build_discovery_filter()
     
     # iterate over the lines
-    print("    -------- async monitor system events starting")
-    print("")
-    print("    use ctrl-c to end host registration cleanly")
-    print("")
-    while True:
-        # get next system event
-        line = next(systemevent)
-
-        # determine if a DHCPDISCOVER was received
-        mac_pattern = "..:..:..:..:..:.."        
-        pattern = re.compile(f"^.*DHCPDISCOVER\s+from\s+({mac_pattern}).*$")
-        match = pattern.match(line)
-        
-        # if offer received, gather information from operator
-        # to see how we should register this machine
-        if match:
-            macaddress = match.group(1)
-            pm.register_host(macaddress)
-
-        # determine if registerd host install has begun
-        ip_pattern = "\d+\.\d+\.\d+\.\d+"
-        pattern = re.compile(f"^.*RRQ\s+from\s+({ip_pattern})\s+filename\s+initrd.*$")
-        match = pattern.match(line)
-
-        # if an initrd file was requested, the host is doing an autoinstall
-        if match:
-            ipaddress = match.group(1)
-            #print(f"    detected autoinstall in progress from ipaddress: <{ipaddress}>")
-            pm.install_host(ipaddress)
-
-    # actually cannot currently get here, there is no way to stop monitoring for
+    logger.info("    -------- async monitor system events starting")
+    logger.info("    use ctrl-c to end host registration cleanly")
+    batch = pm.LocalBootBatch()
+    try:
+        for line in systemevent:
+            # determine if a DHCPDISCOVER was received
+            event = pm.parse_system_event(line)
+
+            # if offer received, gather information from operator
+            # to see how we should register this machine, repeated
+            # discovers of registered, declined and denied hosts are
+            # filtered out first
+            if event and event.kind == "discover" and discovery_filter.admit(event.macaddress):
+                macaddress = event.macaddress
+                if autoregistration:
+                    host = autoregistration.discover(macaddress)
+                else:
+                    host = pm.register_host(macaddress)
+                if host:
+                    discovery_filter.registered(macaddress)
+                elif not autoregistration:
+                    discovery_filter.decline(macaddress)
+
+            # register the batch of auto registered hosts once its window passes
+            if autoregistration:
+                autoregistration.flush_due()
+
+            # if an initrd file was requested, the host is doing an
+            # autoinstall, the hosts that began installing are set back
+            # to a local boot together
+            if event and event.kind == "initrd":
+                pm.install_host(event.ipaddress, batch)
+            batch.flush_due(idle=not line)
+    finally:
+        batch.flush()
+
+    # we only get here when replaying a finite log, when following the
+    # system events file there is no way to stop monitoring for
     # registration until the user tells us that registration is done
-    print("    -------- finishing host registration")
-    pm.stop_services()
-
-
-def follow_system_events_file():
-    """From: https://medium.com/@aliasav/how-follow-a-file-in-python-tail-f-in-python-bca026a901cf
-    Setup up generator that seeks to end of file and yields new
-    lines as they are logged.  This work by actually never returning, if it performs
-    a read but the file is at the end of the file, it sleeps a bit and trys to keep
-    reading again. readline() python module can handle this and will keep reading 
-    new lines at the end of the file as they appear in the log.
-
-    Returns
-    -------
-    system event string - Each yield retuns a line from the system events
-       log (syslog), as soon as it become available.
-    """
-    # open the systems events file (syslog)
-    systemfile = open(pm.settings['system_event_file'])
-    
-    # seek the end of the file
-    systemfile.seek(0, os.SEEK_END)
-
-    # start infinite loop
-    while True:
-        # read last line of file
-        line = systemfile.readline()
-
-        # sleep if file hasn't been updated
-        if not line:
-            time.sleep(0.5)
-            continue
-
-        yield line
+    if autoregistration:
+        autoregistration.flush()
+    logger.info("    -------- finishing host registration")
 
 
 def register_host(macaddress):
@@ -133,20 +127,25 @@ def register_host(macaddress):
     the machine.  If so we gather the information we need to register the
     machine and return.
 
-    TODO: add command line options to allow for auto sequence registrations,
-    e.g. first host get number 01, name cloud01 and ip 192.168.0.1...
+    See the autoregister submodule for registering hosts automatically
+    from naming and ip address rules instead.
 
     Parameters
     ----------
     macaddress - The hardware mac address of the machine that was
       detected asking for a dhcp lease offer.
+
+    Returns
+    -------
+    host - the newly registered Host, or None if the host was already
+      registered or the operator declined to register it.
     """
     # ignore already registered hosts
-    if pm.is_registered(macaddress):
-        hostname = pm.lookup_host_by_mac(macaddress)
+    hostname = pm.lookup_host_by_mac(macaddress)
+    if hostname:
         #print(f"    detected DHCPDISCOVER from macaddress: {macaddress}")
         #print(f"    not registering macaddress: {macaddress} already registered as host: {hostname}")
-        return
+        return None
 
     # otherwise see if we should register this new host
     print(f"    detected DHCPDISCOVER from macaddress: {macaddress}")
@@ -154,7 +153,17 @@ def register_host(macaddress):
     yes_responses = ['y', 'Y', 'yes', 'Yes', 'YES']
     if answer in yes_responses:
         hostname =  input("    enter hostname: ")
-        ipaddress = input("    enter static ip for host: ")
+
+        # check the static ip against the subnet and the addresses already
+        # in use, suggesting the next free address as the default
+        allocator = pm.build_ip_allocator()
+        suggestion = allocator.next_free()
+        while True:
+            ipaddress = input(f"    enter static ip for host [{suggestion}]: ") or suggestion
+            conflict = allocator.conflict(ipaddress) if ipaddress else "no ip address given"
+            if not conflict:
+                break
+            print(f"    WARNING: {conflict}")
         profile =   input("    enter host installation profile: ")
         print("")
         
@@ -162,14 +171,11 @@ def register_host(macaddress):
         pm.hosts[hostname] = host
 
         # create autoinstall boot configuration in anticipation of the
-        # newly registered host performing an autoinstall boot
-        pm.create_bootconfig_file(hostname)
-
-        # TODO: create user-data file
-        # The hostname and ip address are the only things that need to change
-        # in the user-data?  Maybe copy from the profile to ks/hostname/
-        # then do search and replace on those properties
-        pm.create_kickstart_file(hostname)
+        # newly registered host performing an autoinstall boot, and its
+        # kickstart files, published together as one generation
+        with pm.staged_generation():
+            pm.create_bootconfig_file(hostname)
+            pm.create_kickstart_file(hostname)
         
         # now update dhcpd server with new manged host configurations
         # and reload dhcpd service with new configuration
@@ -178,9 +184,60 @@ def register_host(macaddress):
 
         # keep track of the state of this host
         host.status = pm.status.DHCPOFFER
+        return host
+    return None
 
 
-def install_host(ipaddress):
+def register_host_batch(new_hosts, max_workers=8):
+    """Register a batch of new hosts together.  The bootconfig and
+    kickstart files of the hosts are created in parallel, then the
+    registration file (dhcpd.conf) is written and the dhcpd service
+    restarted only once for the whole batch.
+
+    Parameters
+    ----------
+    new_hosts - a list of the new Host objects to register.
+    max_workers - the number of hosts whose files are created at once.
+    """
+    if not new_hosts:
+        return
+
+    logger.info("======== Register batch of %d hosts ========", len(new_hosts))
+    for host in new_hosts:
+        pm.hosts[host.hostname] = host
+
+    # create the autoinstall boot configuration and kickstart files of
+    # all hosts in the batch in parallel, they are published together
+    # as one generation once all of them are written
+    hostnames = [host.hostname for host in new_hosts]
+    with pm.staged_generation():
+        pm.generation_map(create_host_files, hostnames, max_workers)
+        pm.chown_kickstart_files(hostnames)
+
+    # now update dhcpd server with all of the new managed hosts
+    # and reload dhcpd service with new configuration just once
+    pm.update_host_registration()
+    pm.restart_dhcpd_service()
+
+    # keep track of the state of these hosts
+    for host in new_hosts:
+        host.status = pm.status.DHCPOFFER
+
+
+def create_host_files(hostname):
+    """Create the bootconfig and kickstart files a newly registered
+    host needs to perform its autoinstall boot.  The ownership of the
+    kickstart files is fixed afterwards for the whole batch.
+
+    Parameters
+    ----------
+    hostname - the name of the registered host to create files for.
+    """
+    pm.create_bootconfig_file(hostname)
+    pm.create_kickstart_file(hostname, chown=False)
+
+
+def install_host(ipaddress, batch=None):
     """A host that was assigned the given ip address has begun an
     autoinstall boot.  Update the bootconfig file for that host so
     that when they complete and reboot, they don't begin an install
@@ -190,22 +247,121 @@ def install_host(ipaddress):
     ----------
     ipaddress - The ip (internet protocol) address of the host were an
       install in progress was detected.
+    batch - if given, a LocalBootBatch the host is added to, its
+      bootconfig file is changed when the batch is flushed.
+
+    Returns
+    -------
+    hostname - the name of the host, or None if no host is registered
+      with the ip address.
     """
     # look up the host in our registered hosts
     hostname = pm.lookup_host_by_ipaddress(ipaddress)
     if not hostname:
-        print(f"    WARNING: host at {ipaddress} appears to be boot autoinstalling but it is not registered")
-        return
+        logger.warning("    WARNING: host at %s appears to be boot autoinstalling but it is not registered", ipaddress)
+        return None
     
-    print("======== Host performing pxeboot autoinstall ========")
-    print(f"    -------- detected pxeboot autoinstall for host {hostname} ip address {ipaddress}")
+    logger.info("    -------- detected pxeboot autoinstall for host %s ip address %s", hostname, ipaddress,
+                extra={'hostname': hostname, 'ipaddress': ipaddress, 'event': "installing"})
     
     # get a handle on the host and update it
     host = pm.hosts[hostname]
     if not (host.status == pm.status.DHCPOFFER or host.status == pm.status.REBOOTING):
-        print(f"    WARNING: host {host.hostname} was not in expected state when we detected it performing boot autoinstall")
+        logger.warning("    WARNING: host %s was not in expected state when we detected it performing boot autoinstall",
+                       host.hostname)
     host.status = pm.status.INSTALLING
 
     # the host is currently boot autoinstalling.  set pxe bootconfig menu
     # to automatically boot to the local disk on reboot
-    pm.set_host_local_boot(hostname)
+    if batch is not None:
+        batch.add(hostname)
+    else:
+        pm.set_host_local_boot(hostname)
+    return hostname
+
+
+class LocalBootBatch:
+    """The hosts seen beginning their install whose bootconfig files
+    are still to be set back to a local boot.  They are changed together
+    in one staged generation, instead of staging a generation of all
+    the host files for each host during a reinstall wave.  The change
+    only has to be published before the install finishes and the host
+    reboots, so it may be delayed by up to window seconds.
+    """
+    def __init__(self, window=None, clock=time.monotonic, dry_run=False):
+        """Define class constructor for an empty batch.
+
+        Parameters
+        ----------
+        window - the most seconds a host waits in the batch, by default
+          the install_batch_window setting.
+        clock - the function returning the current time, for testing.
+        dry_run - if True the hosts are only reported when the batch is
+          flushed, no bootconfig file is changed, e.g. when replaying a
+          historical log.
+        """
+        self.window = pm.settings['install_batch_window'] if window is None else window
+        self.clock = clock
+        self.dry_run = dry_run
+        self.hostnames = []
+        self.started = None
+
+    def __len__(self):
+        return len(self.hostnames)
+
+    def add(self, hostname):
+        """Add a host that began its install to the batch."""
+        if not self.hostnames:
+            self.started = self.clock()
+        if hostname not in self.hostnames:
+            self.hostnames.append(hostname)
+
+    def due(self):
+        """Return True if the oldest host of the batch waited the window."""
+        return bool(self.hostnames) and self.clock() - self.started >= self.window
+
+    def flush(self):
+        """Set the hosts of the batch to a local boot, in one generation.
+
+        A host whose bootconfig file can not be changed (e.g. it is
+        missing) is skipped with a warning, the other hosts of the batch
+        are still changed.  The batch is only emptied once the generation
+        is published, so it is tried again if publishing fails.
+
+        Returns
+        -------
+        hostnames - the hosts whose bootconfig files were changed.
+        """
+        hostnames = [hostname for hostname in self.hostnames if hostname in pm.hosts]
+        changed = []
+        if hostnames and self.dry_run:
+            logger.info("    -------- dry run, not setting %d installing hosts to local boot: %s",
+                        len(hostnames), " ".join(hostnames))
+            changed = hostnames
+        elif hostnames:
+            logger.debug("    -------- setting %d installing hosts to local boot", len(hostnames))
+            with pm.staged_generation():
+                for hostname in hostnames:
+                    try:
+                        pm.set_host_local_boot(hostname)
+                    except OSError as e:
+                        logger.warning("    WARNING: could not set host %s to local boot: %s", hostname, e,
+                                       extra={'hostname': hostname})
+                        continue
+                    changed.append(hostname)
+        self.hostnames = []
+        return changed
+
+    def flush_due(self, idle=False):
+        """Flush the batch if its window passed, or if idle is True
+        (there are no events waiting).  If the generation can not be
+        published the error is logged and the batch is kept, to be
+        tried again by the next flush, so the monitors keep running.
+        """
+        if idle or self.due():
+            try:
+                return self.flush()
+            except OSError as e:
+                logger.error("    ERROR: could not set %d installing hosts to local boot, will retry: %s",
+                             len(self.hostnames), e)
+        return []
@@ -9,11 +9,14 @@ Contents
 Functions used for forced reboot and autoinstall of
 hosts being managed.
 """
-import re
-import subprocess
+import logging
+from contextlib import nullcontext
 import pxemanage as pm
 
 
+logger = logging.getLogger(__name__)
+
+
 def configure_hosts_for_reinstall(hostnames):
     """Given a list of host names, configure all of the managed hosts
     to perform a autoinstall reinstall on reboot.
@@ -34,92 +37,77 @@ def configure_hosts_for_reinstall(hostnames):
     set to perform an install after this function finishes.
 
     """
-    print("======== Configure Hosts to auto (re)install on next boot ========")
+    logger.info("======== Configure Hosts to auto (re)install on next boot ========")
     valid_hostnames = []
-    for hostname in hostnames:
-
-        # check that the hostname is under cluster management
-        if hostname not in pm.hosts:
-            print(f"    -------- Warning: host {hostname} was not found in the current set")
-            print("    -------- of managed hosts, it will be ignored for the rest of this script")
-            print("")
-        else:
-            # host is under management, configure it for a reinstall on boot
-            valid_hostnames.append(hostname)
-            pm.set_host_install_boot(hostname)
-    print("")
+    with pm.staged_generation():
+        for hostname in hostnames:
+
+            # check that the hostname is under cluster management
+            if hostname not in pm.hosts:
+                logger.warning("    -------- Warning: host %s was not found in the current set "
+                               "of managed hosts, it will be ignored for the rest of this script", hostname)
+            else:
+                # host is under management, configure it for a reinstall on boot
+                valid_hostnames.append(hostname)
+                pm.set_host_install_boot(hostname)
     
     # return list of valid hosts that are managed and we can proceed with
     return valid_hostnames
 
 
-def reboot_hosts(hostnames):
-    """Given a list of host names, attempt to perform ssh reboot of each host.
-    We assume the list of hosts has already been validated before being
-    passed into this function.
+def reboot_hosts(hostnames, backend=None, watchdog=None, lock=None):
+    """Given a list of host names, attempt to restart each host so it
+    performs its network install.  We assume the list of hosts has
+    already been validated before being passed into this function.
 
-    We attempt to ssh in and perform reboot command using the configured
-    username.  If we fail, we display warning but continue with the 
-    machine, assuming that the operator will be performing a hand
-    reboot or start of the machine.
+    By default we ssh in and perform a reboot command using the
+    configured username, see the power submodule for the other power
+    control backends.  If we fail, we display warning but continue with
+    the machine, assuming that the operator will be performing a hand
+    reboot or start of the machine, or that the watchdog retries it.
 
     Parameters
     ----------
     hostnames - A list of hosts to be rebooted.  The list should all be hosts
       that are currently being managed, e.g. we expect this list to be
       validated before calling this function.
-
+    backend - the power control backend, by default the power_backend
+      setting.
+    watchdog - if given, an InstallWatchdog that starts a deadline for
+      each host to begin installing.
+    lock - if given, the lock held while the status of each rebooted
+      host is changed and the watchdog is told, but not while the host
+      is power cycled, e.g. the lock of the pxemanaged daemon.
     """
-    print("======== Reboot host to perform autoinstall  ========")
+    logger.info("======== Reboot host to perform autoinstall  ========")
+    if backend is None:
+        backend = pm.get_power_backend()
 
     for hostname in hostnames:
         host = pm.hosts[hostname]
-
-        # attempt ssh reboot of the host, send it a reboot command
-        # not using password here currently, so this assumes ssh key access is working
-        key = pm.settings['identity']
-        args = pm.settings['ssh_args']
-        username = pm.settings['username']
-        password = pm.settings['password']
-
-        # we first detect if machine has working ssh communication with
-        # the identity we are using
-        command = f"ssh -i {key} {args} {username}@{host.ipaddress} 'sudo hostname'"
-        try:
-            output = subprocess.run(command, shell=True, check=True, capture_output=True)
-            connected = True
-        except subprocess.CalledProcessError as e:
-            connected = False
-            
-        # if we were able to successfully connect, attempt the actual reboot
-        # it is normal for this command to fail with a 255 returncode because we
-        # will loose the connection
-        if connected:
-            command = f"ssh -i {key} {args} {username}@{host.ipaddress} 'sudo reboot'"
-            rebooted = False
-            try:
-                print(f"    -------- running command <{command}>")
-                output = subprocess.run(command, shell=True, check=True, capture_output=True)
-            except subprocess.CalledProcessError as e:
-                # it is normal to get return error code 255 on reboot because the
-                # ssh connection gets interrupted
-                if e.returncode == 255:
-                    rebooted = True
+        rebooted = backend.power_cycle(host)
 
         # report what happened
         if rebooted:
-            print(f"    -------- Successfully rebooted {hostname}")
-            host.status = pm.status.REBOOTING
+            logger.info("    -------- Successfully rebooted %s", hostname,
+                        extra={'hostname': hostname, 'event': "rebooted"})
+        elif watchdog:
+            logger.warning("    -------- Warning: host %s could not be successfully rebooted, "
+                           "it will be power cycled again after %.0f seconds", hostname, watchdog.timeout)
         else:
-            if not connected:
-                print(f"    -------- Error, could not connect to {hostname}, is identity correct?")
-            print(f"    -------- Warning: host {hostname} could not be successfully rebooted")
-            print("    -------- you will need to restart or reboot by hand to proceed with install")
-            
-    print("")
+            logger.warning("    -------- Warning: host %s could not be successfully rebooted, "
+                           "you will need to restart or reboot by hand to proceed with install", hostname)
 
+        # hosts that failed to reboot are watched too, the watchdog
+        # retries them when their deadline passes
+        with lock or nullcontext():
+            if rebooted or watchdog:
+                host.status = pm.status.REBOOTING
+            if watchdog:
+                watchdog.watch(hostname, backend=backend)
 
-def monitor_host_reinstalls():
+
+def monitor_host_reinstalls(systemevent=None, watchdog=None, dry_run=False):
     """Begin monitoring system events (syslog) for tftp request
     events of initrd files.  These indicate that a pxeboot
     auto(re)install is beginning on a machine.  When we detect
@@ -127,34 +115,53 @@ def monitor_host_reinstalls():
     to a local hard drive boot, so that after machine finishes
     reinstallation and it automatically reboots, it will reboot
     into its newly installed hard drive configuration.
+
+    Parameters
+    ----------
+    systemevent - an iterator of system event lines to monitor.  By
+      default we follow the configured event source, e.g. the system
+      events file (syslog) replaying any events missed since the last
+      checkpoint, see the eventsources submodule.
+    watchdog - if given, an InstallWatchdog whose deadlines are checked
+      while we wait, hosts it gives up on end the monitoring for them.
+    dry_run - if True the bootconfig files of the installing hosts are
+      left as they are, e.g. when replaying a historical log.
     """
-    print("======== Monotor Syslog for Host Reinstallation Progress ========")
-    systemevent = pm.follow_system_events_file()
-    
+    logger.info("======== Monotor Syslog for Host Reinstallation Progress ========")
+    if systemevent is None:
+        # wake up regularly to check the watchdog deadlines and to set
+        # the installing hosts to a local boot once events pause
+        systemevent = pm.system_events(idle=True)
+
     # iterate over the lines
-    print("    -------- async monitor system events starting")
-    print("")
-    print("    use ctrl-c to end host reinstallations monitoring")
-    print("")
-    while not all_hosts_installed():
-        # get next system event
-        line = next(systemevent)
-
-        # determine if registerd host install has begun
-        ip_pattern = "\d+\.\d+\.\d+\.\d+"
-        pattern = re.compile(f"^.*RRQ\s+from\s+({ip_pattern})\s+filename\s+initrd.*$")
-        match = pattern.match(line)
-
-        # if an initrd file was requested, the host is doing an autoinstall
-        if match:
-            ipaddress = match.group(1)
-            print("")
-            #print(f"    detected autoinstall in progress from ipaddress: <{ipaddress}>")
-            pm.install_host(ipaddress)
-        
-    print("    -------- finished host reinstallations, all hosts appear to have started reinstall")
-    print("    -------- You may stop the services we use for management once all files have downloaded to the hosts")
-    print("")
+    logger.info("    -------- async monitor system events starting")
+    logger.info("    use ctrl-c to end host reinstallations monitoring")
+    batch = pm.LocalBootBatch(dry_run=dry_run)
+    try:
+        while not all_hosts_installed():
+            # get next system event, stop if a replayed log is exhausted
+            line = next(systemevent, None)
+            if line is None:
+                break
+            if watchdog:
+                watchdog.retry(watchdog.check())
+
+            # determine if registerd host install has begun
+            event = pm.parse_system_event(line)
+
+            # if an initrd file was requested, the host is doing an
+            # autoinstall, the hosts that began installing are set back
+            # to a local boot together
+            if event and event.kind == "initrd":
+                pm.install_host(event.ipaddress, batch)
+            batch.flush_due(idle=not line)
+    finally:
+        batch.flush()
+
+    if watchdog:
+        watchdog.report()
+    logger.info("    -------- finished host reinstallations, all hosts appear to have started reinstall or failed")
+    logger.info("    -------- You may stop the services we use for management once all files have downloaded to the hosts")
     # TODO: whoops a timing bug/issue here.  When we detect last host has started
     # install, it still may be some time before it has finished getting files from
     # tftp, and especially from http.  For now we leave services running.
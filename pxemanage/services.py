@@ -10,40 +10,252 @@ Functions relating to stopping, starting, restarting and
 managing system services are found here.  We need to
 control dhcpd, tftpd and apache2 (or other web) services
 to manage the pxeboot
+
+The ServiceController acts on all of the services at once, each in
+its own thread.  It remembers a hash of the configuration files of
+each service (the service_config_files setting) as of when it was last
+started, and when asked to start a service that is already active
+with unchanged configuration it does nothing, if the configuration
+changed it reloads the services that support it
+(reloadable_services) and restarts the others.
+
+Restart requests are coalesced: the first request for a service
+starts a timer of service_restart_window seconds, further requests
+within the window are folded into it, so registering 30 hosts in
+quick succession restarts dhcpd once instead of 30 times.  Pending
+restarts are carried out at exit, or at once with flush.
 """
+import atexit
+import hashlib
+import logging
+import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import yaml
 from pxemanage import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+def run_systemctl(*args):
+    """Run a systemctl command, with sudo unless it only queries a
+    service.
+
+    Returns
+    -------
+    returncode - the exit status of systemctl.
+    """
+    command = ["systemctl"] + list(args)
+    if args[0] != "is-active":
+        command = ["sudo"] + command
+    return subprocess.run(command, capture_output=True).returncode
+
+
+class ServiceController:
+    """Start, stop and restart the pxeboot services concurrently and
+    only when needed.
+    """
+    def __init__(self, run=run_systemctl, window=None):
+        """Define class constructor for the service controller.
+
+        Parameters
+        ----------
+        run - function running a systemctl command given its arguments,
+          returning its exit status.
+        window - seconds restart requests are collected before acting,
+          by default the service_restart_window setting.
+        """
+        self.run = run
+        self.window = settings['service_restart_window'] if window is None else window
+        self.lock = threading.Lock()
+        # the restart timer of each service with a restart pending
+        self.pending = {}
+        # number of restart requests folded into each pending restart
+        self.requests = {}
+
+    def config_hash(self, service_name):
+        """Return a hash of the configuration files (and the files in
+        configuration directories) of a service.
+        """
+        digest = hashlib.sha256()
+        for path in settings['service_config_files'].get(service_name, []):
+            if os.path.isdir(path):
+                filenames = sorted(os.path.join(dirpath, name)
+                                   for dirpath, dirnames, names in os.walk(path) for name in names)
+            else:
+                filenames = [path]
+            for filename in filenames:
+                digest.update(filename.encode() + b"\0")
+                try:
+                    with open(filename, mode="rb") as file:
+                        digest.update(file.read())
+                except OSError:
+                    digest.update(b"missing")
+        return digest.hexdigest()
+
+    def _load_state(self):
+        """Return the configuration hash of each service as of when it
+        was last started.
+        """
+        try:
+            with open(settings['service_state_file']) as file:
+                return yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, state):
+        """Save the configuration hashes of the services."""
+        state_file = settings['service_state_file']
+        os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+        new_state_file = f"{state_file}.{os.getpid()}.tmp"
+        with open(new_state_file, mode="w") as file:
+            yaml.safe_dump(state, file)
+        os.replace(new_state_file, state_file)
+
+    def _update_state(self, hashes):
+        """Record new configuration hashes (None forgets a service)."""
+        with self.lock:
+            state = self._load_state()
+            for service_name, config_hash in hashes.items():
+                if config_hash is None:
+                    state.pop(service_name, None)
+                else:
+                    state[service_name] = config_hash
+            self._save_state(state)
+
+    def ensure_running(self, service_name, force=False):
+        """Make sure a service runs with its current configuration.
+
+        Parameters
+        ----------
+        service_name - the systemd service.
+        force - if True the service is restarted even if its
+          configuration is unchanged.
+
+        Returns
+        -------
+        action - 'unchanged', 'reload', 'restart', or 'failed' if
+          systemctl failed.
+        """
+        config_hash = self.config_hash(service_name)
+        active = self.run("is-active", "--quiet", service_name) == 0
+        if active and not force and self._load_state().get(service_name) == config_hash:
+            logger.debug("    -------- service %s is active and unchanged", service_name)
+            return "unchanged"
+        action = "reload" if active and not force and service_name in settings['reloadable_services'] else "restart"
+        logger.info("    -------- %s service %s", "reloading" if action == "reload" else "restarting", service_name)
+        if self.run(action, service_name) != 0:
+            logger.error("    -------- Error, could not %s service %s", action, service_name)
+            return "failed"
+        self._update_state({service_name: config_hash})
+        return action
+
+    def stop(self, service_name):
+        """Stop a service, it is restarted when next started."""
+        logger.info("    -------- stopping service %s", service_name)
+        self.cancel(service_name)
+        if self.run("stop", service_name) != 0:
+            logger.error("    -------- Error, could not stop service %s", service_name)
+            return False
+        self._update_state({service_name: None})
+        return True
+
+    def start_all(self, service_names, force=False):
+        """Make sure all of the services run, acting on them
+        concurrently.
+
+        Returns
+        -------
+        actions - a dictionary of service name to the action taken, see
+          ensure_running.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(service_names))) as executor:
+            actions = executor.map(lambda service_name: self.ensure_running(service_name, force), service_names)
+            return dict(zip(service_names, actions))
+
+    def stop_all(self, service_names):
+        """Stop all of the services concurrently."""
+        with ThreadPoolExecutor(max_workers=max(1, len(service_names))) as executor:
+            return dict(zip(service_names, executor.map(self.stop, service_names)))
+
+    def request_restart(self, service_name):
+        """Ask for a service to be restarted (or reloaded) once its
+        configuration changed.  Requests within the restart window are
+        carried out together once the window passes.
+        """
+        with self.lock:
+            self.requests[service_name] = self.requests.get(service_name, 0) + 1
+            if service_name in self.pending:
+                return
+            if self.window <= 0:
+                timer = None
+            else:
+                timer = threading.Timer(self.window, self._restart_pending, (service_name,))
+                timer.daemon = True
+                self.pending[service_name] = timer
+        if timer is None:
+            self._restart_pending(service_name, pending=False)
+        else:
+            timer.start()
+
+    def _restart_pending(self, service_name, pending=True):
+        """Carry out the restart requests of a service."""
+        with self.lock:
+            if pending and self.pending.pop(service_name, None) is None:
+                # already carried out by flush
+                return
+            requests = self.requests.pop(service_name, 0)
+        if requests > 1:
+            logger.info("    -------- %d restart requests of service %s coalesced", requests, service_name)
+        self.ensure_running(service_name)
+
+    def cancel(self, service_name):
+        """Drop a pending restart of a service."""
+        with self.lock:
+            timer = self.pending.pop(service_name, None)
+            self.requests.pop(service_name, None)
+        if timer:
+            timer.cancel()
+
+    def flush(self):
+        """Carry out all pending restarts now."""
+        with self.lock:
+            timers = self.pending
+            self.pending = {}
+        for service_name, timer in timers.items():
+            timer.cancel()
+            self._restart_pending(service_name, pending=False)
+
+
+# the service controller shared by the functions below
+service_controller = ServiceController()
+atexit.register(lambda: service_controller.flush())
+
+
 def restart_services():
     """(re)Start the services needed for cluster host registration.
     We usually need dhcpd, tftpd and apache2 services running.
     On the ansible management machine it is not normal to have these
-    running continuously, only when we are registering or 
+    running continuously, only when we are registering or
     reinstalling hosts.
 
-    We restart in case somehow they are already running, to
-    ensure that their config files are reloaded.
+    Services that are already running are only reloaded or restarted
+    if their configuration files changed since they were started.
 
     NOTE: we use sudo root escalation here, so this requires
     that this script be run as root or as an sudo enabled user.
     """
-    print("======== Start registration services ========")
-    for service_name in settings['service_list']:
-        print(f"    -------- starting service {service_name}")
-        command = f"sudo systemctl restart {service_name}"
-        subprocess.run(command, shell=True)
-    print("")
+    logger.info("======== Start registration services ========")
+    service_controller.start_all(settings['service_list'])
 
 
 def restart_dhcpd_service():
-    """Retart the dhcpd service.  Ensure it is running on this machine.
+    """Retart the dhcpd service, so it serves the current registration.
+    Restarts asked for within the service_restart_window are done once.
     """
-    print("======== Restart dhcpd service ========")
-    print(f"    -------- restarting service {settings['dhcpd_service_name']}")
-    command = f"sudo systemctl restart {settings['dhcpd_service_name']}"
-    subprocess.run(command, shell=True)
-    print("")
+    service_controller.request_restart(settings['dhcpd_service_name'])
 
 
 def stop_services():
@@ -55,9 +267,5 @@ def stop_services():
     NOTE: we use sudo root escalation here, so this requires
     that this script be run as root or as an sudo enabled user.
     """
-    print("======== Stop registration services ========")
-    for service_name in settings['service_list']:
-        print(f"    -------- stopping service {service_name}")
-        command = f"sudo systemctl stop {service_name}"
-        subprocess.run(command, shell=True)
-    print("")
+    logger.info("======== Stop registration services ========")
+    service_controller.stop_all(settings['service_list'])
@@ -0,0 +1,200 @@
+"""pxemanage module
+
+snapshot submodule
+
+Contents
+--------
+
+A compact binary snapshot of the registry for fast read only queries,
+e.g. which ip address does cloud17 have.  Loading the registry parses
+dhcpd.conf and all of its shards, the snapshot instead holds the
+registered fields of every host, and indexes of them by mac address,
+ip address and profile, in a marshal file that loads in a fraction of
+the time.
+
+The snapshot is keyed by the mtime, size and sha256 hash of the
+registration file and of each shard it includes.  A query first stats
+these files, when one was changed (its content hash differs, a file
+that was only touched keeps the snapshot) the snapshot is rebuilt
+transparently under the registry lock before answering.
+
+"""
+import fnmatch
+import hashlib
+import logging
+import marshal
+import os
+import re
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+# increased whenever the layout of the snapshot changes, snapshots of
+# another format are rebuilt
+snapshot_format = 1
+
+mac_term_pattern = re.compile(r"^(?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$")
+ip_term_pattern = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+
+
+def _file_digest(filename):
+    """Return the sha256 hash of the content of a file."""
+    with open(filename, mode="rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def build_registry_snapshot():
+    """Parse the registration file and write a new snapshot of it.
+
+    Returns
+    -------
+    snapshot - the snapshot dictionary, see load_registry_snapshot.
+    """
+    with pm.registry_lock():
+        sources = []
+        parsed_hosts, version = pm.parse_host_registration(pm.settings['registration_file'], sources)
+        sources = [(filename, info.st_mtime_ns, info.st_size, _file_digest(filename))
+                   for filename, info in sources]
+
+    profiles = {}
+    for hostname, host in parsed_hosts.items():
+        profiles.setdefault(host.profile, []).append(hostname)
+    snapshot = {
+        'format': snapshot_format,
+        'sources': sources,
+        'version': version,
+        'hosts': {hostname: (host.macaddress, host.ipaddress, host.profile)
+                  for hostname, host in parsed_hosts.items()},
+        'macaddresses': {host.macaddress.lower(): hostname for hostname, host in parsed_hosts.items()
+                         if host.macaddress != "unknown"},
+        'ipaddresses': {host.ipaddress: hostname for hostname, host in parsed_hosts.items()
+                        if host.ipaddress != "unknown"},
+        'profiles': profiles,
+    }
+    save_registry_snapshot(snapshot)
+    return snapshot
+
+
+def save_registry_snapshot(snapshot):
+    """Write a snapshot to the registry_snapshot_file.  It is written
+    to a temporary file and renamed into place, so readers never see
+    a partial snapshot.  A snapshot that can not be written is only
+    used by this process.
+    """
+    snapshot_file = pm.settings['registry_snapshot_file']
+    new_snapshot_file = f"{snapshot_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(snapshot_file) or ".", exist_ok=True)
+        with open(new_snapshot_file, mode="wb") as file:
+            marshal.dump(snapshot, file)
+        os.replace(new_snapshot_file, snapshot_file)
+    except OSError as e:
+        logger.warning("    WARNING: could not save registry snapshot %s: %s", snapshot_file, e)
+
+
+def _snapshot_sources_current(snapshot):
+    """Determine if the registration files a snapshot was built from
+    are unchanged.  Files whose mtime changed but whose content did
+    not get their new mtime recorded in the snapshot.
+
+    Returns
+    -------
+    (current, touched) - True if the snapshot is current, and True if
+      the recorded mtimes of the snapshot were updated.
+    """
+    sources = snapshot['sources']
+    if not sources or sources[0][0] != pm.settings['registration_file']:
+        return False, False
+    touched = False
+    for index, (filename, mtime, size, digest) in enumerate(sources):
+        try:
+            info = os.stat(filename)
+        except FileNotFoundError:
+            return False, False
+        if info.st_mtime_ns == mtime and info.st_size == size:
+            continue
+        if info.st_size != size or _file_digest(filename) != digest:
+            return False, False
+        sources[index] = (filename, info.st_mtime_ns, info.st_size, digest)
+        touched = True
+    return True, touched
+
+
+def load_registry_snapshot():
+    """Load the registry snapshot, rebuilding it first if it is missing
+    or the registration changed since it was built.
+
+    Returns
+    -------
+    snapshot - a dictionary with the registry 'version', the 'hosts'
+      as a dictionary of hostname to (macaddress, ipaddress, profile),
+      the hostname of each lower case mac address in 'macaddresses'
+      and ip address in 'ipaddresses', and the hostnames of each
+      profile in 'profiles'.
+    """
+    try:
+        with open(pm.settings['registry_snapshot_file'], mode="rb") as file:
+            snapshot = marshal.load(file)
+        if snapshot.get('format') != snapshot_format:
+            return build_registry_snapshot()
+        current, touched = _snapshot_sources_current(snapshot)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, KeyError):
+        return build_registry_snapshot()
+    if not current:
+        return build_registry_snapshot()
+    if touched:
+        save_registry_snapshot(snapshot)
+    return snapshot
+
+
+def query_registry(terms=(), profile=None):
+    """Look up registered hosts in the registry snapshot.
+
+    Parameters
+    ----------
+    terms - hostnames (or hostname globs), mac addresses or ip
+      addresses of the hosts wanted, all hosts if none are given.
+    profile - only hosts with this profile.
+
+    Returns
+    -------
+    records - a list of dictionaries with the hostname, macaddress,
+      ipaddress and profile of each host found.
+    """
+    snapshot = load_registry_snapshot()
+    registered = snapshot['hosts']
+    if terms:
+        hostnames = []
+        seen = set()
+        for term in terms:
+            if mac_term_pattern.match(term):
+                found = [snapshot['macaddresses'].get(term.lower())]
+            elif ip_term_pattern.match(term):
+                found = [snapshot['ipaddresses'].get(term)]
+            elif any(character in term for character in "*?["):
+                found = fnmatch.filter(registered, term)
+            else:
+                found = [term] if term in registered else []
+            for hostname in found:
+                if hostname and hostname not in seen:
+                    seen.add(hostname)
+                    hostnames.append(hostname)
+    elif profile:
+        hostnames = snapshot['profiles'].get(profile, [])
+    else:
+        hostnames = list(registered)
+
+    records = []
+    for hostname in hostnames:
+        macaddress, ipaddress, host_profile = registered[hostname]
+        if profile and host_profile != profile:
+            continue
+        records.append({
+            'hostname': hostname,
+            'macaddress': macaddress,
+            'ipaddress': ipaddress,
+            'profile': host_profile,
+        })
+    return records
@@ -9,16 +9,23 @@ Contents
 Functions used for unregistering hosts from the
 database of hosts being managed.
 """
-import subprocess
+import logging
 import pxemanage as pm
 
 
-def unregister_hosts(unregister_all, hostnames):
+logger = logging.getLogger(__name__)
+
+
+def unregister_hosts(unregister_all, hostnames, profile=None, name_glob=None,
+                     name_regex=None, ip_range=None, dry_run=False, confirm=True):
     """Unregister the hosts asked for from management in
     this cluster.
 
     If we are asked to unregister all hosts, then the hostnames
-    parameter is ignored.
+    parameter is ignored.  Otherwise the given hostnames are
+    unregistered together with any hosts matching the selection
+    criteria (profile, name glob or regex, ip range), see
+    select_hosts.
 
     We perform the following steps:
 
@@ -28,10 +35,26 @@ def unregister_hosts(unregister_all, hostnames):
     4. remove host kickstarter files from files/html/ks
     5. remove hosts from the hosts management database
     6. update the management configuration flat file (dhcpd.conf)
+
+    Parameters
+    ----------
+    unregister_all - if True every registered host is unregistered.
+    hostnames - a list of names of hosts to unregister.
+    profile, name_glob, name_regex, ip_range - criteria selecting more
+      hosts to unregister, hosts must match all of the criteria given.
+    dry_run - if True only report the hosts and files that would be
+      removed, nothing is changed.
+    confirm - if True ask the operator before unregistering, the daemon
+      passes False as its clients ask instead.
+
+    Returns
+    -------
+    verified_hosts - the list of the names of the hosts that were (or
+      for a dry run would be) unregistered, empty if aborted.
     """
     # 1. verify list of hosts
     if unregister_all:
-        print("---- Asked to unregister all hosts, ignoring any hostnames specified on command line")
+        logger.info("---- Asked to unregister all hosts, ignoring any hostnames specified on command line")
         hostnames = []
         for hostname in pm.hosts:
             hostnames.append(hostname)
@@ -39,46 +62,57 @@ def unregister_hosts(unregister_all, hostnames):
     verified_hosts = []
     for hostname in hostnames:
         if not hostname in pm.hosts:
-            print(f"---- Warning: host {hostname} given in list of hosts to unregister, but it is not a host currently in this cluster")
+            logger.warning("---- Warning: host %s given in list of hosts to unregister, but it is not a host currently in this cluster",
+                           hostname)
         else:
             verified_hosts.append(hostname)
 
+    if not unregister_all:
+        selected_hosts = pm.select_hosts(profile, name_glob, name_regex, ip_range)
+        verified_set = set(verified_hosts)
+        verified_hosts.extend(hostname for hostname in selected_hosts if hostname not in verified_set)
+
     if len(verified_hosts) == 0:
-        print("---- No valid hosts were specified to unregister")
-        return
+        logger.warning("---- No valid hosts were specified to unregister")
+        return []
         
-    # 2. warn and verify intent to continue
-    print("---- The following are the list of hosts till will be removed from management:")
-    print("")
-    print("    ")
-    for hostname in verified_hosts:
-        print(f"{hostname} ", end='')
-    print("")
-    print("")
+    # 2. warn and verify intent to continue, the operator we ask is
+    #    always shown the hosts, whatever the log level
+    show = print if confirm else logger.info
+    show("---- The following are the list of hosts till will be removed from management:")
+    show("    " + " ".join(verified_hosts))
     
+    if dry_run:
+        show("---- Dry run, the following files would be removed:")
+        for hostname in verified_hosts:
+            host = pm.hosts[hostname]
+            show(f"    {pm.settings['pxelinux_config_dir']}/{host.macaddress_file()}")
+            show(f"    {pm.settings['pxelinux_config_dir']}/{host.hostname}")
+            show(f"    {pm.settings['ks_config_dir']}/{host.hostname}/")
+        return verified_hosts
+
     yes_answers = ['y', 'Y', 'yes', 'Yes', 'YES']
-    answer = input("Do you wish to unregister these hosts (y/n)? ")
-    if not answer in yes_answers:
-        print("aborting unregistration")
-        return
+    if confirm:
+        answer = input("Do you wish to unregister these hosts (y/n)? ")
+        if not answer in yes_answers:
+            print("aborting unregistration")
+            return []
     
-    # 3. remove host pxeboot configuration files from pxeboot.cfg
-    print("======== Deleteing host pxeboot configuration files ========")
-    print("")
-    for hostname in verified_hosts:
-        pm.delete_bootconfig_file(hostname)
-        
-    # 4. remove host kickstart files from ks directory
-    print("======== Deleteing host kickstarter configuration files ========")
-    print("")
-    for hostname in verified_hosts:
-        pm.delete_kickstart_file(hostname)
+    # 3. and 4. are published together as one generation
+    with pm.staged_generation():
+        # 3. remove host pxeboot configuration files from pxeboot.cfg
+        logger.info("======== Deleteing host pxeboot configuration files ========")
+        pm.delete_bootconfig_files(verified_hosts)
+
+        # 4. remove host kickstart files from ks directory
+        logger.info("======== Deleteing host kickstarter configuration files ========")
+        pm.delete_kickstart_files(verified_hosts)
     
     # 5. remove hosts from the management database
-    print("======== Removing host registrations from Registration Database ========")
-    print("")
+    logger.info("======== Removing host registrations from Registration Database ========")
     for hostname in verified_hosts:
         del pm.hosts[hostname]
     
     # 6. update management configuration flat file
-    pm.update_host_registration() 
+    pm.update_host_registration()
+    return verified_hosts
@@ -0,0 +1,183 @@
+"""pxemanage module
+
+watchdog submodule
+
+Contents
+--------
+
+A deadline scheduler that makes sure hosts we rebooted for an install
+actually begin installing.  Each host we expect to make a status
+transition (e.g. leave REBOOTING once its install starts) gets a
+deadline, kept in a heap ordered by deadline, so checking the
+deadlines costs O(log n) per expired host no matter how many hosts
+are being reinstalled.
+
+When a deadline passes and the host is still in the status it was
+expected to leave, the host is restarted again through the power
+control backend and given a new deadline.  check finds these hosts
+and retry power cycles them, so the daemon can check the deadlines
+under its lock and power cycle the hosts on a thread without it.  After max_attempts power
+cycles the watchdog gives up on the host, marks it FAILED and reports
+it, so a large reinstall campaign finishes without an operator
+watching every host.
+
+"""
+import heapq
+import logging
+import time
+from contextlib import nullcontext
+import pxemanage as pm
+
+
+logger = logging.getLogger(__name__)
+
+
+class InstallWatchdog:
+    """Deadlines of the hosts expected to make a status transition."""
+    def __init__(self, backend, timeout=900.0, max_attempts=3, clock=time.monotonic):
+        """Define class constructor for the install watchdog.
+
+        Parameters
+        ----------
+        backend - the power control backend used to retry hosts.
+        timeout - seconds a host is given to make its transition.
+        max_attempts - the most times a host is power cycled, including
+          the first reboot, before giving up on it.
+        clock - function returning the current time in seconds.
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.clock = clock
+        # heap of (deadline, sequence, hostname) entries, entries whose
+        # deadline is not the current deadline of the host are stale
+        self._heap = []
+        self._sequence = 0
+        # the current deadline, expected status and attempts of each host
+        self.deadlines = {}
+        self.expected = {}
+        self.attempts = {}
+        self.backends = {}
+        self.failed = []
+
+    def watch(self, hostname, status=None, attempts=1, backend=None):
+        """Start the deadline of a host that was just restarted.
+
+        Parameters
+        ----------
+        hostname - the host to watch.
+        status - the status the host should leave before the deadline,
+          by default REBOOTING.
+        attempts - the power cycles already made for this host.
+        backend - the power control backend used to retry this host, by
+          default the backend of the watchdog.
+        """
+        status = status or pm.status.REBOOTING
+        deadline = self.clock() + self.timeout
+        self.deadlines[hostname] = deadline
+        self.expected[hostname] = status
+        self.attempts[hostname] = attempts
+        self.backends[hostname] = backend or self.backend
+        self._sequence += 1
+        heapq.heappush(self._heap, (deadline, self._sequence, hostname))
+
+    def forget(self, hostname):
+        """Stop watching a host."""
+        self.deadlines.pop(hostname, None)
+        self.expected.pop(hostname, None)
+
+    def next_deadline(self):
+        """Return the seconds until the next deadline, or None if no
+        host is being watched.
+        """
+        while self._heap and self.deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
+
+    def check(self):
+        """Handle every deadline that has passed.  Hosts that made
+        their transition are forgotten, the others are given up on or
+        returned to be power cycled again by retry.
+
+        Returns
+        -------
+        due - the names of the hosts due to be power cycled again.
+        """
+        due = []
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, hostname = heapq.heappop(self._heap)
+            if self.deadlines.get(hostname) != deadline:
+                # stale entry, the host was forgotten or watched again
+                continue
+            status = self.expected[hostname]
+            self.forget(hostname)
+            host = pm.hosts.get(hostname)
+            if host is None or host.status != status:
+                continue
+
+            attempts = self.attempts[hostname]
+            if attempts >= self.max_attempts:
+                logger.error("    -------- Error: host %s still %s after %d attempts, giving up",
+                             hostname, status.name, attempts, extra={'hostname': hostname, 'event': "failed"})
+                host.status = pm.status.FAILED
+                self.failed.append(hostname)
+                continue
+
+            # the host waits for retry without a deadline
+            self.expected[hostname] = status
+            due.append(hostname)
+        return due
+
+    def retry(self, hostnames, lock=None):
+        """Power cycle the hosts returned by check again and start their
+        new deadlines.
+
+        Parameters
+        ----------
+        hostnames - the hosts due to be power cycled again.
+        lock - if given, the lock held while the status of a host is
+          checked and its deadline started, but not while the host is
+          power cycled, e.g. the lock of the pxemanaged daemon.
+
+        Returns
+        -------
+        retried - the names of the hosts that were power cycled again.
+        """
+        retried = []
+        for hostname in hostnames:
+            with lock or nullcontext():
+                # the host may have made its transition, or be watched
+                # again, since check
+                status = self.expected.get(hostname)
+                host = pm.hosts.get(hostname)
+                if status is None or hostname in self.deadlines or host is None or host.status != status:
+                    self.expected.pop(hostname, None)
+                    continue
+                attempts = self.attempts[hostname]
+                backend = self.backends[hostname]
+
+            logger.warning("    -------- Warning: host %s still %s after %.0fs, power cycling with %s (attempt %d of %d)",
+                           hostname, status.name, self.timeout, backend.name, attempts + 1, self.max_attempts)
+            backend.power_cycle(host)
+            with lock or nullcontext():
+                self.watch(hostname, status, attempts + 1, backend)
+            retried.append(hostname)
+        return retried
+
+    def report(self):
+        """Print how many attempts each watched host needed, and the
+        hosts that were given up on.
+        """
+        logger.info("======== Install watchdog report ========")
+        if logger.isEnabledFor(logging.DEBUG):
+            for hostname in sorted(self.attempts):
+                host = pm.hosts.get(hostname)
+                outcome = host.status.name if host else "unregistered"
+                logger.debug("    -------- host %s attempts %d status %s", hostname, self.attempts[hostname], outcome)
+        retried = sum(1 for attempts in self.attempts.values() if attempts > 1)
+        logger.info("    -------- %d hosts watched, %d power cycled again", len(self.attempts), retried)
+        if self.failed:
+            logger.error("    -------- %d hosts FAILED, power cycle them by hand: %s", len(self.failed), " ".join(self.failed))
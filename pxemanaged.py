@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+"""This script runs the pxemanaged management daemon.  The daemon
+loads the host registration once, starts the services we use for
+pxeboot management, and follows the system events (syslog) for as
+long as it runs.  The register-hosts, reinstall-hosts and
+unregister-hosts scripts send their requests to the daemon over its
+control socket when it is running, instead of each managing the
+services and the registry themselves.
+
+This script needs to modify root configuration files and
+start and stop root services, it uses sudo privilage
+escalation where needed.  The user it is run as
+needs to have sudo privileges on the host to successfully
+run this script.
+"""
+import argparse
+import signal
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    AutoRegistration, \
+    InstallWatchdog, \
+    ManagementDaemon, \
+    ReadinessProber, \
+    add_logging_arguments, \
+    build_discovery_filter, \
+    get_power_backend, \
+    load_host_registration, \
+    parse_profile_rule, \
+    power_backends, \
+    replay_system_events_file, \
+    restart_services, \
+    settings, \
+    setup_script_logging, \
+    stop_services
+
+
+usage_msg = """Run the pxemanage management daemon.  The daemon keeps
+the registry of managed hosts in memory, follows the system events
+to detect new and installing hosts, and answers requests from the
+pxemanage scripts on its control socket.
+
+With --auto new hosts are registered by the daemon without an
+operator, named from the given pattern (e.g. 'cloud{n:02d}') and
+assigned static ips from --ip-pool.  Otherwise new hosts are kept as
+discoveries until register-hosts registers them.
+"""
+
+
+def end_daemon_handler(signum, frame):
+    """This function is registered as a signal handler for interupt
+    (SIGINT ctrl-c) and terminate (SIGTERM) signals.  We end the
+    event loop, which stops serving requests.
+
+    Parameters
+    ----------
+    signum - the signal number of the generated interupt.
+    frame - current stack frame, not used here.
+    """
+    raise KeyboardInterrupt
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='pxemanaged', description=usage_msg)
+    parser.add_argument('--replay', metavar='FILE', type=str,
+                        help='follow the events of a historical system events (syslog) file instead, '
+                        'and exit once they are processed')
+    parser.add_argument('--stop-services', action='store_true',
+                        help='stop the pxeboot services when the daemon exits')
+    parser.add_argument('--auto', metavar='NAME_PATTERN', type=str,
+                        help="automatically register new hosts, naming them with this pattern, e.g. 'cloud{n:02d}'")
+    parser.add_argument('--first-number', type=int, default=1,
+                        help='first host number tried for the name pattern (default 1)')
+    parser.add_argument('--ip-pool', metavar='FIRST-LAST', type=str,
+                        help='range of static ip addresses to assign automatically registered hosts')
+    parser.add_argument('--profile', type=str, default='default',
+                        help='installation profile for automatically registered hosts (default default)')
+    parser.add_argument('--profile-rule', metavar='MACPREFIX=PROFILE', type=parse_profile_rule,
+                        action='append', default=[],
+                        help='give hosts whose mac address starts with MACPREFIX this profile, may be repeated')
+    parser.add_argument('--max-hosts', type=int,
+                        help='maximum number of hosts to automatically register')
+    parser.add_argument('--batch-window', metavar='SECONDS', type=float, default=10.0,
+                        help='hosts discovered within this many seconds are registered together (default 10)')
+    parser.add_argument('--ignore', metavar='MACADDRESS', action='append', default=[],
+                        help='never register the host with this mac address, may be repeated')
+    parser.add_argument('--deny-prefix', metavar='MACPREFIX', action='append', default=[],
+                        help="never register hosts whose mac address starts with MACPREFIX (e.g. a BMC OUI '00:25:90'), "
+                        'may be repeated')
+    parser.add_argument('--power', choices=sorted(power_backends), default=settings['power_backend'],
+                        help=f"power control used to retry hosts that do not install (default {settings['power_backend']})")
+    parser.add_argument('--install-timeout', metavar='SECONDS', type=float, default=settings['install_timeout'],
+                        help='power cycle hosts again that have not begun installing after this many seconds, '
+                        f"0 to wait forever (default {settings['install_timeout']})")
+    parser.add_argument('--max-attempts', type=int, default=settings['install_attempts'],
+                        help=f"give up on a host after this many power cycles (default {settings['install_attempts']})")
+    parser.add_argument('--ready-timeout', metavar='SECONDS', type=float, default=settings['ready_timeout'],
+                        help='probe installed hosts until their ssh server answers for up to this many seconds, '
+                        f"0 to not probe (default {settings['ready_timeout']})")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+    if args.auto and not args.ip_pool:
+        parser.error("--auto requires an --ip-pool to assign addresses from")
+
+    # 1. read in and determine database of currently registered hosts,
+    #    it is kept in memory for as long as the daemon runs
+    load_host_registration()
+    autoregistration = None
+    if args.auto:
+        autoregistration = AutoRegistration(args.auto, args.ip_pool,
+                                            profile=args.profile,
+                                            profile_rules=args.profile_rule,
+                                            first_number=args.first_number,
+                                            max_hosts=args.max_hosts,
+                                            batch_window=args.batch_window)
+    watchdog = None
+    if args.install_timeout > 0:
+        watchdog = InstallWatchdog(get_power_backend(args.power), args.install_timeout, args.max_attempts)
+    prober = None
+    if args.ready_timeout > 0:
+        prober = ReadinessProber(port=settings['ready_port'], timeout=args.ready_timeout,
+                                 concurrency=settings['ready_concurrency'],
+                                 max_backoff=settings['ready_max_backoff'])
+    discovery_filter = build_discovery_filter(args.ignore, args.deny_prefix)
+    daemon = ManagementDaemon(autoregistration, watchdog, prober, discovery_filter)
+
+    # 2. start the services once, requests only restart dhcpd when the
+    #    registration changes
+    if not args.replay:
+        restart_services()
+
+    # 3. serve requests and follow the system events until stopped
+    signal.signal(signal.SIGINT, end_daemon_handler)
+    signal.signal(signal.SIGTERM, end_daemon_handler)
+    try:
+        if args.replay:
+            daemon.run(replay_system_events_file(args.replay))
+        else:
+            daemon.run()
+    except KeyboardInterrupt:
+        print("    -------- pxemanaged stopping")
+
+    if args.stop_services and not args.replay:
+        stop_services()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that answers read only queries
+about the registered hosts, e.g. which ip address does cloud17 have,
+from the registry snapshot.  The registration (dhcpd.conf) is only
+parsed when it changed since the snapshot was built, so the script
+is cheap enough to call from other scripts and tools.
+"""
+import argparse
+import json
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    query_registry, \
+    setup_script_logging
+
+
+usage_msg = """Look up registered hosts by hostname (or hostname glob),
+mac address or ip address, or list the hosts of a profile.  Each host
+found is printed on a line with its hostname, mac address, ip address
+and profile separated by tabs.  The exit status is 1 when no host is
+found.
+"""
+
+fields = ['hostname', 'macaddress', 'ipaddress', 'profile']
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='query-hosts', description=usage_msg)
+    parser.add_argument('terms', metavar='HOST', type=str, nargs='*',
+                        help='hostname, hostname glob, mac address or ip address of the hosts, all hosts if none')
+    parser.add_argument('--profile', type=str,
+                        help='only hosts with this profile')
+    parser.add_argument('-f', '--field', choices=fields,
+                        help='only print this field of each host, e.g. ipaddress')
+    parser.add_argument('--json', action='store_true',
+                        help='print the hosts found as a json list')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. look up the hosts in the registry snapshot
+    records = query_registry(args.terms, args.profile)
+
+    # 2. print the hosts found
+    if args.json:
+        print(json.dumps(records, indent=2))
+    else:
+        for record in records:
+            if args.field:
+                print(record[args.field])
+            else:
+                print("\t".join(record[field] for field in fields))
+    sys.exit(0 if records else 1)
+
+
+if __name__ == "__main__":
+    main()
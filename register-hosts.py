@@ -14,11 +14,23 @@ run this script.
 import argparse
 import signal
 import sys
+import time
 # load pxemanage routines into local namespace
 from pxemanage import \
+    AutoRegistration, \
+    DaemonError, \
+    add_logging_arguments, \
+    build_discovery_filter, \
+    call_daemon, \
+    daemon_running, \
     load_host_registration, \
     monitor_host_registrations, \
+    parse_profile_rule, \
+    register_leased_hosts, \
+    replay_system_events_file, \
+    report_registered_hosts, \
     restart_services, \
+    setup_script_logging, \
     stop_services, \
     hosts, \
     status
@@ -30,8 +42,22 @@ assign a host name and a static ip address for the bare
 metal OS node configuration.  We manage hosts using
 pxelinux netboot to autoinstall and reinstall nodes
 when needed.
+
+With --auto new hosts are registered without prompting, named from
+the given pattern (e.g. 'cloud{n:02d}') and assigned static ips from
+--ip-pool.  Hosts discovered within --batch-window seconds of each
+other are registered together with a single dhcpd restart.
+
+When the pxemanaged daemon is running, new hosts discovered by the
+daemon are registered through it instead, and no services are started
+or stopped by this script.
 """
 
+# the rules used when automatically registering hosts, None if
+# hosts are registered interactively
+autoregistration = None
+
+
 def end_registration_handler(signum, frame):
     """This function is registered as a signal handler for an interupt
     (SIGINT ctrl-c) signal.  We notify the main loop that the user
@@ -45,6 +71,10 @@ def end_registration_handler(signum, frame):
 
     """
     print("    -------- user has ended host registration")
+    # register any automatically registered hosts still waiting in a batch
+    if autoregistration:
+        autoregistration.flush()
+
     # check if any machine still in dhcp offer state
     for hostname in hosts:
         host_status = hosts[hostname].status
@@ -61,40 +91,128 @@ def end_registration_handler(signum, frame):
                 return
 
     # stop the registration
-    print("======== Registration Finished ========")
-    print("The full list of registered hosts")
-    for hostname in hosts:
-        print(hosts[hostname])
+    report_registered_hosts("Registration Finished")
 
     # stop the services
     stop_services()
     sys.exit(0)
 
 
+def register_daemon_discoveries(poll_interval=1.0):
+    """Ask the operator about each new host the pxemanaged daemon has
+    discovered, and register the hosts they accept through the
+    daemon.  Runs until the user ends registration with ctrl-c.
+
+    Parameters
+    ----------
+    poll_interval - seconds between asking the daemon for discoveries.
+    """
+    print("======== Register hosts discovered by pxemanaged ========")
+    print("    use ctrl-c to end host registration")
+    print("")
+    yes_responses = ['y', 'Y', 'yes', 'Yes', 'YES']
+    declined = set()
+    try:
+        while True:
+            for discovery in call_daemon('discoveries'):
+                macaddress = discovery['macaddress']
+                if macaddress in declined:
+                    continue
+                answer = input(f"    new host detected macaddress {macaddress} should we register this host (y/n): ")
+                if answer not in yes_responses:
+                    declined.add(macaddress)
+                    call_daemon('decline', macaddress=macaddress)
+                    continue
+                hostname = input("    enter hostname: ")
+                suggestion = call_daemon('next_ipaddress')
+                ipaddress = input(f"    enter static ip for host [{suggestion}]: ") or suggestion
+                profile = input("    enter host installation profile: ")
+                print("")
+                try:
+                    call_daemon('register', hosts=[{'hostname': hostname, 'macaddress': macaddress,
+                                                    'ipaddress': ipaddress, 'profile': profile}])
+                    print(f"    -------- registered host {hostname}")
+                except DaemonError as e:
+                    print(f"    WARNING: host not registered, {e}")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("    -------- user has ended host registration")
+
+
 def main():
     """Script main function.
-
-    TODO: add command line parsing for sequence auto registers,
-      logging output verbosity, what else?
     """
+    global autoregistration
+
     # 0. parse command line arguments.
-    # TODO: could/should add options to auto register, e.g.
-    # give base hostname (cloud-1-%02d) and
-    # base ip address (192.168.0.%d) and auto name and number
-    # hosts as their dhcp offers come in
     parser = argparse.ArgumentParser(prog='register-hosts', description=usage_msg)
-    #parser.add_argument('autoregister', type=bool, nargs='+',
-    #                    help='')
+    parser.add_argument('--replay', metavar='FILE', type=str,
+                        help='process the events in a historical system events (syslog) file offline and exit')
+    parser.add_argument('--auto', metavar='NAME_PATTERN', type=str,
+                        help="automatically register new hosts, naming them with this pattern, e.g. 'cloud{n:02d}'")
+    parser.add_argument('--first-number', type=int, default=1,
+                        help='first host number tried for the name pattern (default 1)')
+    parser.add_argument('--ip-pool', metavar='FIRST-LAST', type=str,
+                        help='range of static ip addresses to assign automatically registered hosts')
+    parser.add_argument('--profile', type=str, default='default',
+                        help='installation profile for automatically registered hosts (default default)')
+    parser.add_argument('--profile-rule', metavar='MACPREFIX=PROFILE', type=parse_profile_rule,
+                        action='append', default=[],
+                        help='give hosts whose mac address starts with MACPREFIX this profile, may be repeated')
+    parser.add_argument('--max-hosts', type=int,
+                        help='maximum number of hosts to automatically register')
+    parser.add_argument('--batch-window', metavar='SECONDS', type=float, default=10.0,
+                        help='hosts discovered within this many seconds are registered together (default 10)')
+    parser.add_argument('--ignore', metavar='MACADDRESS', action='append', default=[],
+                        help='never register the host with this mac address, may be repeated')
+    parser.add_argument('--deny-prefix', metavar='MACPREFIX', action='append', default=[],
+                        help="never register hosts whose mac address starts with MACPREFIX (e.g. a BMC OUI '00:25:90'), "
+                        'may be repeated')
+    parser.add_argument('--from-leases', action='store_true',
+                        help='with --auto, first register the unregistered hosts found in the dhcpd lease journal')
+    add_logging_arguments(parser)
     args = parser.parse_args()
-    
+    setup_script_logging(args)
+    if args.auto and not args.ip_pool:
+        parser.error("--auto requires an --ip-pool to assign addresses from")
+    if args.from_leases and not args.auto:
+        parser.error("--from-leases requires --auto rules to name the hosts")
+
+    # the daemon holds the registry and follows the system events when
+    # it is running, we only act as its client
+    if not args.replay and daemon_running():
+        if args.auto or args.ignore or args.deny_prefix:
+            parser.error("pxemanaged is running, give the --auto, --ignore and --deny-prefix options to pxemanaged instead")
+        register_daemon_discoveries()
+        return
+
     # 1. read in and determine database of currently registered hosts
     load_host_registration()
+    if args.auto:
+        autoregistration = AutoRegistration(args.auto, args.ip_pool,
+                                            profile=args.profile,
+                                            profile_rules=args.profile_rule,
+                                            first_number=args.first_number,
+                                            max_hosts=args.max_hosts,
+                                            batch_window=args.batch_window)
+    discovery_filter = build_discovery_filter(args.ignore, args.deny_prefix)
+
+    # when replaying a historical log we only process its events, the
+    # services are left as they are
+    if args.replay:
+        monitor_host_registrations(replay_system_events_file(args.replay), autoregistration, discovery_filter)
+        return
 
     # 2. ensure dhcpd and tftpd servers are up and running,
     #    normal state is to have them turned off unless we are
     #    registering or reinstalling machines
     restart_services()
 
+    # hosts that booted before we were running are only known from the
+    # dhcpd lease journal
+    if args.from_leases:
+        register_leased_hosts(autoregistration, discovery_filter)
+
     # 3. begin monitoring syslog for DHCPDISCOVER events, which may
     #    indicate a new network book of a machine we want to register
     #    for this cluster
@@ -102,7 +220,7 @@ def main():
     #    Setup asynchronous signal to let user cleanly notify when
     #    registration should end
     signal.signal(signal.SIGINT, end_registration_handler)
-    monitor_host_registrations()
+    monitor_host_registrations(autoregistration=autoregistration, discovery_filter=discovery_filter)
 
     
 if __name__ == "__main__":
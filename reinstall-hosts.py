@@ -19,13 +19,27 @@ run this script.
 import argparse
 import signal
 import sys
+import time
 # load pxemanage routines into local namespace
 from pxemanage import \
+    InstallWatchdog, \
+    ReadinessProber, \
+    add_logging_arguments, \
+    call_daemon, \
+    daemon_running, \
+    get_power_backend, \
     load_host_registration, \
+    power_backends, \
+    preflight_reinstall, \
+    settings, \
     configure_hosts_for_reinstall, \
     reboot_hosts, \
     monitor_host_reinstalls, \
+    replay_system_events_file, \
+    report_registered_hosts, \
     restart_services, \
+    setup_script_logging, \
+    start_prewarm, \
     stop_services, \
     hosts, \
     status
@@ -73,16 +87,45 @@ def end_reinstall_handler(signum, frame):
                 return
 
     # stop the installation monitoring
-    print("======== Reinstallation Finished ========")
-    print("The full list of registered hosts")
-    for hostname in hosts:
-        print(hosts[hostname])
+    report_registered_hosts("Reinstallation Finished")
 
     # stop the pexmanagement services
     stop_services()
     sys.exit(0)
 
 
+def reinstall_daemon_hosts(hostnames, power=None, poll_interval=2.0):
+    """Ask the pxemanaged daemon to reinstall the given hosts, then
+    report their progress until all of them have begun installing.
+    The daemon sets the hosts back to local boot, so ending this
+    script early with ctrl-c is safe.
+
+    Parameters
+    ----------
+    hostnames - the hosts to reboot and reinstall.
+    power - the power control backend the daemon reboots hosts with.
+    poll_interval - seconds between asking the daemon for host status.
+    """
+    print("======== Reinstall hosts through pxemanaged ========")
+    hosts = call_daemon('reinstall', hostnames=hostnames, power=power)
+    hostnames = [host['hostname'] for host in hosts]
+    last_status = {}
+    try:
+        while hostnames:
+            for host in call_daemon('query', hostnames=hostnames):
+                if last_status.get(host['hostname']) != host['status']:
+                    print(f"    -------- host {host['hostname']} status {host['status']}")
+                    last_status[host['hostname']] = host['status']
+            if 'REBOOTING' not in last_status.values():
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("    -------- user has ended host reinstallation monitoring, pxemanaged continues monitoring")
+        return
+    print("    -------- finished host reinstallations, all hosts appear to have started reinstall")
+    print("")
+
+
 def main():
     """Script main function.
     """
@@ -91,10 +134,75 @@ def main():
     parser = argparse.ArgumentParser(prog='reinstall-hosts', description=usage_msg)
     parser.add_argument('hostname', type=str, nargs='+',
                         help='one or more hosts to attempt to reboot and reinstall')
+    parser.add_argument('--replay', metavar='FILE', type=str,
+                        help='process the events in a historical system events (syslog) file offline for hosts '
+                        'that were already rebooted for reinstall, then exit')
+    parser.add_argument('--power', choices=sorted(power_backends), default=settings['power_backend'],
+                        help=f"power control used to reboot hosts (default {settings['power_backend']})")
+    # the watchdog and readiness options are those of pxemanaged when
+    # it is running, they may only be given without the daemon
+    parser.add_argument('--install-timeout', metavar='SECONDS', type=float,
+                        help='power cycle hosts again that have not begun installing after this many seconds, '
+                        f"0 to wait forever (default {settings['install_timeout']}, "
+                        'pxemanaged uses its own when running)')
+    parser.add_argument('--max-attempts', type=int,
+                        help=f"give up on a host after this many power cycles (default {settings['install_attempts']}, "
+                        'pxemanaged uses its own when running)')
+    parser.add_argument('--ready-timeout', metavar='SECONDS', type=float,
+                        help='after their install started, wait until the hosts ssh server answers for up to this '
+                        f"many seconds, 0 to not wait (default {settings['ready_timeout']}, "
+                        'pxemanaged uses its own when running)')
+    parser.add_argument('--prewarm', action='store_true',
+                        help='load the installer iso, kernel and initrd into the page cache in the background, '
+                        'so the first hosts to boot do not wait for disk reads')
+    parser.add_argument('--preflight', action='store_true',
+                        help='check the (cached) facts of the hosts first, hosts without a large enough disk or '
+                        'enough memory are not reinstalled')
+    add_logging_arguments(parser)
     args = parser.parse_args()
+    setup_script_logging(args)
+    hostnames = args.hostname
+
+    # hosts that fail the preflight checks of their hardware facts are
+    # left out before anything is changed
+    if args.preflight and not args.replay:
+        load_host_registration()
+        hostnames = preflight_reinstall(hostnames)
+        if not hostnames:
+            sys.exit(1)
+
+    # the daemon holds the registry and follows the system events when
+    # it is running, we only act as its client
+    if not args.replay and daemon_running():
+        if args.install_timeout is not None or args.max_attempts is not None or args.ready_timeout is not None:
+            parser.error("pxemanaged is running and reinstalls the hosts with its own --install-timeout, "
+                         "--max-attempts and --ready-timeout, give them to pxemanaged instead")
+        prewarm = start_prewarm() if args.prewarm else None
+        reinstall_daemon_hosts(hostnames, args.power)
+        # the prewarm thread ends with this script, let it finish its
+        # reads and report the page cache residency
+        if prewarm:
+            prewarm.join()
+        return
     
     # 1. read in and determine database of currently registered hosts
     load_host_registration()
+    if args.install_timeout is None:
+        args.install_timeout = settings['install_timeout']
+    if args.max_attempts is None:
+        args.max_attempts = settings['install_attempts']
+    if args.ready_timeout is None:
+        args.ready_timeout = settings['ready_timeout']
+
+    # when replaying a historical log the hosts were already rebooted,
+    # we only look for their install events, the services and the hosts
+    # bootconfig are left as they are
+    if args.replay:
+        for hostname in args.hostname:
+            if hostname in hosts:
+                hosts[hostname].status = status.REBOOTING
+        monitor_host_reinstalls(replay_system_events_file(args.replay), dry_run=True)
+        return
 
     # 2. ensure dhcpd and tftpd servers are up and running,
     #    normal state is to have them turned off unless we are
@@ -104,18 +212,36 @@ def main():
     # 3. set all hosts to perform reinstall on network boot
     #    this method also validates the hostnames and only returns
     #    valid managed hosts to attempt further actions with
-    hostnames = configure_hosts_for_reinstall(args.hostname)
+    hostnames = configure_hosts_for_reinstall(hostnames)
+    if args.prewarm:
+        start_prewarm()
 
     # 4. attempt to reboot all hosts to start the reinstallation
-    #    process
-    reboot_hosts(hostnames)
+    #    process, the watchdog power cycles hosts again that do not
+    #    begin installing in time
+    backend = get_power_backend(args.power)
+    started = time.monotonic()
+    watchdog = None
+    if args.install_timeout > 0:
+        watchdog = InstallWatchdog(backend, args.install_timeout, args.max_attempts)
+    reboot_hosts(hostnames, backend, watchdog)
     
     # 5. monitor the system events to attempt to detect when
     #    hosts have begun their installation.  We end when
-    #    all hosts reach installing/running status, or when
-    #    user performs sigint
+    #    all hosts reach installing/running status, hosts the
+    #    watchdog gave up on have failed, or when user performs sigint
     signal.signal(signal.SIGINT, end_reinstall_handler)
-    monitor_host_reinstalls()
+    monitor_host_reinstalls(watchdog=watchdog)
+
+    # 6. wait until the installed hosts are up and running, which
+    #    gives the full reinstall time of every host
+    installing = [hostname for hostname in hostnames if hosts[hostname].status == status.INSTALLING]
+    if args.ready_timeout > 0 and installing:
+        prober = ReadinessProber(port=settings['ready_port'], timeout=args.ready_timeout,
+                                 concurrency=settings['ready_concurrency'],
+                                 max_backoff=settings['ready_max_backoff'])
+        prober.wait_for_hosts(installing, started)
+        prober.report()
 
     
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that is used to roll back
+the served pxeboot configuration and kickstarter files to an
+older generation, for example after a bad template change was
+published to the hosts.  The generations are published by the
+other scripts whenever they change these files.
+
+Note that the registration database (dhcpd.conf) is not rolled
+back, only the files served to booting hosts.
+"""
+import argparse
+import sys
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    current_generation, \
+    list_generations, \
+    rollback_generation, \
+    setup_script_logging
+
+
+usage_msg = """Publish an older generation of the pxeboot configuration
+(pxelinux.cfg) and kickstarter (ks) files.  By default the generation
+before the current one is published again.
+"""
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments
+    parser = argparse.ArgumentParser(prog='rollback-generation', description=usage_msg)
+    parser.add_argument('generation', type=int, nargs='?',
+                        help='the generation number to publish, defaults to the previous generation')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='only list the generations that are kept')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. list the generations
+    current = current_generation()
+    if args.list:
+        for generation in list_generations():
+            marker = "*" if generation == current else " "
+            print(f"{marker} {generation}")
+        return
+
+    # 2. publish the older generation
+    generation = rollback_generation(args.generation)
+    if generation is None:
+        print("---- No older generation is available to roll back to")
+        sys.exit(1)
+    print(f"---- Published generation {generation}, previously generation {current}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that rebuilds the generated
+artifacts (pxelinux.cfg bootconfig files, ks kickstart files and the
+dhcpd.conf registration) that are stale, because a template, a host
+or a setting they were built from has changed since they were built.
+
+This script needs to modify root configuration files and
+start and stop root services, it uses sudo privilage
+escalation where needed.  The user it is run as
+needs to have sudo privileges on the host to successfully
+run this script.
+"""
+import argparse
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    load_host_registration, \
+    setup_script_logging, \
+    sync_artifacts, \
+    watch_artifacts
+
+
+usage_msg = """Rebuild the generated artifacts of the registered hosts
+that are stale.  The build manifest records the hashes of the templates
+and inputs each artifact was built from, only artifacts whose hashes
+changed are rebuilt.  Hosts keep their current boot default (install
+or local) when their bootconfig file is rebuilt.
+
+With --watch the templates are watched after the first sync, and the
+stale artifacts are rebuilt as soon as a template is saved.
+"""
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='sync-artifacts', description=usage_msg)
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only list the stale artifacts and why they are stale')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep watching the templates and rebuild stale artifacts when they change')
+    parser.add_argument('--interval', metavar='SECONDS', type=float, default=0.1,
+                        help='seconds between checks of the templates when watching (default 0.1)')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. read in and determine database of currently registered hosts
+    load_host_registration()
+
+    # 2. rebuild the stale artifacts, once or whenever templates change
+    if args.watch and not args.dry_run:
+        try:
+            watch_artifacts(args.interval)
+        except KeyboardInterrupt:
+            print("    -------- stopped watching templates")
+    else:
+        sync_artifacts(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import pytest
+import pxemanage as pm
+
+
+class Clock:
+    """A clock for the time dependent classes that only moves when a
+    test sets its now.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Give a test a Clock starting at 0."""
+    return Clock()
+
+
+@pytest.fixture
+def registry():
+    """Give a test an empty hosts database, restoring the hosts
+    registered by other test modules afterwards.
+    """
+    saved_hosts = dict(pm.hosts)
+    saved_version = pm.db.registry_version
+    pm.hosts.clear()
+    pm.db.registry_version = None
+    yield pm.hosts
+    pm.hosts.clear()
+    pm.hosts.update(saved_hosts)
+    pm.db.registry_version = saved_version
+
+
+@pytest.fixture(autouse=True)
+def state_files(tmp_path, monkeypatch):
+    """Keep the build manifest, registry lock, facts cache and ansible
+    inventory of each test in its own directory.
+    """
+    monkeypatch.setitem(pm.settings, 'build_manifest_file', str(tmp_path / "manifest.json"))
+    monkeypatch.setitem(pm.settings, 'registry_lock_file', str(tmp_path / "registry.lock"))
+    monkeypatch.setitem(pm.settings, 'facts_cache_file', str(tmp_path / "facts.json"))
+    monkeypatch.setitem(pm.settings, 'inventory_dir', str(tmp_path / "inventory"))
+    monkeypatch.setitem(pm.settings, 'inventory_state_file', str(tmp_path / "inventory.yml"))
+    pm.discard_build_manifest()
+    yield
+    pm.discard_build_manifest()
@@ -0,0 +1,49 @@
+import pxemanage as pm
+
+
+def test_parse_ip_range():
+    first, last = pm.parse_ip_range('192.168.0.100-192.168.0.199')
+    assert str(first) == '192.168.0.100'
+    assert str(last) == '192.168.0.199'
+    first, last = pm.parse_ip_range('192.168.0.7')
+    assert first == last
+
+
+def test_discover_assigns_names_addresses_and_profiles(registry):
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:66', '192.168.0.100', 'compute')
+    rules = [('18:03:73', 'manager')]
+    autoregistration = pm.AutoRegistration('cloud{n:02d}', '192.168.0.100-192.168.0.102',
+                                           profile='compute', profile_rules=rules,
+                                           max_hosts=3)
+
+    # already registered hosts are ignored
+    assert autoregistration.discover('11:22:33:44:55:66') is None
+
+    host = autoregistration.discover('18:03:73:c5:91:89')
+    assert (host.hostname, host.ipaddress, host.profile) == ('cloud02', '192.168.0.101', 'manager')
+    assert host.status == pm.status.DHCPOFFER
+
+    # repeated discovers of a host waiting in the batch are ignored
+    assert autoregistration.discover('18:03:73:c5:91:89') is None
+
+    host = autoregistration.discover('66:55:44:33:22:11')
+    assert (host.hostname, host.ipaddress, host.profile) == ('cloud03', '192.168.0.102', 'compute')
+
+    # the ip address pool is now exhausted
+    assert autoregistration.discover('66:55:44:33:22:12') is None
+    assert len(autoregistration.pending) == 2
+
+
+def test_flush_registers_batch_once(registry, monkeypatch):
+    batches = []
+    monkeypatch.setattr(pm, 'register_host_batch', batches.append)
+    autoregistration = pm.AutoRegistration('cloud{n:02d}', '192.168.0.100-192.168.0.199',
+                                           max_hosts=2, batch_window=0)
+    autoregistration.discover('11:22:33:44:55:66')
+    autoregistration.discover('66:55:44:33:22:11')
+    assert autoregistration.discover('18:03:73:c5:91:89') is None
+    autoregistration.flush_due()
+
+    assert len(batches) == 1
+    assert [host.hostname for host in batches[0]] == ['cloud01', 'cloud02']
+    assert autoregistration.pending == []
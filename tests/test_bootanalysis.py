@@ -0,0 +1,86 @@
+import gzip
+import os
+import time
+import pxemanage as pm
+
+
+def boot_lines(day, macaddress, ipaddress, hostname, offsets):
+    """Log lines of one pxe boot, the milestones are logged the given
+    seconds after 10:00:00 of the day in May.
+    """
+    def stamp(seconds):
+        return f"May {day:2d} 10:{seconds // 60:02d}:{seconds % 60:02d}"
+    discover, ack, pxelinux, initrd, kickstart = offsets
+    return [
+        f"{stamp(discover)} kluge dhcpd[100]: DHCPDISCOVER from {macaddress} via eno1\n",
+        f"{stamp(discover)} kluge systemd[1]: Started something unrelated.\n",
+        f"{stamp(ack)} kluge dhcpd[100]: DHCPACK on {ipaddress} to {macaddress} via eno1\n",
+        f"{stamp(pxelinux)} kluge in.tftpd[200]: RRQ from {ipaddress} filename pxelinux.0\n",
+        f"{stamp(initrd)} kluge in.tftpd[201]: RRQ from {ipaddress} filename initrd\n",
+        # the installer asks for its own address, that is the same boot
+        f"{stamp(initrd + 5)} kluge dhcpd[100]: DHCPDISCOVER from {macaddress} via eno1\n",
+        f"{stamp(kickstart)} kluge apache2: {ipaddress} - - [{day:02d}/May/2026:10:{kickstart // 60:02d}:"
+        f"{kickstart % 60:02d} +0000] \"GET /ks/{hostname}/user-data HTTP/1.1\" 200 512\n",
+    ]
+
+
+def test_parse_system_event():
+    event = pm.parse_system_event("May 16 10:00:02 kluge dhcpd[100]: DHCPACK on 192.168.0.101 "
+                                  "to 11:22:33:44:55:66 (cloud01) via eno1\n")
+    assert event == pm.SystemEvent("ack", "11:22:33:44:55:66", "192.168.0.101", None)
+    event = pm.parse_system_event("May 16 10:00:09 kluge in.tftpd[201]: RRQ from 192.168.0.1 filename initrd\n")
+    assert event.kind == "initrd" and event.ipaddress == "192.168.0.1"
+    assert pm.parse_system_event("May 16 10:00:09 kluge cron[5]: nothing to see\n") is None
+
+
+def test_boot_event_files(tmp_path):
+    syslog = tmp_path / "syslog"
+    for name in ["syslog", "syslog.1", "syslog.2.gz", "syslog.10.gz", "syslog.bak"]:
+        (tmp_path / name).write_text("")
+    assert pm.boot_event_files(str(syslog)) == [
+        str(tmp_path / "syslog.10.gz"), str(tmp_path / "syslog.2.gz"),
+        str(tmp_path / "syslog.1"), str(syslog)]
+
+
+def test_analyze_boots_across_rotated_files(tmp_path, registry):
+    pm.hosts['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:66", "192.168.0.101", "compute")
+
+    # an older boot in a compressed archive, and a later boot of the same
+    # host and of an unregistered host in the current file
+    archive = tmp_path / "syslog.2.gz"
+    with gzip.open(archive, "wt") as file:
+        file.writelines(boot_lines(14, "11:22:33:44:55:66", "192.168.0.101", "cloud01", (0, 1, 3, 10, 70)))
+    syslog = tmp_path / "syslog"
+    syslog.write_text("".join(
+        boot_lines(16, "11:22:33:44:55:66", "192.168.0.101", "cloud01", (0, 2, 4, 20, 100))
+        + boot_lines(16, "aa:bb:cc:dd:ee:ff", "192.168.0.150", "cloud02", (30, 31, 32, 40, 90))))
+    modified = time.mktime((2026, 5, 20, 0, 0, 0, 0, 0, -1))
+    for filename in (archive, syslog):
+        os.utime(filename, (modified, modified))
+
+    boots = pm.analyze_boots([str(archive), str(syslog)], processes=2)
+    assert [(boot.name, boot.profile) for boot in boots] == [
+        ("cloud01", "compute"), ("cloud01", "compute"), ("aa:bb:cc:dd:ee:ff", "unregistered")]
+    assert boots[0].phase_durations() == {
+        ("discover", "ack"): 1, ("ack", "pxelinux"): 2, ("pxelinux", "initrd"): 7,
+        ("initrd", "kickstart"): 60, ("discover", "kickstart"): 70}
+
+    statistics = pm.boot_phase_statistics(boots)
+    assert statistics['all'][("discover", "kickstart")] == [60, 70, 100]
+    assert statistics['compute'][("discover", "kickstart")] == [70, 100]
+    assert pm.percentile(statistics['all'][("discover", "kickstart")], 50) == 70
+    assert pm.percentile(statistics['all'][("discover", "kickstart")], 99) == 100
+
+
+def test_pxe_retry_begins_a_new_boot(registry):
+    events = [
+        (0.0, "discover", "11:22:33:44:55:66", None),
+        (1.0, "ack", "11:22:33:44:55:66", "192.168.0.101"),
+        (2.0, "pxelinux", None, "192.168.0.101"),
+        # booted no further, the host pxe boots again
+        (60.0, "discover", "11:22:33:44:55:66", None),
+        (61.0, "ack", "11:22:33:44:55:66", "192.168.0.101"),
+    ]
+    boots = pm.correlate_boots(events)
+    assert [boot.started for boot in boots] == [0.0, 60.0]
+    assert boots[1].milestones == {"discover": 60.0, "ack": 61.0}
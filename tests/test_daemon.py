@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+import pxemanage as pm
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch, registry):
+    monkeypatch.setitem(pm.settings, 'control_socket', str(tmp_path / "pxemanaged.sock"))
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:01', '192.168.0.101', 'compute')
+    registry['cloud02'] = pm.Host('cloud02', '11:22:33:44:55:02', '192.168.0.102', 'manager')
+    daemon = pm.ManagementDaemon()
+    daemon.start_server()
+    yield daemon
+    daemon.stop_server()
+
+
+def test_status_and_query(daemon):
+    assert pm.daemon_running()
+    status = pm.call_daemon('status', timeout=5)
+    assert status['hosts'] == 2 and status['status'] == {'RUNNING': 2}
+    hosts = pm.call_daemon('query', timeout=5, profile='compute')
+    assert hosts == [{'hostname': 'cloud01', 'macaddress': '11:22:33:44:55:01',
+                      'ipaddress': '192.168.0.101', 'profile': 'compute', 'status': 'RUNNING'}]
+    assert len(pm.call_daemon('query', timeout=5)) == 2
+
+
+def test_discoveries_from_system_events(daemon):
+    daemon.handle_event("dhcpd[42]: DHCPDISCOVER from 11:22:33:44:55:01 via eth0")
+    daemon.handle_event("dhcpd[42]: DHCPDISCOVER from aa:bb:cc:dd:ee:ff via eth0")
+    discoveries = pm.call_daemon('discoveries', timeout=5)
+    assert [discovery['macaddress'] for discovery in discoveries] == ['aa:bb:cc:dd:ee:ff']
+
+
+def test_errors_are_returned(daemon):
+    with pytest.raises(pm.DaemonError, match="unknown method"):
+        pm.call_daemon('format_disks', timeout=5)
+    with pytest.raises(pm.DaemonError):
+        pm.call_daemon('register', timeout=5, hosts=[{'hostname': 'cloud01', 'macaddress': 'bad'}])
+
+
+def test_not_running(tmp_path, monkeypatch):
+    monkeypatch.setitem(pm.settings, 'control_socket', str(tmp_path / "missing.sock"))
+    assert not pm.daemon_running()
+
+
+def test_reinstall_reboots_outside_the_lock(daemon, monkeypatch):
+    monkeypatch.setattr(pm, 'configure_hosts_for_reinstall', lambda hostnames: hostnames)
+    release = threading.Event()
+    backend = pm.MockPower(on_power_cycle=lambda host: release.wait(5))
+    monkeypatch.setattr(pm, 'get_power_backend', lambda name=None: backend)
+
+    hosts = pm.call_daemon('reinstall', timeout=5, hostnames=['cloud01', 'cloud02'])
+    assert [host['status'] for host in hosts] == ['REBOOTING', 'REBOOTING']
+
+    # the system events and requests are handled during the reboots
+    daemon.handle_event("dhcpd[42]: DHCPDISCOVER from aa:bb:cc:dd:ee:ff via eth0")
+    assert pm.call_daemon('status', timeout=5)['discovered'] == 1
+    release.set()
+    for _ in range(50):
+        if backend.calls == ['cloud01', 'cloud02']:
+            break
+        time.sleep(0.05)
+    assert backend.calls == ['cloud01', 'cloud02']
+
+
+def test_watchdog_retries_outside_the_lock(daemon, registry, clock):
+    release = threading.Event()
+    backend = pm.MockPower(on_power_cycle=lambda host: release.wait(5))
+    daemon.watchdog = pm.InstallWatchdog(backend, timeout=600, clock=clock)
+    registry['cloud01'].status = pm.status.REBOOTING
+    daemon.watchdog.watch('cloud01')
+    clock.now = 601
+
+    # the host is power cycled again while the lock is free
+    daemon.handle_event("")
+    for _ in range(50):
+        if backend.calls:
+            break
+        time.sleep(0.05)
+    locked = []
+
+    def lock():
+        if daemon.lock.acquire(timeout=1):
+            locked.append(True)
+            daemon.lock.release()
+
+    locker = threading.Thread(target=lock)
+    locker.start()
+    locker.join()
+    assert locked == [True] and not release.is_set()
+    release.set()
+    for _ in range(50):
+        if daemon.watchdog.next_deadline() is not None:
+            break
+        time.sleep(0.05)
+    assert backend.calls == ['cloud01'] and daemon.watchdog.attempts['cloud01'] == 2
+
+
+def test_discoveries_are_bounded(daemon, monkeypatch):
+    daemon.max_discovered = 2
+    for n in range(3):
+        daemon.handle_event(f"dhcpd[42]: DHCPDISCOVER from aa:bb:cc:dd:ee:0{n} via eth0")
+    assert list(daemon.discovered) == ['aa:bb:cc:dd:ee:01', 'aa:bb:cc:dd:ee:02']
+
+    # hosts not seen for the time to live are dropped
+    now = time.time()
+    monkeypatch.setattr(pm.daemon.time, 'time', lambda: now + daemon.discovered_ttl + 1)
+    daemon.discover('aa:bb:cc:dd:ee:03')
+    assert list(daemon.discovered) == ['aa:bb:cc:dd:ee:03']
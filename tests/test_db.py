@@ -1,3 +1,4 @@
+import pytest
 import pxemanage as pm
 
 host = pm.Host('host01', '11:22:33:44:55:66', '192.168.0.1', 'profile')
@@ -48,3 +49,45 @@ def test_lookup_mac():
 def test_lookup_host_by_ip():
     assert pm.lookup_host_by_ipaddress('192.168.0.2') == 'host02'
     assert pm.lookup_host_by_ipaddress('192.168.0.9') is None
+
+
+def test_select_hosts():
+    assert pm.select_hosts(profile='manager') == ['host03']
+    assert pm.select_hosts(name_glob='host0*') == ['host01', 'host02', 'host03']
+    assert pm.select_hosts(name_regex='0[12]$') == ['host01', 'host02']
+    assert pm.select_hosts(ip_range='192.168.0.2-192.168.0.3') == ['host02', 'host03']
+    assert pm.select_hosts(name_glob='host0*', ip_range='192.168.0.1-192.168.0.2',
+                           profile='otherprofile') == ['host02']
+    assert pm.select_hosts() == []
+
+
+def test_host_address_conversions():
+    assert pm.macaddress_to_int('11:22:33:44:55:66') == 0x112233445566
+    assert pm.int_to_macaddress(0x112233445566) == '11:22:33:44:55:66'
+    assert pm.ipaddress_to_int('192.168.0.1') == 0xc0a80001
+    assert pm.int_to_ipaddress(0xc0a80001) == '192.168.0.1'
+    for invalid in ('11:22:33:44:55', 'not a mac address'):
+        with pytest.raises(ValueError):
+            pm.macaddress_to_int(invalid)
+    with pytest.raises(ValueError):
+        pm.ipaddress_to_int('192.168.0.256')
+
+
+def test_host_fields_round_trip():
+    upper = pm.Host('host04', 'AA:BB:CC:DD:EE:0F', '10.0.0.4')
+    assert upper.macaddress == 'aa:bb:cc:dd:ee:0f'
+    assert upper == pm.Host('host04', 'aa:bb:cc:dd:ee:0f', '10.0.0.4')
+    assert upper.macaddress_file() == '01-aa-bb-cc-dd-ee-0f'
+
+    unknown = pm.Host('host05')
+    assert (unknown.macaddress, unknown.ipaddress, unknown.profile) == ('unknown', 'unknown', 'default')
+    unknown.ipaddress = '10.0.0.5'
+    unknown.status = pm.status.DHCPOFFER
+    assert unknown['ipaddress'] == '10.0.0.5' and unknown['status'] == pm.status.DHCPOFFER
+    unknown.ipaddress = 'unknown'
+    assert unknown.ipaddress == 'unknown'
+    with pytest.raises(KeyError):
+        unknown['_ipaddress']
+
+    assert host != pm.Host('host01', '11:22:33:44:55:66', '192.168.0.1', 'profile', pm.status.INSTALLING)
+    assert host != 'host01'
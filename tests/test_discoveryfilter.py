@@ -0,0 +1,40 @@
+import pxemanage as pm
+
+
+def test_verdicts_are_cached(registry, monkeypatch):
+    pm.hosts['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:66", "192.168.0.101")
+    discovery_filter = pm.DiscoveryFilter(ignore=["AA:BB:CC:DD:EE:01"], deny_prefixes=["00:25:90"])
+    assert discovery_filter.verdict("11:22:33:44:55:66") == "registered"
+    assert discovery_filter.verdict("aa:bb:cc:dd:ee:01") == "ignored"
+    assert discovery_filter.verdict("00:25:90:12:34:56") == "denied"
+    assert discovery_filter.admit("18:03:73:c5:91:89")
+
+    # repeated discovers never scan the hosts database again
+    scans = []
+    monkeypatch.setattr(pm, 'is_registered', scans.append)
+    for _ in range(100):
+        assert not discovery_filter.admit("11:22:33:44:55:66")
+        assert discovery_filter.admit("18:03:73:c5:91:89")
+    assert scans == []
+
+
+def test_declined_hosts_expire_and_cache_is_bounded(registry, clock):
+    discovery_filter = pm.DiscoveryFilter(ttl=10.0, declined_ttl=100.0, max_entries=2, clock=clock)
+    discovery_filter.decline("18:03:73:c5:91:89")
+    clock.now = 50.0
+    assert not discovery_filter.admit("18:03:73:c5:91:89")
+    clock.now = 101.0
+    assert discovery_filter.admit("18:03:73:c5:91:89")
+
+    discovery_filter.decline("66:55:44:33:22:11")
+    discovery_filter.decline("66:55:44:33:22:12")
+    # the least recently seen mac address was dropped
+    assert discovery_filter.admit("18:03:73:c5:91:89")
+
+
+def test_monitor_asks_operator_once(registry, monkeypatch):
+    line = "May 16 10:00:01 kluge dhcpd[100]: DHCPDISCOVER from 18:03:73:c5:91:89 via eno1\n"
+    asked = []
+    monkeypatch.setattr(pm, 'register_host', lambda macaddress: asked.append(macaddress))
+    pm.monitor_host_registrations(iter([line] * 50), discovery_filter=pm.DiscoveryFilter())
+    assert asked == ["18:03:73:c5:91:89"]
@@ -0,0 +1,78 @@
+import os
+import pxemanage as pm
+
+
+lines = [
+    "May 16 10:00:01 kluge dhcpd[100]: DHCPDISCOVER from 11:22:33:44:55:66 via eno1\n",
+    "May 16 10:00:05 kluge in.tftpd[200]: RRQ from 192.168.0.1 filename pxelinux.0\n",
+    "May 16 10:00:09 kluge in.tftpd[201]: RRQ from 192.168.0.1 filename initrd\n",
+]
+
+
+def setup_event_files(tmp_path, monkeypatch):
+    syslog = tmp_path / "syslog"
+    syslog.write_text("".join(lines))
+    monkeypatch.setitem(pm.settings, 'system_event_file', str(syslog))
+    monkeypatch.setitem(pm.settings, 'system_event_checkpoint_file',
+                        str(tmp_path / "state" / "syslog.checkpoint"))
+    return syslog
+
+
+def test_replay_system_events_file(tmp_path, monkeypatch):
+    syslog = setup_event_files(tmp_path, monkeypatch)
+    assert list(pm.replay_system_events_file(syslog)) == lines
+
+
+def test_checkpoint_round_trip(tmp_path, monkeypatch):
+    setup_event_files(tmp_path, monkeypatch)
+    assert pm.load_event_checkpoint() is None
+    pm.save_event_checkpoint(42, 1234)
+    assert pm.load_event_checkpoint() == (42, 1234)
+
+
+def test_follow_replays_missed_events(tmp_path, monkeypatch):
+    syslog = setup_event_files(tmp_path, monkeypatch)
+    monkeypatch.setattr(pm.events, 'checkpoint_interval', 1)
+    inode = os.stat(syslog).st_ino
+    pm.save_event_checkpoint(inode, len(lines[0]))
+
+    systemevent = pm.follow_system_events_file()
+    assert next(systemevent) == lines[1]
+    assert next(systemevent) == lines[2]
+
+    # asking for the next line checkpoints the line already handled
+    with open(syslog, "a") as file:
+        file.write(lines[0])
+    assert next(systemevent) == lines[0]
+    assert pm.load_event_checkpoint() == (inode, len(lines[0]) + len(lines[1]) + len(lines[2]))
+
+
+def test_follow_replays_rotated_file_from_start(tmp_path, monkeypatch):
+    syslog = setup_event_files(tmp_path, monkeypatch)
+    inode = os.stat(syslog).st_ino
+    pm.save_event_checkpoint(inode + 1, 10)
+
+    systemevent = pm.follow_system_events_file()
+    assert [next(systemevent) for line in lines] == lines
+
+
+def test_http_boot_events():
+    line = ('May 16 10:00:09 kluge apache2: 192.168.0.101 - - [16/May/2026:10:00:09 +0000] '
+            '"GET /images/ubuntu22/initrd HTTP/1.1" 200 123456\n')
+    assert pm.parse_system_event(line) == pm.SystemEvent("initrd", None, "192.168.0.101", "images/ubuntu22/initrd")
+    # the iso download is not a boot event
+    assert pm.parse_system_event(line.replace("ubuntu22/initrd", "ubuntu22/server.iso")) is None
+
+
+def test_follow_switches_from_rotated_file_ending_in_partial_line(tmp_path, monkeypatch):
+    syslog = setup_event_files(tmp_path, monkeypatch)
+    monkeypatch.setattr(pm.events.time, 'sleep', lambda seconds: None)
+    systemevent = pm.follow_system_events_file(checkpoint=False, idle=True)
+    assert next(systemevent) == ""
+
+    # the old file ends in a line that is never finished
+    with open(syslog, "a") as file:
+        file.write(lines[0].rstrip("\n"))
+    os.rename(syslog, tmp_path / "syslog.1")
+    syslog.write_text(lines[1])
+    assert [line for line in (next(systemevent) for _ in range(4)) if line] == lines[:2]
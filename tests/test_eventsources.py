@@ -0,0 +1,53 @@
+import socket
+import pxemanage as pm
+
+
+def test_parse_rfc3164():
+    # forwarded by rsyslog, with a hostname
+    message = pm.parse_syslog_message(
+        b"<30>May 16 10:00:01 kluge dhcpd[100]: DHCPDISCOVER from 11:22:33:44:55:66 via eno1\n")
+    assert message == pm.SyslogMessage(3, 6, "May 16 10:00:01", "kluge", "dhcpd[100]",
+                                       "DHCPDISCOVER from 11:22:33:44:55:66 via eno1")
+
+    # sent by the syslog() library call, without a hostname
+    message = pm.parse_syslog_message(b"<27>May  6 10:00:05 in.tftpd[200]: RRQ from 192.168.0.1 filename initrd\0")
+    assert message.hostname is None
+    assert message.tag == "in.tftpd[200]"
+    assert pm.syslog_line(message, "kluge") == "May  6 10:00:05 kluge in.tftpd[200]: RRQ from 192.168.0.1 filename initrd\n"
+
+
+def test_parse_rfc5424():
+    message = pm.parse_syslog_message(
+        '<30>1 2024-05-16T10:00:01.5Z kluge dhcpd 100 - [meta x="a\\]b" y="c"] '
+        '\ufeffDHCPDISCOVER from 11:22:33:44:55:66 via eno1'.encode())
+    assert message == pm.SyslogMessage(3, 6, "2024-05-16T10:00:01.5Z", "kluge", "dhcpd[100]",
+                                       "DHCPDISCOVER from 11:22:33:44:55:66 via eno1")
+    line = pm.syslog_line(message)
+    assert pm.parse_system_event(line) == pm.SystemEvent("discover", "11:22:33:44:55:66", None, None)
+    assert pm.parse_event_time(line) == 1715853601.5
+
+
+def test_udp_receiver():
+    source = pm.SyslogEventSource(socket.AF_INET, ("127.0.0.1", 0))
+    events = source.events(idle=True)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b"<30>May 16 10:00:01 dhcpd[100]: DHCPDISCOVER from 11:22:33:44:55:66 via eno1",
+                      source.address)
+        assert next(events) == "May 16 10:00:01 127.0.0.1 dhcpd[100]: DHCPDISCOVER from 11:22:33:44:55:66 via eno1\n"
+    # quiet sources let an idle caller do periodic work
+    assert next(events) == ""
+    events.close()
+    assert source.sock.fileno() < 0
+
+
+def test_unix_receiver(tmp_path, monkeypatch):
+    monkeypatch.setitem(pm.settings, 'syslog_socket', str(tmp_path / "run" / "syslog.sock"))
+    source = pm.get_event_source("unix")
+    events = source.events()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        for filename in ("pxelinux.0", "initrd"):
+            sender.sendto(f"<27>May 16 10:00:05 in.tftpd[200]: RRQ from 192.168.0.1 filename {filename}".encode(),
+                          source.address)
+    assert [pm.parse_system_event(next(events)).kind for n in range(2)] == ["pxelinux", "initrd"]
+    events.close()
+    assert not (tmp_path / "run" / "syslog.sock").exists()
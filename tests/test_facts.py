@@ -0,0 +1,70 @@
+import threading
+import time
+import pxemanage as pm
+
+
+fact_output = """hostname=cloud01
+kernel=5.15.0-76-generic
+cpus=16
+memory_kb=65842316
+os=Ubuntu 22.04.2 LTS
+disk=sda 480103981056
+disk=sdb 16000900661248
+nic=eno1 11:22:33:44:55:01 1000
+nic=eno2 11:22:33:44:55:02 -1
+"""
+
+
+def test_parse_facts():
+    facts = pm.parse_facts(fact_output)
+    assert (facts['hostname'], facts['cpus'], facts['memory_mb']) == ("cloud01", 16, 64299)
+    assert facts['disks'] == [{'name': "sda", 'size_gb': 480}, {'name': "sdb", 'size_gb': 16000}]
+    assert facts['nics'][1] == {'name': "eno2", 'macaddress': "11:22:33:44:55:02", 'speed_mbps': -1}
+
+
+def test_gather_facts_bounded_and_cached(registry, monkeypatch):
+    for n in range(1, 9):
+        registry[f"cloud{n:02d}"] = pm.Host(f"cloud{n:02d}", f"11:22:33:44:55:{n:02d}", f"192.168.0.{100 + n}")
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def run_fact_script(host, timeout):
+        with lock:
+            running.append(host.hostname)
+            most_running.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(host.hostname)
+        if host.hostname == "cloud08":
+            raise RuntimeError("no answer within 5 seconds")
+        return fact_output.replace("cloud01", host.hostname)
+
+    monkeypatch.setattr(pm.facts, 'run_fact_script', run_fact_script)
+    facts, errors = pm.gather_facts(sorted(registry), parallel=3, timeout=5)
+    assert len(facts) == 7 and list(errors) == ["cloud08"]
+    assert max(most_running) <= 3
+    assert facts["cloud03"]['hostname'] == "cloud03"
+
+    # only the host without cached facts is contacted again
+    most_running.clear()
+    facts, errors = pm.gather_facts(sorted(registry), parallel=3, timeout=5)
+    assert len(most_running) == 1 and list(errors) == ["cloud08"]
+    assert pm.cached_facts("cloud01") is not None
+    assert pm.cached_facts("cloud01", ttl=-1) is None
+
+
+def test_preflight_reinstall(registry, monkeypatch):
+    registry['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:01", "192.168.0.101")
+    registry['cloud02'] = pm.Host('cloud02', "11:22:33:44:55:02", "192.168.0.102")
+    registry['cloud03'] = pm.Host('cloud03', "11:22:33:44:55:03", "192.168.0.103")
+
+    def run_fact_script(host, timeout):
+        if host.hostname == "cloud03":
+            raise RuntimeError("Connection refused")
+        if host.hostname == "cloud02":
+            return fact_output.replace("memory_kb=65842316", "memory_kb=1048576")
+        return fact_output
+
+    monkeypatch.setattr(pm.facts, 'run_fact_script', run_fact_script)
+    assert pm.preflight_reinstall(['cloud01', 'cloud02', 'cloud03', 'cloud99']) == ['cloud01', 'cloud03', 'cloud99']
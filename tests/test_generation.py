@@ -0,0 +1,158 @@
+import os
+import threading
+import pytest
+import pxemanage as pm
+
+
+@pytest.fixture
+def trees(tmp_path, monkeypatch):
+    pxelinux_config_dir = tmp_path / "tftp" / "pxelinux.cfg"
+    ks_config_dir = tmp_path / "html" / "ks"
+    pxelinux_config_dir.mkdir(parents=True)
+    (ks_config_dir / "default").mkdir(parents=True)
+    (ks_config_dir / "default" / "meta-data").write_text("instance-id: ubuntu-server\n")
+    monkeypatch.setitem(pm.settings, 'pxelinux_config_dir', str(pxelinux_config_dir))
+    monkeypatch.setitem(pm.settings, 'ks_config_dir', str(ks_config_dir))
+    monkeypatch.setitem(pm.settings, 'generations_kept', 3)
+    return pxelinux_config_dir, ks_config_dir
+
+
+def stage_file(key, name, content):
+    with pm.staged_generation():
+        pm.write_artifact(os.path.join(pm.artifact_dir(key), name), content)
+
+
+def test_first_generation_migrates_trees(trees):
+    pxelinux_config_dir, ks_config_dir = trees
+    stage_file('pxelinux_config_dir', "01-11-22-33-44-55-66", "ONTIMEOUT install\n")
+
+    assert os.path.islink(pxelinux_config_dir) and os.path.islink(ks_config_dir)
+    assert pm.current_generation() == 1
+    assert pm.list_generations() == [0, 1]
+    assert (pxelinux_config_dir / "01-11-22-33-44-55-66").read_text() == "ONTIMEOUT install\n"
+    assert (ks_config_dir / "default" / "meta-data").exists()
+
+
+def test_older_generations_are_unchanged_and_rollback(trees):
+    pxelinux_config_dir, ks_config_dir = trees
+    stage_file('pxelinux_config_dir', "host01", "ONTIMEOUT install\n")
+    stage_file('pxelinux_config_dir', "host01", "ONTIMEOUT local\n")
+    assert (pxelinux_config_dir / "host01").read_text() == "ONTIMEOUT local\n"
+
+    assert pm.rollback_generation() == 1
+    assert (pxelinux_config_dir / "host01").read_text() == "ONTIMEOUT install\n"
+
+
+def test_failed_change_set_is_not_published(trees):
+    pxelinux_config_dir, ks_config_dir = trees
+    stage_file('pxelinux_config_dir', "host01", "ONTIMEOUT install\n")
+    with pytest.raises(RuntimeError):
+        with pm.staged_generation():
+            pm.write_artifact(os.path.join(pm.artifact_dir('pxelinux_config_dir'), "host02"), "")
+            raise RuntimeError("crash part way through")
+
+    assert pm.current_generation() == 1
+    assert pm.list_generations() == [0, 1]
+    assert not (pxelinux_config_dir / "host02").exists()
+
+
+def test_nested_staging_publishes_once_and_prunes(trees):
+    for number in range(5):
+        with pm.staged_generation():
+            stage_file('ks_config_dir', f"host{number}", "")
+            stage_file('pxelinux_config_dir', f"host{number}", "")
+    assert pm.current_generation() == 5
+    assert pm.list_generations() == [3, 4, 5]
+
+
+def test_threads_stage_their_own_generations(trees):
+    pxelinux_config_dir, ks_config_dir = trees
+    staged = threading.Event()
+    failed = threading.Event()
+
+    def failing_change_set():
+        with pytest.raises(RuntimeError):
+            with pm.staged_generation():
+                stage_file('pxelinux_config_dir', "host02", "")
+                staged.set()
+                failed.wait(5)
+                raise RuntimeError("crash part way through")
+
+    # the other thread waits for our change set, its failure never
+    # discards our staged files
+    with pm.staged_generation():
+        thread = threading.Thread(target=failing_change_set)
+        thread.start()
+        assert not staged.wait(0.2)
+        pm.generation_map(lambda name: stage_file('pxelinux_config_dir', name, ""), ["host01", "host03"])
+        failed.set()
+    thread.join()
+    assert sorted(os.listdir(pxelinux_config_dir)) == ["host01", "host03"]
+    assert pm.current_generation() == 1
+
+
+def test_installing_hosts_are_set_local_boot_together(trees, registry, clock, monkeypatch):
+    changed = []
+    monkeypatch.setattr(pm, 'set_host_local_boot', changed.append)
+    registry['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:01", "192.168.0.101")
+    registry['cloud02'] = pm.Host('cloud02', "11:22:33:44:55:02", "192.168.0.102")
+    batch = pm.LocalBootBatch(window=2.0, clock=clock)
+    assert pm.install_host("192.168.0.101", batch) == 'cloud01'
+    assert pm.install_host("192.168.0.102", batch) == 'cloud02'
+    assert registry['cloud02'].status == pm.status.INSTALLING
+    assert batch.flush_due() == [] and changed == []
+
+    clock.now = 2.0
+    assert batch.flush_due() == ['cloud01', 'cloud02']
+    assert pm.current_generation() == 1
+    assert batch.flush_due(idle=True) == []
+
+
+def test_local_boot_batch_skips_missing_bootconfig(trees, registry, clock, monkeypatch):
+    pxelinux_config_dir, ks_config_dir = trees
+    for n in (1, 2):
+        registry[f"cloud0{n}"] = pm.Host(f"cloud0{n}", f"11:22:33:44:55:0{n}", f"192.168.0.10{n}")
+    stage_file('pxelinux_config_dir', registry['cloud02'].macaddress_file(), "ONTIMEOUT install\n")
+    batch = pm.LocalBootBatch(window=2.0, clock=clock)
+    pm.install_host("192.168.0.101", batch)
+    pm.install_host("192.168.0.102", batch)
+
+    # cloud01 has no bootconfig file, cloud02 is still set to local boot
+    assert batch.flush() == ['cloud02']
+    assert (pxelinux_config_dir / registry['cloud02'].macaddress_file()).read_text() == "ONTIMEOUT local\n"
+    assert len(batch) == 0
+
+    # a batch that could not be published is kept
+    pm.install_host("192.168.0.102", batch)
+    def publish(key, number):
+        raise PermissionError("read only file system")
+
+    monkeypatch.setattr(pm.generation, '_publish', publish)
+    assert batch.flush_due(idle=True) == []
+    assert batch.hostnames == ['cloud02']
+
+
+def test_registration_monitor_sets_installing_hosts_local_boot_together(trees, registry):
+    pxelinux_config_dir, ks_config_dir = trees
+    for n in (1, 2):
+        registry[f"cloud0{n}"] = pm.Host(f"cloud0{n}", f"11:22:33:44:55:0{n}", f"192.168.0.10{n}")
+        stage_file('pxelinux_config_dir', registry[f"cloud0{n}"].macaddress_file(), "ONTIMEOUT install\n")
+    lines = [f"May 16 10:00:0{n} kluge in.tftpd[201]: RRQ from 192.168.0.10{n} filename initrd\n" for n in (1, 2)]
+    pm.monitor_host_registrations(iter(lines), discovery_filter=pm.DiscoveryFilter())
+
+    # the two staged bootconfigs and one change set for both hosts
+    assert pm.current_generation() == 3
+    for n in (1, 2):
+        assert (pxelinux_config_dir / registry[f"cloud0{n}"].macaddress_file()).read_text() == "ONTIMEOUT local\n"
+
+
+def test_replayed_reinstall_leaves_bootconfigs(trees, registry):
+    pxelinux_config_dir, ks_config_dir = trees
+    registry['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:01", "192.168.0.101", status=pm.status.REBOOTING)
+    stage_file('pxelinux_config_dir', registry['cloud01'].macaddress_file(), "ONTIMEOUT install\n")
+    line = "May 16 10:00:01 kluge in.tftpd[201]: RRQ from 192.168.0.101 filename initrd\n"
+    pm.monitor_host_reinstalls(iter([line]), dry_run=True)
+
+    assert registry['cloud01'].status == pm.status.INSTALLING
+    assert pm.current_generation() == 1
+    assert (pxelinux_config_dir / registry['cloud01'].macaddress_file()).read_text() == "ONTIMEOUT install\n"
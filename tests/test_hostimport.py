@@ -0,0 +1,75 @@
+import pxemanage as pm
+
+
+csv_inventory = """hostname,mac,ip,profile
+cloud01,18:03:73:C5:91:89,192.168.0.101,compute
+cloud02,18:03:73:c5:91:90,192.168.0.102,
+"""
+
+yaml_inventory = """
+cloud01:
+  macaddress: 18:03:73:c5:91:89
+  ipaddress: 192.168.0.101
+  profile: compute
+"""
+
+
+def test_read_csv_inventory(tmp_path):
+    filename = tmp_path / "rack.csv"
+    filename.write_text(csv_inventory)
+    inventory = pm.read_host_inventory(str(filename))
+    assert inventory[0] == {'hostname': 'cloud01', 'macaddress': '18:03:73:C5:91:89',
+                            'ipaddress': '192.168.0.101', 'profile': 'compute'}
+    assert inventory[1]['profile'] == ''
+
+
+def test_read_yaml_inventory(tmp_path):
+    filename = tmp_path / "rack.yml"
+    filename.write_text(yaml_inventory)
+    inventory = pm.read_host_inventory(str(filename))
+    assert inventory == [{'hostname': 'cloud01', 'macaddress': '18:03:73:c5:91:89',
+                          'ipaddress': '192.168.0.101', 'profile': 'compute'}]
+
+
+def test_validate_inventory(registry):
+    registry['host01'] = pm.Host('host01', '11:22:33:44:55:66', '192.168.0.2', 'compute')
+    inventory = [
+        {'hostname': 'cloud01', 'macaddress': '18:03:73:C5:91:89', 'ipaddress': '192.168.0.101', 'profile': 'compute'},
+        {'hostname': 'cloud02', 'macaddress': '18:03:73:c5:91:90', 'ipaddress': '192.168.0.102', 'profile': ''},
+    ]
+    new_hosts, errors = pm.validate_host_inventory(inventory)
+    assert errors == []
+    assert [host.hostname for host in new_hosts] == ['cloud01', 'cloud02']
+    assert new_hosts[0].macaddress == '18:03:73:c5:91:89'
+    assert new_hosts[1].profile == 'default'
+
+
+def test_validate_inventory_reports_all_errors(registry):
+    registry['host01'] = pm.Host('host01', '11:22:33:44:55:66', '192.168.0.2', 'compute')
+    inventory = [
+        {'hostname': 'host01', 'macaddress': '11:22:33:44:55:66', 'ipaddress': '192.168.0.2', 'profile': 'compute'},
+        {'hostname': 'cloud-02', 'macaddress': '18:03:73', 'ipaddress': '10.0.0.1', 'profile': 'nosuchprofile'},
+        {'hostname': 'cloud03', 'macaddress': '18:03:73:c5:91:91', 'ipaddress': '192.168.0.103', 'profile': 'compute'},
+        {'hostname': 'cloud03', 'macaddress': '18:03:73:c5:91:91', 'ipaddress': '192.168.0.103', 'profile': 'compute'},
+    ]
+    new_hosts, errors = pm.validate_host_inventory(inventory)
+    assert len(errors) == 10
+    assert any('already registered' in error for error in errors)
+    assert any('unknown profile nosuchprofile' in error for error in errors)
+    assert any('already assigned to host cloud03' in error for error in errors)
+
+
+def test_csv_line_with_extra_fields_is_an_error(tmp_path, registry):
+    filename = tmp_path / "rack.csv"
+    filename.write_text(csv_inventory + "cloud03,18:03:73:c5:91:91,192.168.0.103,compute,rack2\n")
+    new_hosts, errors = pm.validate_host_inventory(pm.read_host_inventory(str(filename)))
+    assert [host.hostname for host in new_hosts] == ['cloud01', 'cloud02']
+    assert errors == ["host 3 (cloud03): 1 more fields than the header: rack2"]
+
+
+def test_yaml_host_fields_not_a_mapping_is_an_error(tmp_path, registry):
+    filename = tmp_path / "rack.yml"
+    filename.write_text(yaml_inventory + 'cloud02: "18:03:73:c5:91:90"\n')
+    new_hosts, errors = pm.validate_host_inventory(pm.read_host_inventory(str(filename)))
+    assert [host.hostname for host in new_hosts] == ['cloud01']
+    assert errors == ["host 2 (cloud02): host fields are not a mapping: '18:03:73:c5:91:90'"]
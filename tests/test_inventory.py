@@ -0,0 +1,53 @@
+import configparser
+import io
+import os
+import yaml
+import pxemanage as pm
+
+
+registered = {
+    'cloud01': ("11:22:33:44:55:01", "192.168.0.101", "compute"),
+    'cloud02': ("11:22:33:44:55:02", "192.168.0.102", "compute"),
+    'store01': ("11:22:33:44:55:03", "192.168.0.103", "storage-v2"),
+}
+
+
+def test_write_inventory_formats():
+    file = io.StringIO()
+    pm.write_inventory(file, registered, "yaml")
+    inventory = yaml.safe_load(file.getvalue())
+    children = inventory['all']['children']
+    assert sorted(children) == ["compute", "storage_v2"]
+    assert children['compute']['hosts']['cloud02'] == {
+        'ansible_host': "192.168.0.102", 'macaddress': "11:22:33:44:55:02"}
+    assert children['storage_v2']['vars']['ansible_user'] == pm.settings['username']
+
+    file = io.StringIO()
+    pm.write_inventory(file, registered, "ini")
+    parser = configparser.ConfigParser(allow_no_value=True, delimiters=(" ",))
+    parser.read_string(file.getvalue())
+    assert parser['compute']['cloud01'] == "ansible_host=192.168.0.101 macaddress=11:22:33:44:55:01"
+    assert f"[storage_v2:vars]\nansible_user={pm.settings['username']}\n" in file.getvalue()
+
+
+def test_export_rewrites_changed_groups(tmp_path, monkeypatch):
+    monkeypatch.setitem(pm.settings, 'inventory_formats', ["yaml", "ini"])
+    inventory_dir = tmp_path / "inventory"
+    assert sorted(pm.export_inventory(registered)) == ["compute.ini", "compute.yml",
+                                                        "storage_v2.ini", "storage_v2.yml"]
+    assert pm.export_inventory(registered) == []
+
+    # a new compute host only changes the compute group files, the
+    # storage group files are removed with its last host
+    changed = dict(registered, cloud03=("11:22:33:44:55:04", "192.168.0.104", "compute"))
+    del changed['store01']
+    assert pm.export_inventory(changed) == ["compute.yml", "compute.ini", "storage_v2.ini", "storage_v2.yml"]
+    assert sorted(os.listdir(inventory_dir)) == ["compute.ini", "compute.yml"]
+    assert "cloud03" in yaml.safe_load((inventory_dir / "compute.yml").read_text())['all']['children']['compute']['hosts']
+
+
+def test_dynamic_inventory():
+    inventory = pm.dynamic_inventory(registered)
+    assert inventory['all']['children'] == ["compute", "storage_v2"]
+    assert inventory['compute']['hosts'] == ["cloud01", "cloud02"]
+    assert inventory['_meta']['hostvars']['store01']['ansible_host'] == "192.168.0.103"
@@ -0,0 +1,64 @@
+import pytest
+import pxemanage as pm
+
+
+def test_next_free_skips_network_and_allocated_addresses():
+    allocator = pm.IPAllocator('192.168.0.0', '255.255.255.0')
+    assert allocator.next_free() == '192.168.0.1'
+    allocator.allocate('192.168.0.1', 'host01')
+    allocator.allocate('192.168.0.2', 'host02')
+    allocator.allocate('192.168.0.4', 'host04')
+    assert allocator.next_free() == '192.168.0.3'
+    allocator.allocate('192.168.0.3', 'host03')
+    assert allocator.next_free() == '192.168.0.5'
+    # adjacent addresses are merged into a single interval
+    assert len(allocator._starts) == 1
+    assert allocator.next_free('192.168.0.250') == '192.168.0.250'
+    assert allocator.next_free('192.168.0.2', '192.168.0.4') is None
+
+
+def test_conflicts_and_reserved_ranges():
+    allocator = pm.IPAllocator('192.168.0.0', '255.255.255.0')
+    allocator.allocate('192.168.0.10', 'host10')
+    allocator.reserve('192.168.0.200', '192.168.0.254', reason="the dynamic pool")
+    allocator.reserve('8.8.8.8', reason="a dns server")
+
+    assert allocator.conflict('192.168.0.11') is None
+    assert 'host10' in allocator.conflict('192.168.0.10')
+    assert 'dynamic pool' in allocator.conflict('192.168.0.220')
+    assert 'not an assignable address' in allocator.conflict('192.168.0.255')
+    assert 'not an assignable address' in allocator.conflict('10.0.0.1')
+    assert 'not a valid ip address' in allocator.conflict('192.168.0')
+    assert allocator.next_free('192.168.0.199') == '192.168.0.199'
+    assert allocator.next_free('192.168.0.200') is None
+
+
+def test_release_splits_interval():
+    allocator = pm.IPAllocator('10.1.0.0', '255.255.0.0')
+    for n in range(1, 1001):
+        allocator.allocate(f"10.1.{n // 256}.{n % 256}", f"host{n}")
+    assert len(allocator._starts) == 1
+    allocator.release('10.1.1.44')
+    assert len(allocator._starts) == 2
+    assert allocator.next_free() == '10.1.1.44'
+    assert allocator.conflict('10.1.1.44') is None
+
+
+def test_build_ip_allocator_from_registry(registry):
+    registry['host01'] = pm.Host('host01', '11:22:33:44:55:66', '192.168.0.2', 'compute')
+    registry['host02'] = pm.Host('host02', '66:55:44:33:22:11', '192.168.0.2', 'compute')
+    allocator = pm.build_ip_allocator()
+    assert 'host01' in allocator.conflict('192.168.0.2')
+    assert 'gateway' in allocator.conflict(pm.settings['gateway_ip'])
+    assert 'apache' in allocator.conflict(pm.settings['apache_server_ip'])
+    assert allocator.next_free() == '192.168.0.3'
+
+
+def test_multiple_subnets():
+    allocator = pm.IPAllocator('192.168.0.0', '255.255.255.0')
+    allocator.add_subnet('192.168.2.0', '255.255.255.0')
+    assert allocator.in_subnet('192.168.2.10') and not allocator.in_subnet('192.168.1.10')
+    allocator.reserve('192.168.0.1', '192.168.0.254')
+    assert allocator.next_free() == '192.168.2.1'
+    with pytest.raises(ValueError):
+        allocator.add_subnet('192.168.2.128', '255.255.255.128')
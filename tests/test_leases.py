@@ -0,0 +1,77 @@
+import os
+import pytest
+import pxemanage as pm
+
+
+def lease_block(ipaddress, macaddress, starts, vendor_class=None):
+    lines = [f"lease {ipaddress} {{\n",
+             f"  starts 3 {starts};\n",
+             "  ends 3 2026/10/14 23:59:59;\n",
+             f"  cltt 3 {starts};\n",
+             "  binding state active;\n",
+             f"  hardware ethernet {macaddress};\n"]
+    if vendor_class:
+        lines.append(f'  set vendor-class-identifier = "{vendor_class}";\n')
+    lines.append("}\n")
+    return "".join(lines)
+
+
+@pytest.fixture
+def leases(tmp_path, monkeypatch):
+    leases_file = tmp_path / "dhcpd.leases"
+    leases_file.write_text("# The format of this file is documented in the dhcpd.leases(5) manual page.\n"
+                           'server-duid "\\000\\001";\n\n'
+                           + lease_block("192.168.0.150", "11:22:33:44:55:01", "2026/10/14 10:00:00", "PXEClient:Arch:00000")
+                           + lease_block("192.168.0.151", "11:22:33:44:55:02", "2026/10/14 10:05:00"))
+    monkeypatch.setitem(pm.settings, 'dhcpd_leases_file', str(leases_file))
+    monkeypatch.setitem(pm.settings, 'lease_index_file', str(tmp_path / "state" / "leases.json"))
+    return leases_file
+
+
+def test_incremental_update(leases, registry):
+    index = pm.update_lease_index()
+    assert len(index) == 2
+    record = index.records["11:22:33:44:55:01"]
+    assert (record.ipaddress, record.vendor_class) == ("192.168.0.150", "PXEClient:Arch:00000")
+
+    # only the appended blocks are read, a block still being written is
+    # left for the next update
+    block = lease_block("192.168.0.160", "11:22:33:44:55:01", "2026/10/14 11:00:00")
+    with open(leases, "a") as file:
+        file.write(lease_block("192.168.0.152", "11:22:33:44:55:03", "2026/10/14 10:30:00") + block[:40])
+    index = pm.LeaseIndex.load()
+    assert index.update() == 1
+    index.save()
+    with open(leases, "a") as file:
+        file.write(block[40:])
+    index = pm.update_lease_index()
+    assert len(index) == 3
+    record = index.records["11:22:33:44:55:01"]
+    assert record.ipaddress == "192.168.0.160"
+    assert record.last_seen - record.first_seen == 3600
+    assert record.vendor_class == "PXEClient:Arch:00000"
+
+    registry['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:01", "192.168.0.101")
+    assert [record.macaddress for record in index.unregistered()] == ["11:22:33:44:55:03", "11:22:33:44:55:02"]
+
+
+def test_rewritten_journal_keeps_first_seen(leases):
+    first_seen = pm.update_lease_index().records["11:22:33:44:55:01"].first_seen
+
+    # dhcpd writes a new journal with only the current leases
+    rewritten = leases.with_suffix(".new")
+    rewritten.write_text(lease_block("192.168.0.150", "11:22:33:44:55:01", "2026/10/15 09:00:00"))
+    os.replace(rewritten, leases)
+    record = pm.update_lease_index().records["11:22:33:44:55:01"]
+    assert record.first_seen == first_seen
+    assert record.last_seen > first_seen
+
+
+def test_register_leased_hosts(leases, registry, monkeypatch):
+    batches = []
+    monkeypatch.setattr(pm, 'register_host_batch', batches.append)
+    autoregistration = pm.AutoRegistration("cloud{n:02d}", "192.168.0.101-192.168.0.110")
+    discovery_filter = pm.DiscoveryFilter(ignore=["11:22:33:44:55:02"])
+    hosts = pm.register_leased_hosts(autoregistration, discovery_filter)
+    assert [(host.hostname, host.macaddress) for host in hosts] == [("cloud01", "11:22:33:44:55:01")]
+    assert len(batches) == 1
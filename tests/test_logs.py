@@ -0,0 +1,47 @@
+import io
+import json
+import logging
+import pytest
+import pxemanage as pm
+
+
+@pytest.fixture
+def log_stream():
+    """Send the pxemanage log to a string stream, restoring the logger
+    afterwards.
+    """
+    logger = pm.package_logger
+    saved = (list(logger.handlers), logger.level, logger.propagate)
+    stream = io.StringIO()
+    yield stream
+    logger.handlers[:] = saved[0]
+    logger.setLevel(saved[1])
+    logger.propagate = saved[2]
+
+
+def test_levels(log_stream, registry):
+    pm.hosts['cloud01'] = pm.Host('cloud01', "11:22:33:44:55:66", "192.168.0.101")
+    pm.setup_logging(0, stream=log_stream)
+    pm.report_registered_hosts("Read Host Registration")
+    assert log_stream.getvalue() == "======== Read Host Registration ========\n    -------- 1 registered hosts\n"
+
+    # every host is only listed with debug logging
+    pm.setup_logging(1, stream=log_stream)
+    pm.report_registered_hosts("Read Host Registration")
+    assert "cloud01" in log_stream.getvalue()
+
+    pm.setup_logging(-1, stream=log_stream)
+    logging.getLogger("pxemanage.db").info("not shown")
+    assert "not shown" not in log_stream.getvalue()
+
+
+def test_json_lines(log_stream):
+    pm.setup_logging(0, json_lines=True, stream=log_stream)
+    logging.getLogger("pxemanage.register").warning(
+        "    WARNING: host at %s appears to be boot autoinstalling but it is not registered", "192.168.0.7",
+        extra={'ipaddress': "192.168.0.7"})
+    entry = json.loads(log_stream.getvalue())
+    assert entry['level'] == "warning"
+    assert entry['logger'] == "pxemanage.register"
+    assert entry['message'] == "WARNING: host at 192.168.0.7 appears to be boot autoinstalling but it is not registered"
+    assert entry['ipaddress'] == "192.168.0.7"
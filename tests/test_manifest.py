@@ -0,0 +1,79 @@
+import shutil
+import pytest
+from jinja2 import Environment, FileSystemLoader
+import pxemanage as pm
+
+
+@pytest.fixture
+def artifacts(tmp_path, monkeypatch, registry):
+    templates = tmp_path / "templates"
+    shutil.copytree("templates", templates)
+    monkeypatch.setattr(pm, 'j2', Environment(loader=FileSystemLoader(str(templates))))
+    key_file = tmp_path / "management.key.pub"
+    key_file.write_text("ssh-ed25519 AAAA manager\n")
+    monkeypatch.setitem(pm.settings, 'ansible_manager_key', str(key_file))
+    monkeypatch.setitem(pm.settings, 'pxelinux_config_dir', str(tmp_path / "tftp" / "pxelinux.cfg"))
+    monkeypatch.setitem(pm.settings, 'ks_config_dir', str(tmp_path / "html" / "ks"))
+    (tmp_path / "tftp" / "pxelinux.cfg").mkdir(parents=True)
+    (tmp_path / "html" / "ks").mkdir(parents=True)
+    monkeypatch.setattr(pm, 'chown_kickstart_files', lambda hostnames: None)
+    monkeypatch.setattr(pm, 'update_host_registration', lambda: None)
+    monkeypatch.setattr(pm, 'restart_dhcpd_service', lambda: None)
+
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:01', '192.168.0.101', 'compute')
+    registry['cloud02'] = pm.Host('cloud02', '11:22:33:44:55:02', '192.168.0.102', 'manager')
+    with pm.staged_generation():
+        for hostname in registry:
+            pm.create_bootconfig_file(hostname)
+            pm.create_kickstart_file(hostname, chown=False)
+    pm.record_artifact('registration', *pm.registration_inputs())
+    return templates
+
+
+def stale_keys():
+    return [key for key, reason in pm.stale_artifacts()]
+
+
+def test_fresh_artifacts_are_not_stale(artifacts):
+    assert stale_keys() == []
+
+
+def test_profile_template_change(artifacts):
+    user_data = artifacts / "profiles" / "compute" / "user-data.j2"
+    user_data.write_text(user_data.read_text() + "# changed\n")
+    assert pm.stale_artifacts() == [('kickstart/cloud01', "template profiles/compute/user-data.j2 changed")]
+
+    pm.sync_artifacts()
+    assert stale_keys() == []
+    assert open(f"{pm.settings['ks_config_dir']}/cloud01/user-data").read().endswith("# changed")
+
+
+def test_host_input_change(artifacts):
+    pm.hosts['cloud02'].ipaddress = '192.168.0.112'
+    assert stale_keys() == ['kickstart/cloud02', 'registration']
+
+
+def test_rebuild_keeps_boot_default(artifacts):
+    pm.set_host_local_boot('cloud01')
+    pxeboot = artifacts / "pxeboot.cfg.j2"
+    pxeboot.write_text(pxeboot.read_text().replace("timeout 20", "timeout 10"))
+    assert stale_keys() == ['bootconfig/cloud01', 'bootconfig/cloud02']
+
+    pm.sync_artifacts()
+    content = open(f"{pm.settings['pxelinux_config_dir']}/01-11-22-33-44-55-01").read()
+    assert content.startswith("ONTIMEOUT local\ntimeout 10")
+
+
+def test_ipxe_boot_mode(artifacts, monkeypatch):
+    monkeypatch.setitem(pm.settings, 'boot_mode', "ipxe")
+    assert stale_keys() == ['bootconfig/cloud01', 'bootconfig/cloud02', 'registration']
+
+    pm.sync_artifacts()
+    script = f"{pm.settings['pxelinux_config_dir']}/01-11-22-33-44-55-01"
+    content = open(script).read()
+    assert content.startswith("#!ipxe") and "set boot install\n" in content
+    assert f"initrd http://{pm.settings['apache_server_ip']}/images/{pm.settings['ipxe_initrd']} initrd" in content
+
+    pm.set_host_local_boot('cloud01')
+    assert "set boot local\n" in open(script).read()
+    assert pm.host_boot_default(pm.hosts['cloud01']) == "local"
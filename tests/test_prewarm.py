@@ -0,0 +1,26 @@
+import os
+import pxemanage as pm
+
+
+def test_prewarm_files(tmp_path, monkeypatch):
+    monkeypatch.setitem(pm.settings, 'images_dir', str(tmp_path / "images"))
+    monkeypatch.setitem(pm.settings, 'tftp_root_dir', str(tmp_path / "tftp"))
+    monkeypatch.setitem(pm.settings, 'iso_image_name', "ubuntu/server.iso")
+    os.makedirs(tmp_path / "images" / "ubuntu")
+    os.makedirs(tmp_path / "tftp")
+    (tmp_path / "images" / "ubuntu" / "server.iso").write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    (tmp_path / "tftp" / "vmlinuz").write_bytes(b"")
+
+    # the missing initrd is skipped
+    reports = pm.prewarm_files()
+    assert [os.path.basename(report.filename) for report in reports] == ["server.iso", "vmlinuz"]
+    assert reports[0].size == 3 * 1024 * 1024 + 17
+    assert reports[0].resident_after == 1.0
+    assert reports[1].resident_after == 1.0
+
+
+def test_start_prewarm(tmp_path):
+    filename = tmp_path / "initrd"
+    filename.write_bytes(b"initrd" * 1000)
+    pm.start_prewarm([str(filename)]).join()
+    assert pm.file_residency(str(filename)) == 1.0
@@ -0,0 +1,66 @@
+import asyncio
+import pxemanage as pm
+
+
+def test_hosts_become_running_when_ssh_answers(registry):
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:01', '127.0.0.1', 'compute', pm.status.INSTALLING)
+    registry['cloud02'] = pm.Host('cloud02', '11:22:33:44:55:02', '127.0.0.2', 'compute', pm.status.INSTALLING)
+    probes = []
+
+    async def run():
+        async def sshd(reader, writer):
+            writer.write(b"SSH-2.0-OpenSSH_8.9p1 Ubuntu-3\r\n")
+            await writer.drain()
+            writer.close()
+
+        # cloud01 answers once its ssh server starts, after a few probes,
+        # cloud02 never answers
+        prober = pm.ReadinessProber(timeout=0.5, initial_backoff=0.01, max_backoff=0.05, connect_timeout=0.2)
+        probe = prober.probe
+
+        async def counting_probe(ipaddress):
+            probes.append(ipaddress)
+            if ipaddress == '127.0.0.1' and probes.count(ipaddress) == 3:
+                server = await asyncio.start_server(sshd, '127.0.0.1', 0)
+                prober.port = server.sockets[0].getsockname()[1]
+            return await probe(ipaddress)
+
+        async def login(host):
+            return host.hostname
+
+        prober.port = 1
+        prober.probe = counting_probe
+        prober.login = login
+        await prober.wait_all_ready(['cloud01', 'cloud02'])
+        return prober
+
+    prober = asyncio.run(run())
+    assert registry['cloud01'].status == pm.status.RUNNING
+    assert registry['cloud02'].status == pm.status.INSTALLING
+    assert prober.results['cloud01'] is not None and prober.results['cloud02'] is None
+    assert probes.count('127.0.0.1') == 3
+
+
+def test_installer_sshd_is_not_ready(registry):
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:01', '127.0.0.1', 'compute', pm.status.INSTALLING)
+    logins = []
+
+    async def run():
+        prober = pm.ReadinessProber(timeout=0.3, initial_backoff=0.01, max_backoff=0.05)
+
+        async def probe(ipaddress):
+            return "SSH-2.0-OpenSSH_8.9p1 Ubuntu-3"
+
+        # the installer sshd answers but does not let us log in, then the
+        # installed system answers as another host until its hostname is set
+        async def login(host):
+            logins.append(host.hostname)
+            return {1: None, 2: "ubuntu-server"}.get(len(logins), "cloud01.cluster")
+
+        prober.probe = probe
+        prober.login = login
+        return await prober.wait_ready('cloud01')
+
+    assert asyncio.run(run())
+    assert len(logins) == 3
+    assert registry['cloud01'].status == pm.status.RUNNING
@@ -0,0 +1,123 @@
+import fcntl
+import subprocess
+import threading
+import pytest
+import pxemanage as pm
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch, registry):
+    monkeypatch.setitem(pm.settings, 'registration_file', str(tmp_path / "dhcpd.conf"))
+    monkeypatch.setitem(pm.settings, 'registration_shard_dir', str(tmp_path / "pxemanage.d"))
+    monkeypatch.setitem(pm.settings, 'registration_shard_state', str(tmp_path / "dhcpd-shards.yml"))
+    monkeypatch.setitem(pm.settings, 'subnets', [
+        {'name': "rack2", 'subnet': "192.168.2.0", 'netmask': "255.255.255.0", 'gateway_ip': "192.168.2.1"},
+    ])
+    # install the files without root
+    run = subprocess.run
+    monkeypatch.setattr(pm.db.subprocess, 'run',
+                        lambda command, **kwargs: run(command.replace("sudo ", ""), **kwargs))
+    registry['cloud01'] = pm.Host('cloud01', '11:22:33:44:55:01', '192.168.0.101', 'compute')
+    registry['cloud02'] = pm.Host('cloud02', '11:22:33:44:55:02', '192.168.2.102', 'compute')
+    return tmp_path
+
+
+def test_group_hosts_by_subnet(shards):
+    pm.hosts['stray'] = pm.Host('stray', '11:22:33:44:55:03', '10.0.0.3', 'default')
+    groups = pm.group_hosts_by_subnet(pm.configured_subnets())
+    assert {name: [host.hostname for host in hosts] for name, hosts in groups.items()} == {
+        'default': ['cloud01'], 'rack2': ['cloud02'], 'unassigned': ['stray']}
+
+
+def test_only_changed_shards_are_rewritten(shards):
+    assert pm.update_host_registration() == ['default', 'rack2', 'unassigned']
+    assert pm.update_host_registration() == []
+
+    pm.hosts['cloud03'] = pm.Host('cloud03', '11:22:33:44:55:04', '192.168.2.103', 'compute')
+    assert pm.update_host_registration() == ['rack2']
+    rack2 = (shards / "pxemanage.d" / "rack2.conf").read_text()
+    assert "option routers 192.168.2.1;" in rack2 and "cloud03" in rack2
+    assert "cloud03:" in (shards / "inventory" / "compute.yml").read_text()
+
+
+def test_load_follows_shard_includes(shards):
+    pm.update_host_registration()
+    saved = {hostname: pm.hosts[hostname] for hostname in pm.hosts}
+    pm.hosts.clear()
+    pm.load_host_registration()
+    assert pm.hosts == saved
+
+
+def in_other_process(change):
+    """Run change as if another process had loaded the registration at
+    the same time as us, and updated it first.
+    """
+    ours = dict(pm.hosts)
+    version, base = pm.db.registry_version, pm.db._registry_base
+    change(pm.hosts)
+    pm.update_host_registration()
+    pm.hosts.clear()
+    pm.hosts.update(ours)
+    pm.db.registry_version, pm.db._registry_base = version, base
+
+
+def test_concurrent_updates_are_merged(shards):
+    pm.update_host_registration()
+    in_other_process(lambda hosts: hosts.update(
+        cloud03=pm.Host('cloud03', '11:22:33:44:55:03', '192.168.2.103', 'compute')))
+
+    pm.hosts['cloud04'] = pm.Host('cloud04', '11:22:33:44:55:04', '192.168.2.104', 'compute')
+    pm.update_host_registration()
+    assert sorted(pm.hosts) == ['cloud01', 'cloud02', 'cloud03', 'cloud04']
+    parsed_hosts, version = pm.parse_host_registration(pm.settings['registration_file'])
+    assert sorted(parsed_hosts) == sorted(pm.hosts) and version == 3
+
+
+def test_conflicting_updates_raise(shards):
+    pm.update_host_registration()
+    in_other_process(lambda hosts: hosts.update(
+        cloud03=pm.Host('cloud03', '11:22:33:44:55:03', '192.168.2.103', 'compute')))
+
+    pm.hosts['cloud05'] = pm.Host('cloud05', '11:22:33:44:55:05', '192.168.2.103', 'compute')
+    with pytest.raises(pm.RegistryConflict, match="same ipaddress"):
+        pm.update_host_registration()
+    assert 'cloud03' not in pm.hosts
+
+
+def test_registry_lock_excludes_other_processes(shards):
+    with pm.registry_lock(), pm.registry_lock():
+        with open(pm.settings['registry_lock_file']) as other:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    with open(pm.settings['registry_lock_file']) as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_ipxe_chainload(shards, monkeypatch):
+    pm.update_host_registration()
+    monkeypatch.setitem(pm.settings, 'boot_mode', "ipxe")
+    assert pm.update_host_registration() == ['default', 'rack2', 'unassigned']
+    shard = (shards / "pxemanage.d" / "default.conf").read_text()
+    assert 'option user-class = "iPXE"' in shard
+    assert f'filename "http://{pm.settings["apache_server_ip"]}/pxelinux.cfg/01-11-22-33-44-55-01";' in shard
+    assert f'filename "{pm.settings["ipxe_filename"]}";' in shard
+
+    # the registry is still read back from the shards
+    pm.hosts.clear()
+    pm.load_host_registration()
+    assert pm.hosts['cloud01'].ipaddress == '192.168.0.101'
+
+
+def test_registry_lock_excludes_other_threads(shards):
+    entered = threading.Event()
+
+    def other_thread():
+        with pm.registry_lock():
+            entered.set()
+
+    with pm.registry_lock():
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        assert not entered.wait(0.2)
+    thread.join(5)
+    assert entered.is_set()
@@ -0,0 +1,71 @@
+import threading
+import pytest
+import pxemanage as pm
+
+
+class FakeSystemctl:
+    """Record systemctl commands, with services active once started."""
+    def __init__(self):
+        self.commands = []
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, *args):
+        if args[0] == "is-active":
+            return 0 if args[-1] in self.active else 3
+        with self.lock:
+            self.commands.append(args)
+        if args[0] == "stop":
+            self.active.discard(args[-1])
+        else:
+            self.active.add(args[-1])
+        return 0
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    config_file = tmp_path / "dhcpd.conf"
+    config_file.write_text("subnet\n")
+    (tmp_path / "apache2").mkdir()
+    (tmp_path / "apache2" / "apache2.conf").write_text("Listen 80\n")
+    monkeypatch.setitem(pm.settings, 'service_state_file', str(tmp_path / "services.yml"))
+    monkeypatch.setitem(pm.settings, 'service_config_files', {
+        'isc-dhcp-server': [str(config_file)],
+        'apache2': [str(tmp_path / "apache2")],
+    })
+    monkeypatch.setitem(pm.settings, 'reloadable_services', ['apache2'])
+    return pm.ServiceController(run=FakeSystemctl(), window=0.2)
+
+
+def test_start_only_when_changed(controller, tmp_path):
+    services = ['isc-dhcp-server', 'tftpd-hpa', 'apache2']
+    assert controller.start_all(services) == {
+        'isc-dhcp-server': "restart", 'tftpd-hpa': "restart", 'apache2': "restart"}
+
+    # running services with unchanged configuration are left alone
+    assert set(controller.start_all(services).values()) == {"unchanged"}
+
+    (tmp_path / "dhcpd.conf").write_text("subnet\nhost\n")
+    (tmp_path / "apache2" / "apache2.conf").write_text("Listen 8080\n")
+    assert controller.start_all(services) == {
+        'isc-dhcp-server': "restart", 'tftpd-hpa': "unchanged", 'apache2': "reload"}
+
+    # stopped services are restarted even if unchanged
+    controller.stop_all(services)
+    assert set(controller.start_all(services).values()) == {"restart"}
+
+
+def test_restarts_coalesced(controller, tmp_path):
+    controller.run.active.add('isc-dhcp-server')
+    for n in range(30):
+        (tmp_path / "dhcpd.conf").write_text(f"host{n}\n")
+        controller.request_restart('isc-dhcp-server')
+    assert controller.run.commands == []
+    controller.flush()
+    assert controller.run.commands == [("restart", 'isc-dhcp-server')]
+
+    # the timer carries out the request after the window
+    (tmp_path / "dhcpd.conf").write_text("host30\n")
+    controller.request_restart('isc-dhcp-server')
+    controller.pending['isc-dhcp-server'].join()
+    assert controller.run.commands == [("restart", 'isc-dhcp-server')] * 2
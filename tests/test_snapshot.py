@@ -0,0 +1,65 @@
+import os
+import pytest
+import pxemanage as pm
+
+
+def write_registration(tmp_path, hosts):
+    """Write a registration file including a shard with the given
+    (hostname, macaddress, ipaddress, profile) hosts.
+    """
+    shard = tmp_path / "default.conf"
+    shard.write_text("".join(
+        f"host {hostname} {{\n"
+        f"    hardware ethernet {macaddress};\n"
+        f"    fixed-address {ipaddress};\n"
+        f"    # cloudstack profile {profile};\n"
+        "}\n"
+        for hostname, macaddress, ipaddress, profile in hosts))
+    registration = tmp_path / "dhcpd.conf"
+    registration.write_text(f"# pxemanage registry version 3\ninclude \"{shard}\";\n")
+    return registration, shard
+
+
+@pytest.fixture
+def snapshot_files(tmp_path, monkeypatch):
+    registration, shard = write_registration(tmp_path, [
+        ("cloud01", "11:22:33:44:55:01", "192.168.0.101", "compute"),
+        ("cloud02", "11:22:33:44:55:02", "192.168.0.102", "compute"),
+        ("store01", "11:22:33:44:55:03", "192.168.0.103", "storage"),
+    ])
+    monkeypatch.setitem(pm.settings, 'registration_file', str(registration))
+    monkeypatch.setitem(pm.settings, 'registry_snapshot_file', str(tmp_path / "registry.snapshot"))
+    return registration, shard
+
+
+def test_query_registry(snapshot_files):
+    assert pm.query_registry(["cloud02"]) == [{
+        'hostname': "cloud02", 'macaddress': "11:22:33:44:55:02",
+        'ipaddress': "192.168.0.102", 'profile': "compute"}]
+    assert [record['hostname'] for record in pm.query_registry(["11:22:33:44:55:03"])] == ["store01"]
+    assert [record['hostname'] for record in pm.query_registry(["192.168.0.101", "cloud*"])] == ["cloud01", "cloud02"]
+    assert [record['hostname'] for record in pm.query_registry(profile="compute")] == ["cloud01", "cloud02"]
+    assert pm.query_registry(["cloud99"]) == []
+    assert pm.load_registry_snapshot()['version'] == 3
+
+
+def test_snapshot_answers_without_parsing(snapshot_files, monkeypatch):
+    registration, shard = snapshot_files
+    pm.query_registry()
+
+    def parse_host_registration(filename, sources=None):
+        raise AssertionError("registration parsed")
+    monkeypatch.setattr(pm, 'parse_host_registration', parse_host_registration)
+    assert len(pm.query_registry()) == 3
+
+    # touching a file without changing it keeps the snapshot
+    info = os.stat(shard)
+    os.utime(shard, ns=(info.st_atime_ns, info.st_mtime_ns + 1000000000))
+    assert len(pm.query_registry()) == 3
+
+
+def test_snapshot_rebuilt_when_shard_changes(snapshot_files, tmp_path):
+    assert len(pm.query_registry()) == 3
+    write_registration(tmp_path, [("cloud01", "11:22:33:44:55:01", "192.168.0.201", "compute")])
+    assert pm.query_registry(["cloud01"], "compute")[0]['ipaddress'] == "192.168.0.201"
+    assert pm.query_registry(["cloud02"]) == []
@@ -0,0 +1,56 @@
+import pxemanage as pm
+
+
+def reinstall(registry, clock, hostnames, backend):
+    for hostname in hostnames:
+        registry[hostname] = pm.Host(hostname, f"11:22:33:44:55:{len(registry):02d}",
+                                     f"192.168.0.{100 + len(registry)}", 'compute')
+    watchdog = pm.InstallWatchdog(backend, timeout=600, max_attempts=3, clock=clock)
+    pm.reboot_hosts(hostnames, backend, watchdog)
+    return watchdog
+
+
+def test_hosts_that_install_are_not_retried(registry, clock):
+    backend = pm.MockPower()
+    watchdog = reinstall(registry, clock, ['cloud01', 'cloud02'], backend)
+    registry['cloud01'].status = pm.status.INSTALLING
+    clock.now = 601
+    assert watchdog.check() == ['cloud02']
+    assert backend.calls == ['cloud01', 'cloud02']
+    assert watchdog.retry(['cloud02']) == ['cloud02']
+    assert backend.calls == ['cloud01', 'cloud02', 'cloud02']
+    assert watchdog.next_deadline() == 600
+
+
+def test_give_up_after_max_attempts(registry, clock):
+    backend = pm.MockPower(succeed=False)
+    watchdog = reinstall(registry, clock, ['cloud01'], backend)
+    assert registry['cloud01'].status == pm.status.REBOOTING
+    for attempt in range(3):
+        clock.now += 601
+        watchdog.retry(watchdog.check())
+    assert backend.calls == ['cloud01'] * 3
+    assert registry['cloud01'].status == pm.status.FAILED
+    assert watchdog.failed == ['cloud01'] and watchdog.next_deadline() is None
+    assert pm.all_hosts_installed()
+
+
+def test_retry_that_boots_the_host(registry, clock):
+    backend = pm.MockPower(on_power_cycle=lambda host: None)
+    watchdog = reinstall(registry, clock, ['cloud01'], backend)
+    backend.on_power_cycle = lambda host: setattr(host, 'status', pm.status.INSTALLING)
+    clock.now = 601
+    watchdog.retry(watchdog.check())
+    clock.now = 1202
+    assert watchdog.check() == []
+    assert registry['cloud01'].status == pm.status.INSTALLING and not watchdog.failed
+
+
+def test_retry_skips_hosts_that_installed_since_the_check(registry, clock):
+    backend = pm.MockPower()
+    watchdog = reinstall(registry, clock, ['cloud01'], backend)
+    clock.now = 601
+    due = watchdog.check()
+    registry['cloud01'].status = pm.status.INSTALLING
+    assert watchdog.retry(due) == []
+    assert backend.calls == ['cloud01'] and watchdog.next_deadline() is None
@@ -17,7 +17,11 @@ import signal
 import sys
 # load pxemanage routines into local namespace
 from pxemanage import \
+    add_logging_arguments, \
+    call_daemon, \
+    daemon_running, \
     load_host_registration, \
+    setup_script_logging, \
     unregister_hosts
 
 
@@ -36,6 +40,42 @@ practice to attempt to vacate virtual instances from hosts before
 rebooting and reinstalling them.  """
 
 
+def unregister_daemon_hosts(args):
+    """Unregister hosts through the running pxemanaged daemon.  The
+    daemon is asked for a dry run first, so the operator can confirm
+    the hosts that will be removed.
+
+    Parameters
+    ----------
+    args - the parsed command line arguments.
+    """
+    selection = dict(hostnames=args.hostname,
+                     unregister_all=args.all_unregister,
+                     profile=args.profile,
+                     name_glob=args.name,
+                     name_regex=args.regex,
+                     ip_range=args.ip_range)
+    hostnames = call_daemon('unregister', dry_run=True, **selection)
+    if not hostnames:
+        print("---- No valid hosts were specified to unregister")
+        return
+    print("---- The following are the list of hosts till will be removed from management:")
+    print("")
+    print(" ".join(hostnames))
+    print("")
+    if args.dry_run:
+        return
+
+    yes_answers = ['y', 'Y', 'yes', 'Yes', 'YES']
+    answer = input("Do you wish to unregister these hosts (y/n)? ")
+    if not answer in yes_answers:
+        print("aborting unregistration")
+        return
+    # unregister exactly the hosts that were confirmed
+    hostnames = call_daemon('unregister', hostnames=hostnames)
+    print(f"---- unregistered {len(hostnames)} hosts")
+
+
 def main():
     """Script main function.
     """
@@ -46,13 +86,37 @@ def main():
                         help='flag if set all hosts will be unregistered, this is of course dangerous')
     parser.add_argument('hostname', type=str, nargs='*',
                         help='one or more hosts to attempt to reboot and reinstall')
+    parser.add_argument('--profile', type=str,
+                        help='unregister hosts installed with this profile')
+    parser.add_argument('--name', metavar='GLOB', type=str,
+                        help="unregister hosts whose name matches this pattern, e.g. 'cloud1*'")
+    parser.add_argument('--regex', type=str,
+                        help='unregister hosts whose name matches this regular expression')
+    parser.add_argument('--ip-range', metavar='FIRST-LAST', type=str,
+                        help='unregister hosts whose ip address is in this range')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only show the hosts and files that would be removed')
+    add_logging_arguments(parser)
     args = parser.parse_args()
+    setup_script_logging(args)
+
+    # the daemon holds the registry when it is running, we only act as
+    # its client
+    if daemon_running():
+        unregister_daemon_hosts(args)
+        return
     
     # 1. read in and determine database of currently registered hosts
     load_host_registration()
 
-    # 2. unregister all indicated hosts
-    unregister_hosts(args.all_unregister, args.hostname)
+    # 2. unregister all indicated hosts, hosts matching all of the given
+    #    selection options are unregistered along with the named hosts
+    unregister_hosts(args.all_unregister, args.hostname,
+                     profile=args.profile,
+                     name_glob=args.name,
+                     name_regex=args.regex,
+                     ip_range=args.ip_range,
+                     dry_run=args.dry_run)
 
 
 if __name__ == "__main__":
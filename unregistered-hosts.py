@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+"""This script is a command line tool that reports the machines that
+have been given a dhcp lease but are not registered, from the index of
+the dhcpd lease journal (dhcpd.leases).  Only the leases added to the
+journal since the last run are parsed.  No services or root
+configuration files are changed.
+"""
+import argparse
+import csv
+import sys
+import time
+# load pxemanage routines into local namespace
+from pxemanage import \
+    add_logging_arguments, \
+    load_host_registration, \
+    setup_script_logging, \
+    update_lease_index
+
+
+usage_msg = """List the mac addresses that dhcpd has handed a lease to and
+that are not registered, most recently seen first, with their last
+ip address, when they were first and last seen, their vendor class and
+the hostname they sent.  Use register-hosts --auto with --from-leases
+to register them.
+"""
+
+fields = ['macaddress', 'ipaddress', 'first_seen', 'last_seen', 'vendor_class', 'client_hostname']
+
+
+def format_time(seconds):
+    """Format a lease time for the report."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+
+
+def main():
+    """Script main function.
+    """
+    # 0. parse command line arguments.
+    parser = argparse.ArgumentParser(prog='unregistered-hosts', description=usage_msg)
+    parser.add_argument('--vendor', metavar='PREFIX', type=str,
+                        help="only machines whose vendor class starts with PREFIX, e.g. 'PXEClient'")
+    parser.add_argument('--since', metavar='HOURS', type=float,
+                        help='only machines seen within this many hours')
+    parser.add_argument('--csv', action='store_true',
+                        help='print the machines as csv with a header line')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_script_logging(args)
+
+    # 1. read in and determine database of currently registered hosts,
+    #    and bring the lease index up to date
+    load_host_registration()
+    index = update_lease_index()
+
+    # 2. select the unregistered machines
+    records = index.unregistered()
+    if args.vendor:
+        records = [record for record in records if (record.vendor_class or "").startswith(args.vendor)]
+    if args.since:
+        oldest = time.time() - args.since * 3600
+        records = [record for record in records if record.last_seen >= oldest]
+
+    # 3. report them
+    if args.csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow([record.macaddress, record.ipaddress, format_time(record.first_seen),
+                             format_time(record.last_seen), record.vendor_class or "", record.client_hostname or ""])
+    else:
+        for record in records:
+            print(f"{record.macaddress}  {record.ipaddress:15}  {format_time(record.first_seen)}  "
+                  f"{format_time(record.last_seen)}  {record.vendor_class or '-'}  {record.client_hostname or '-'}")
+    sys.exit(0 if records else 1)
+
+
+if __name__ == "__main__":
+    main()